@@ -0,0 +1,294 @@
+""" Statistical emulator of the model response to the calibration
+parameters (t*, prcp_fac, A factor), trained on the results of the
+existing parameter sweeps.
+
+The outputs (e.g. the length time series of `data/length_t_star.csv` or
+the skill scores of `data/length_corr_t_star/`) are reduced by a principal
+component analysis, and every principal component is emulated by a
+Gaussian process. Predictions for unseen parameter combinations (with
+uncertainty) cost a few matrix products instead of a full model run.
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from scipy import linalg
+
+import skill
+
+# names of the calibration parameters
+PARAMS = ['t_star', 'prcp_fac', 'glen_a_fac']
+
+# candidate length scales of the Gaussian processes (normalized parameters)
+LENGTH_SCALES = np.logspace(-1.5, 0.5, 15)
+
+
+class GaussianProcess(object):
+    """ Gaussian process regression with a squared exponential kernel, for
+    one single (centered) output. The length scale is chosen from the given
+    candidates by maximizing the log marginal likelihood.
+    """
+
+    def __init__(self, length_scales=LENGTH_SCALES, noise=1e-4):
+        """ Initializes the Gaussian process.
+
+        :param length_scales: (float array like, optional) candidate
+            length scales of the kernel
+        :param noise: (float, optional) noise variance, relative to the
+            signal variance
+        """
+        self.length_scales = np.atleast_1d(length_scales)
+        self.noise = noise
+
+    @staticmethod
+    def _sq_dist(a, b):
+        return ((a[:, np.newaxis, :] - b[np.newaxis, :, :]) ** 2).sum(axis=-1)
+
+    def _kernel(self, d2):
+        return self.variance * np.exp(-0.5 * d2 / self.length_scale ** 2)
+
+    def fit(self, x, y):
+        """ Fits the Gaussian process.
+
+        :param x: (2-D array) normalized parameters, samples x parameters
+        :param y: (1-D array) centered output, one value per sample
+        :return: the fitted Gaussian process
+        """
+        self.x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n = y.size
+        self.variance = y.var() if y.var() > 0 else 1.
+        best = -np.inf
+        d2 = self._sq_dist(self.x, self.x)
+        for length_scale in self.length_scales:
+            self.length_scale = length_scale
+            k = self._kernel(d2)
+            k[np.diag_indices(n)] += self.noise * self.variance
+            try:
+                chol = linalg.cholesky(k, lower=True)
+            except linalg.LinAlgError:
+                continue
+            alpha = linalg.cho_solve((chol, True), y)
+            # log marginal likelihood
+            lml = (-0.5 * y.dot(alpha) - np.log(np.diag(chol)).sum() -
+                   0.5 * n * np.log(2 * np.pi))
+            if lml > best:
+                best = lml
+                best_fit = (length_scale, alpha, chol)
+        if not np.isfinite(best):
+            raise RuntimeError('Gaussian process could not be fitted.')
+        self.length_scale, self.alpha, self._chol = best_fit
+        return self
+
+    def predict(self, x, return_var=True):
+        """ Returns mean and variance of the prediction.
+
+        :param x: (2-D array) normalized parameters, samples x parameters
+        :param return_var: (bool, optional) compute the variance as well
+        :return: mean (1-D array), variance (1-D array) if return_var
+        """
+        k = self._kernel(self._sq_dist(np.asarray(x, dtype=float), self.x))
+        mean = k.dot(self.alpha)
+        if not return_var:
+            return mean
+        v = linalg.solve_triangular(self._chol, k.T, lower=True)
+        var = np.clip(self.variance - (v ** 2).sum(axis=0), 0, None)
+        return mean, var
+
+
+class Emulator(object):
+    """ Emulator of a multivariate model output (e.g. a length time series
+    or a set of skill scores), based on a principal component analysis
+    and one Gaussian process per principal component.
+    """
+
+    def __init__(self, n_components=5, noise=1e-4):
+        """ Initializes the emulator.
+
+        :param n_components: (int, optional) number of principal components
+        :param noise: (float, optional) relative noise variance of the
+            Gaussian processes
+        """
+        self.n_components = n_components
+        self.noise = noise
+
+    def fit(self, params, outputs):
+        """ Trains the emulator.
+
+        :param params: (pd.DataFrame) parameters, one row per sample and one
+            column per parameter (e.g. t_star, prcp_fac, glen_a_fac)
+        :param outputs: (pd.DataFrame) outputs, one row per sample and one
+            column per output (e.g. years or scores), without NaN
+        :return: the fitted emulator
+        """
+        self.params = list(params.columns)
+        self.outputs = list(outputs.columns)
+        x = params.values.astype(float)
+        y = outputs.values.astype(float)
+
+        # normalize parameters onto the unit cube
+        self._x_min = x.min(axis=0)
+        self._x_range = x.max(axis=0) - self._x_min
+        self._x_range[self._x_range == 0] = 1
+        x = self._normalize(x)
+
+        # standardize outputs
+        self._y_mean = y.mean(axis=0)
+        self._y_scale = y.std(axis=0)
+        self._y_scale[self._y_scale == 0] = 1
+        y = (y - self._y_mean) / self._y_scale
+
+        # principal components
+        u, s, vt = np.linalg.svd(y, full_matrices=False)
+        k = min(self.n_components, s.size)
+        self.components = vt[:k]
+        scores = u[:, :k] * s[:k]
+        # variance not explained by the retained components
+        self._residual_var = ((y - scores.dot(self.components)) ** 2).mean(
+            axis=0)
+
+        # one Gaussian process per principal component
+        self._gps = [GaussianProcess(noise=self.noise).fit(x, scores[:, i])
+                     for i in range(k)]
+        return self
+
+    def _normalize(self, x):
+        return (x - self._x_min) / self._x_range
+
+    def predict(self, params, return_std=False):
+        """ Predicts the outputs for the given parameters.
+
+        :param params: (pd.DataFrame) parameters, with the same columns as
+            used for training
+        :param return_std: (bool, optional) return the standard deviation
+            of the prediction as well
+        :return: (pd.DataFrame) predicted outputs (and standard deviation),
+            with the same index as `params`
+        """
+        x = self._normalize(params[self.params].values.astype(float))
+        if return_std:
+            means, variances = zip(*[gp.predict(x) for gp in self._gps])
+        else:
+            means = [gp.predict(x, return_var=False) for gp in self._gps]
+        means = np.array(means).T
+        # back to output space
+        mean = (means.dot(self.components) * self._y_scale + self._y_mean)
+        mean = pd.DataFrame(mean, index=params.index, columns=self.outputs)
+        if not return_std:
+            return mean
+        variances = np.array(variances).T
+        var = variances.dot(self.components ** 2) + self._residual_var
+        std = np.sqrt(var) * self._y_scale
+        std = pd.DataFrame(std, index=params.index, columns=self.outputs)
+        return mean, std
+
+
+class EmulatorObjective(object):
+    """ Objective function for `glen_a.search_glen_a()`, using an emulator
+    instead of model runs. The emulator predicts either the scores
+    directly, or the length time series, which are then scored against
+    the reference length.
+    """
+
+    def __init__(self, emulator, score='rmsd', length_ref=None, y0=1894):
+        """ Initializes the objective.
+
+        :param emulator: (Emulator) trained emulator
+        :param score: (str, optional) score to minimize, either 'rmsd',
+            'rmsd_bc' or 'corr' (whereby 1 - corr is minimized)
+        :param length_ref: (pd.Series, optional) reference length, needed
+            if the emulator predicts length time series
+        :param y0: (int, optional) first year of the control period
+        """
+        self.emulator = emulator
+        self.score = score
+        self.length_ref = length_ref
+        self.y0 = y0
+        self.trace = list()
+
+    def evaluate(self, t_star, prcp_fac, glen_a_fac):
+        """ Returns the predicted scores (pd.Series) for the given
+        parameters. """
+        values = dict(t_star=t_star, prcp_fac=prcp_fac,
+                      glen_a_fac=glen_a_fac)
+        params = pd.DataFrame([values])
+        prediction = self.emulator.predict(params)
+        if self.score in prediction.columns:
+            scores = prediction.iloc[0]
+        else:
+            years = prediction.columns.values.astype(int)
+            scores = skill.score(prediction.values, years,
+                                 self.length_ref.values,
+                                 self.length_ref.index.values,
+                                 y0=self.y0).iloc[0]
+        self.trace.append(dict(values, **scores))
+        return scores
+
+    def __call__(self, t_star, prcp_fac, glen_a_fac):
+        value = self.evaluate(t_star, prcp_fac, glen_a_fac)[self.score]
+        if self.score == 'corr':
+            value = 1 - value
+        return value if np.isfinite(value) else np.inf
+
+    def trace_df(self):
+        """ Returns all evaluated points and their predicted scores. """
+        return pd.DataFrame(self.trace)
+
+
+def read_length_runs(path='/Users/oberrauch/work/grindelwald/data/length_t_star.csv'):
+    """ Reads the modeled length of the t* runs (see `t_star_tuning.py`) as
+    training data. Rows which are no model runs (i.e. the reference) and
+    years without modeled length are dropped.
+
+    :param path: (str, optional) path to length file
+    :return: parameters (pd.DataFrame), length (pd.DataFrame, one column
+        per year)
+    """
+    length = pd.read_csv(path, index_col=0)
+    # keep model runs only, index by t*
+    t_stars = pd.to_numeric(length.index, errors='coerce')
+    length = length.loc[np.isfinite(t_stars)]
+    length.index = t_stars[np.isfinite(t_stars)].astype(int)
+    length = length.dropna(axis=1, how='any')
+    length.columns = length.columns.astype(int)
+    params = pd.DataFrame({'t_star': length.index.values}, index=length.index)
+    return params, length
+
+
+def read_score_files(path='/Users/oberrauch/work/grindelwald/data/length_corr_t_star/'):
+    """ Reads the skill scores of the (t*, prcp_fac, A factor) sweep, stored
+    in one file per (t*, prcp_fac) cell, as training data. Parameter
+    combinations with missing scores are dropped.
+
+    :param path: (str, optional) path to directory with the score files
+    :return: parameters (pd.DataFrame), scores (pd.DataFrame)
+    """
+    pattern = re.compile(r't_star_(\d+)_prcp_fac_([\d.]+)\.csv$')
+    frames = []
+    for fn in sorted(os.listdir(path)):
+        match = pattern.search(fn)
+        if not match:
+            continue
+        df = pd.read_csv(os.path.join(path, fn), index_col=0)
+        df.index.name = 'glen_a_fac'
+        df = df.reset_index()
+        df.insert(0, 't_star', int(match.group(1)))
+        df.insert(1, 'prcp_fac', float(match.group(2)))
+        frames.append(df)
+    data = pd.concat(frames, ignore_index=True)
+    # older files name the correlation coefficient differently
+    data.rename(columns={'correlation': 'corr'}, inplace=True)
+    data = data.dropna()
+    return data[PARAMS], data.drop(columns=PARAMS)
+
+
+def read_sweep(ds):
+    """ Converts the results of `glen_a.cross_correlation_tstar_prcpfac_glena()`
+    (e.g. read from glen_a.nc) into training data.
+
+    :param ds: (xr.Dataset) sweep results
+    :return: parameters (pd.DataFrame), scores (pd.DataFrame)
+    """
+    data = ds.to_dataframe().dropna().reset_index()
+    return data[PARAMS], data.drop(columns=PARAMS)
@@ -0,0 +1,398 @@
+""" Flux based flowline model for an ensemble of parameter sets.
+
+OGGM's `FluxBasedModel` advances one single glacier state, whereby the
+Python overhead of every time step dominates for small glaciers. Here, the
+states of N ensemble members (same flowlines, but different creep
+parameter, sliding parameter, mass balance model or bed) are stacked into
+2-D arrays (members x grid points) and advanced together. The numerics
+follow `oggm.core.flowline.FluxBasedModel` (staggered grid, tributary
+fluxes, CFL condition, annual mass balance feedback), with one common
+time step for all members: every step is as short as the CFL time step of
+the fastest member, e.g. for an ensemble of t* the most active glacier
+sets the pace of all others.
+
+Supported are the flowlines of `init_present_time_glacier()` (mixed
+trapezoidal/parabolic beds) as well as rectangular, trapezoidal and
+parabolic bed flowlines. Flux gates, calving and shape factors are not
+supported.
+"""
+
+import copy
+import logging
+import numpy as np
+import xarray as xr
+
+# oggm modules
+from oggm import cfg
+from oggm.cfg import G, SEC_IN_YEAR
+from oggm.core import flowline
+
+log = logging.getLogger(__name__)
+
+
+def _bed_geometry(fl):
+    """ Returns the cross section parameters of a flowline as arrays,
+    i.e. trapezoid mask, bottom width and side slope (lambda) of the
+    trapezoids and the bed shape of the parabolas.
+
+    :param fl: (oggm Flowline) model flowline
+    :return: is_trapezoid, w0, lambdas, bed_shape (all arrays of length nx)
+    """
+    nx = fl.nx
+    is_trap = np.zeros(nx, dtype=bool)
+    w0 = np.zeros(nx)
+    lambdas = np.zeros(nx)
+    bed_shape = np.ones(nx)
+    if isinstance(fl, flowline.MixedBedFlowline):
+        is_trap[:] = fl.is_trapezoid
+        lambdas[is_trap] = fl._lambdas[is_trap]
+        w0[is_trap] = fl._w0_m[is_trap]
+        bed_shape[~is_trap] = fl.bed_shape[~is_trap]
+    elif isinstance(fl, flowline.ParabolicBedFlowline):
+        bed_shape[:] = fl.bed_shape
+    elif isinstance(fl, flowline.RectangularBedFlowline):
+        is_trap[:] = True
+        w0[:] = fl._widths * fl.map_dx
+    elif isinstance(fl, flowline.TrapezoidalBedFlowline):
+        is_trap[:] = True
+        w0[:] = fl._w0_m
+        lambdas[:] = fl._lambdas
+    else:
+        raise NotImplementedError('Flowline type not supported: '
+                                  '{}'.format(type(fl).__name__))
+    return is_trap, w0, lambdas, bed_shape
+
+
+class EnsembleFluxModel(object):
+    """ Flux based flowline model, advancing N ensemble members at once.
+
+    All members must consist of the same flowlines (number of flowlines,
+    grid points and tributary structure), but can differ in their bed
+    (e.g. inversions with different creep parameters), initial section,
+    creep and sliding parameter and mass balance model. As in OGGM, a
+    member whose glacier exceeds the domain or whose solution contains
+    NaNs fails; its state is set to NaN and it is not advanced any further.
+    """
+
+    def __init__(self, members_fls, mb_model, y0=0., glen_a=None, fs=0.):
+        """ Initializes the ensemble.
+
+        :param members_fls: (list) model flowlines of every member (e.g.
+            `gdir.read_pickle('model_flowlines')`), or one list of
+            flowlines used for all members
+        :param mb_model: mass balance model used for all members, or list
+            of mass balance models (one per member)
+        :param y0: (float, optional) start year
+        :param glen_a: (float or array like, optional) creep parameter, one
+            per member, `cfg.PARAMS['glen_a']` as default
+        :param fs: (float or array like, optional) sliding parameter, one
+            per member
+        """
+        if glen_a is None:
+            glen_a = cfg.PARAMS['glen_a']
+        glen_a = np.atleast_1d(np.asarray(glen_a, dtype=float))
+        # one list of flowlines for all members
+        if not isinstance(members_fls[0], (list, tuple)):
+            members_fls = [members_fls] * glen_a.size
+        n = max(len(members_fls), glen_a.size)
+        if len(members_fls) == 1:
+            members_fls = members_fls * n
+        self.glen_a = np.broadcast_to(glen_a, (n,)).copy()
+        self.fs = np.broadcast_to(np.asarray(fs, dtype=float), (n,)).copy()
+        self.n_members = n
+        # own copy of the flowlines, used for the diagnostics
+        self.members_fls = [copy.deepcopy(fls) for fls in members_fls]
+
+        # mass balance model, shared by all members or one per member
+        if isinstance(mb_model, (list, tuple)):
+            if len(mb_model) != n:
+                raise ValueError('One mass balance model per member needed.')
+            self.mb_models = list(mb_model)
+            self.mb_model = None
+        else:
+            self.mb_models = None
+            self.mb_model = mb_model
+
+        # numerical parameters and tributary structure, as used by OGGM
+        fls = self.members_fls[0]
+        template = flowline.FluxBasedModel(copy.deepcopy(fls),
+                                           mb_model=self.mb_models[0]
+                                           if self.mb_models else mb_model,
+                                           y0=y0, glen_a=self.glen_a[0])
+        if template.sf_func is not None:
+            raise NotImplementedError('Shape factors are not supported, see '
+                                      "cfg.PARAMS['use_shape_factor_for_"
+                                      "fluxbasedmodel'].")
+        self.glen_n = template.glen_n
+        self.rho = template.rho
+        self.cfl_number = template.cfl_number
+        self.min_dt = template.min_dt
+        self.max_dt = template.max_dt
+        self._trib = template._trib
+        self._fd = 2. / (self.glen_n + 2) * self.glen_a
+
+        # geometry and state of all members, stacked (members x grid points)
+        self.dx = [fl.dx_meter for fl in fls]
+        self.flows_to_indice = [fl.flows_to_indice if fl.flows_to is not None
+                                else None for fl in fls]
+        self.bed_h = []
+        self._is_trap = []
+        self._w0 = []
+        self._lambdas = []
+        self._bed_shape = []
+        self.sections = []
+        for fl_id in range(len(fls)):
+            geoms = [_bed_geometry(m_fls[fl_id]) for m_fls in self.members_fls]
+            self._is_trap.append(np.array([g[0] for g in geoms]))
+            self._w0.append(np.array([g[1] for g in geoms]))
+            self._lambdas.append(np.array([g[2] for g in geoms]))
+            self._bed_shape.append(np.array([g[3] for g in geoms]))
+            self.bed_h.append(np.array([m_fls[fl_id].bed_h
+                                        for m_fls in self.members_fls]))
+            self.sections.append(np.array([m_fls[fl_id].section
+                                           for m_fls in self.members_fls]))
+
+        # failed members and members which would have needed a time step
+        # shorter than min_dt (see `FluxBasedModel.dt_warning`)
+        self.failed = np.zeros(n, dtype=bool)
+        self.dt_warning = np.zeros(n, dtype=bool)
+
+        # time and mass balance cache (annual mass balance feedback)
+        self.y0 = y0
+        self.t = 0.
+        self._mb_year = [None] * len(fls)
+        self._mb_cache = [None] * len(fls)
+
+    @property
+    def yr(self):
+        return self.y0 + self.t / SEC_IN_YEAR
+
+    def thick_widths(self, fl_id, section=None):
+        """ Computes ice thickness and surface width of all members from
+        the cross section area.
+
+        :param fl_id: (int) flowline index
+        :param section: (2-D array, optional) cross section area,
+            the current one as default
+        :return: thickness, widths (2-D arrays, members x grid points)
+        """
+        if section is None:
+            section = self.sections[fl_id]
+        is_trap = self._is_trap[fl_id]
+        w0 = self._w0[fl_id]
+        lambdas = self._lambdas[fl_id]
+        bed_shape = self._bed_shape[fl_id]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # parabolic: section = 4/3 * h^(3/2) / sqrt(bed_shape)
+            thick_par = (0.75 * section * np.sqrt(bed_shape)) ** (2 / 3)
+            # trapezoid: section = w0 * h + lambda / 2 * h^2
+            thick_trap = np.where(lambdas > 0,
+                                  (np.sqrt(w0 ** 2 + 2 * lambdas * section)
+                                   - w0) / np.where(lambdas > 0, lambdas, 1),
+                                  section / np.where(w0 > 0, w0, 1))
+            thick = np.where(is_trap, thick_trap, thick_par)
+            widths = np.where(is_trap, w0 + lambdas * thick,
+                              np.sqrt(4 * thick / bed_shape))
+        return thick, widths
+
+    def _get_mb(self, fl_id, heights):
+        """ Annual mass balance [m ice s-1] of all members, computed once per
+        year and flowline (annual mass balance feedback, as in OGGM). """
+        year = np.floor(self.yr)
+        if self._mb_year[fl_id] == year:
+            return self._mb_cache[fl_id]
+        if self.mb_models is None:
+            # one single call for all members
+            mb = self.mb_model.get_annual_mb(heights.ravel(), year=self.yr,
+                                             fl_id=fl_id)
+            mb = mb.reshape(heights.shape)
+        else:
+            mb = np.array([m.get_annual_mb(h, year=self.yr, fl_id=fl_id)
+                           for m, h in zip(self.mb_models, heights)])
+        self._mb_year[fl_id] = year
+        self._mb_cache[fl_id] = mb
+        return mb
+
+    def step(self, dt):
+        """ Advances all members by one time step, which is at most `dt`
+        and fulfills the CFL condition for all (non failed) members. As in
+        `FluxBasedModel.step()`, the time step is clipped to `min_dt` and
+        `max_dt`.
+
+        :param dt: (float) maximal time step [s]
+        :return: (float) actual time step [s]
+        """
+        n = self.glen_n
+        ok = ~self.failed
+        # to arrive precisely at a given date
+        min_dt = dt if dt < self.min_dt else self.min_dt
+        # state of all flowlines
+        thicks, widths, surfaces = [], [], []
+        for fl_id in range(len(self.sections)):
+            thick, width = self.thick_widths(fl_id)
+            thicks.append(thick)
+            widths.append(width)
+            surfaces.append(self.bed_h[fl_id] + thick)
+
+        # first loop: fluxes, CFL condition and mass balance
+        fluxes, mbs = [], []
+        member_dt = np.full(self.n_members, np.inf)
+        for fl_id, trib in enumerate(self._trib):
+            section = self.sections[fl_id]
+            thick = thicks[fl_id]
+            surface_h = surfaces[fl_id]
+            dx = self.dx[fl_id]
+
+            # tributaries use the surface of the branch they flow into
+            if trib[0] is not None:
+                ide = self.flows_to_indice[fl_id]
+                surface_h = np.hstack([surface_h,
+                                       surfaces[trib[0]][:, [ide]]])
+                thick = np.hstack([thick, thick[:, [-1]]])
+                section = np.hstack([section, section[:, [-1]]])
+
+            # staggered gradient
+            nxs = surface_h.shape[1] + 1
+            slope_stag = np.zeros((self.n_members, nxs))
+            slope_stag[:, 1:-1] = (surface_h[:, :-1] - surface_h[:, 1:]) / dx
+            slope_stag[:, -1] = slope_stag[:, -2]
+
+            # staggered thickness and section
+            thick_stag = np.empty((self.n_members, nxs))
+            thick_stag[:, 1:-1] = (thick[:, :-1] + thick[:, 1:]) / 2.
+            thick_stag[:, [0, -1]] = thick[:, [0, -1]]
+            section_stag = np.empty((self.n_members, nxs))
+            section_stag[:, 1:-1] = (section[:, :-1] + section[:, 1:]) / 2.
+            section_stag[:, [0, -1]] = section[:, [0, -1]]
+
+            # staggered velocity (deformation + sliding)
+            rhogh = (self.rho * G * slope_stag) ** n
+            u_stag = (thick_stag ** (n + 1) * self._fd[:, np.newaxis] * rhogh
+                      + thick_stag ** (n - 1) * self.fs[:, np.newaxis] * rhogh)
+            fluxes.append(u_stag * section_stag / dx)
+
+            # CFL condition, for each member
+            maxu = np.abs(u_stag).max(axis=1)
+            with np.errstate(divide='ignore'):
+                fl_dt = np.where(maxu > 0, self.cfl_number * dx / maxu,
+                                 self.max_dt)
+            member_dt = np.minimum(member_dt, fl_dt)
+
+            # mass balance, at the current surface
+            heights = np.where(ok[:, np.newaxis], surfaces[fl_id],
+                               self.bed_h[fl_id])
+            mbs.append(self._get_mb(fl_id, heights))
+
+        # common time step
+        if ok.any():
+            dt = min(dt, member_dt[ok].min())
+        self.dt_warning |= ok & (member_dt < min_dt)
+        dt = np.clip(dt, min_dt, self.max_dt)
+
+        # second loop: mass exchange
+        trib_flux = [np.zeros_like(s) for s in self.sections]
+        for fl_id, trib in enumerate(self._trib):
+            flux = fluxes[fl_id]
+            # for tributaries an additional grid point was added
+            if trib[0] is not None:
+                flux = flux[:, :-1]
+
+            # mass balance, allow parabolic beds to grow
+            width = np.where((mbs[fl_id] > 0) & (widths[fl_id] == 0), 10.,
+                             widths[fl_id])
+            mb = dt * mbs[fl_id] * width
+
+            # update section with ice flow and mass balance
+            section = (self.sections[fl_id] +
+                       (flux[:, :-1] - flux[:, 1:]) * dt +
+                       trib_flux[fl_id] * dt + mb)
+            self.sections[fl_id] = np.where(ok[:, np.newaxis],
+                                            np.clip(section, 0, None), np.nan)
+
+            # add the outflow to the downstream flowline
+            # (this works because the flowlines are sorted)
+            if trib[0] is not None:
+                out = np.clip(flux[:, -1], 0, None)
+                trib_flux[trib[0]][:, trib[1]:trib[2]] += \
+                    out[:, np.newaxis] * trib[3][np.newaxis, :]
+
+        self.t += dt
+        return dt
+
+    def run_until(self, y1):
+        """ Runs all members until the given year. Members which exceed
+        the domain boundaries or contain NaNs fail (where
+        `FluxBasedModel.run_until()` would raise an error).
+
+        :param y1: (float) end year
+        """
+        t = (y1 - self.y0) * SEC_IN_YEAR
+        while self.t < t:
+            self.step(t - self.t)
+
+        # check for domain bounds and NaNs
+        thick, _ = self.thick_widths(len(self.sections) - 1)
+        new_failed = ~self.failed & (thick[:, -1] > 10)
+        for fl_id in range(len(self.sections)):
+            thick, _ = self.thick_widths(fl_id)
+            new_failed |= ~self.failed & ~np.all(np.isfinite(thick), axis=1)
+        if new_failed.any():
+            self.failed |= new_failed
+            for section in self.sections:
+                section[new_failed] = np.nan
+
+    def diagnostics(self):
+        """ Returns length [m], volume [m3] and area [m2] of every member,
+        computed by the OGGM flowline objects (NaN for failed members).
+
+        :return: length, volume, area (arrays of length N)
+        """
+        length = np.full(self.n_members, np.nan)
+        volume = np.full(self.n_members, np.nan)
+        area = np.full(self.n_members, np.nan)
+        for m, fls in enumerate(self.members_fls):
+            if self.failed[m]:
+                continue
+            for fl, section in zip(fls, self.sections):
+                fl.section = section[m]
+            length[m] = fls[-1].length_m
+            volume[m] = np.sum([fl.volume_m3 for fl in fls])
+            area[m] = np.sum([fl.area_m2 for fl in fls])
+        return length, volume, area
+
+    def run_until_and_store(self, y1):
+        """ Runs all members until the given year and stores the yearly
+        diagnostics.
+
+        Failed members and members which needed a time step shorter than
+        `min_dt` are logged (see `failed` and `dt_warning` in the output).
+
+        :param y1: (int) end year
+        :return: (xr.Dataset) `length_m`, `volume_m3` and `area_m2`, with
+            the dimensions member and time (year)
+        """
+        years = np.arange(np.floor(self.yr), y1 + 1)
+        diags = np.full((3, self.n_members, years.size), np.nan)
+        for i, yr in enumerate(years):
+            self.run_until(yr)
+            diags[:, :, i] = self.diagnostics()
+
+        ds = xr.Dataset()
+        ds.coords['member'] = ('member', np.arange(self.n_members))
+        ds.coords['time'] = ('time', years)
+        ds.coords['glen_a'] = ('member', self.glen_a)
+        ds['length_m'] = (['member', 'time'], diags[0])
+        ds['volume_m3'] = (['member', 'time'], diags[1])
+        ds['area_m2'] = (['member', 'time'], diags[2])
+        ds['failed'] = ('member', self.failed.copy())
+        ds['dt_warning'] = ('member', self.dt_warning.copy())
+
+        if self.failed.any():
+            log.warning('Ensemble members failed (domain exceeded or NaN): '
+                        '{}'.format(np.flatnonzero(self.failed).tolist()))
+        if self.dt_warning.any():
+            log.warning('Ensemble members with time steps shorter than '
+                        'min_dt: {}'.format(
+                            np.flatnonzero(self.dt_warning).tolist()))
+        return ds
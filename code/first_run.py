@@ -5,16 +5,24 @@ import numpy as np
 import pandas as pd
 # oggm modules
 from oggm import utils, cfg, tasks, workflow, graphics
-from oggm.core import flowline, massbalance, inversion, climate
+from oggm.core import flowline, inversion, climate
 from oggm.workflow import execute_entity_task
+# local modules
+from utils import get_rgi_entities
+from gdir_cache import gdir_path, MemoryGlacierDirectory
+from length_ref import offset_to
+from mb_table import get_tabulated_mb
 # system libraries
 import os
+import json
+import hashlib
 # plotting libraries
 import matplotlib
 import matplotlib.pyplot as plt
 
 
-def init_single_glacier(rgi_id, wdir=None, paths=None, params=None):
+def init_single_glacier(rgi_id, wdir=None, paths=None, params=None,
+                        reset=True):
     """
     Performs the following necessary initialization steps for a single glacier:
         - loading the default path & parameter set
@@ -33,6 +41,8 @@ def init_single_glacier(rgi_id, wdir=None, paths=None, params=None):
         style of cfg.PATHS dict: key=path_name, value=path
     :param params: (dict, optional) params to be changed/set in config, following the
         style of cfg.PARAMS dict: key=param_name, value=value
+    :param reset: (bool, optional) delete an existing glacier directory,
+        otherwise its content is kept
     :return: (str) path to the glacier directory
     """
 
@@ -50,7 +60,7 @@ def init_single_glacier(rgi_id, wdir=None, paths=None, params=None):
             cfg.PARAMS[p] = v
 
     # download RGI entry
-    df_rgi = utils.get_rgi_glacier_entities([rgi_id])
+    df_rgi = get_rgi_entities([rgi_id])
 
     # define name of working directory if no given
     if wdir is None:
@@ -63,14 +73,22 @@ def init_single_glacier(rgi_id, wdir=None, paths=None, params=None):
     print('Working directory: ', wdir)
 
     # Go - initialize working directories
-    gdir = workflow.init_glacier_regions(df_rgi, reset=True)[0]
+    gdir = workflow.init_glacier_regions(df_rgi, reset=reset)[0]
 
     return gdir
 
 
-def prepo(gdir):
+def _as_list(gdirs):
+    """ Wraps a single glacier directory into a list. """
+    if isinstance(gdirs, (list, tuple)):
+        return list(gdirs)
+    return [gdirs]
+
+
+def prepo(gdirs):
     """
-    Runs all necessary preprocessing tasks for the given glacier directory, which are:
+    Runs all necessary preprocessing tasks for the given glacier directory
+    (or list of glacier directories), which are:
         - computing the glacier mask
         - computing the centerlines
         - initialize the flowlines
@@ -81,8 +99,9 @@ def prepo(gdir):
         - compute the geometrical catchment widths (for each point of the flowline)
         - correct for NaNs and inconsistencies in the catchment widths
 
-    :param gdir: path to glacier directory
+    :param gdirs: glacier directory or list of glacier directories
     """
+    gdirs = _as_list(gdirs)
     # specify preprocessing tasks
     task_list = [
         tasks.glacier_masks,
@@ -95,28 +114,29 @@ def prepo(gdir):
         tasks.catchment_width_geom,
         tasks.catchment_width_correction
     ]
-    # run all tasks
+    # run all tasks, each one for all glaciers at once
     for task in task_list:
-        workflow.execute_entity_task(task, [gdir])
+        workflow.execute_entity_task(task, gdirs)
     pass
 
 
-def cru_climate_tasks(gdir):
+def cru_climate_tasks(gdirs):
     """
     Execute the needed climate task when working with CRU data, which are
         - process and write the CRU climate data for this glacier
         - apply t* interpolation on this glacier
         - compute the apparent mass balance for the calculated mu*
-    :param gdir: (str) path to glacier directory
+    :param gdirs: glacier directory or list of glacier directories
     :return:
     """
-    tasks.process_cru_data(gdir)
-    tasks.distribute_t_stars([gdir])
-    tasks.apparent_mb(gdir)
+    gdirs = _as_list(gdirs)
+    execute_entity_task(tasks.process_cru_data, gdirs)
+    tasks.distribute_t_stars(gdirs)
+    execute_entity_task(tasks.apparent_mb, gdirs)
     pass
 
 
-def histalp_climate_tasks(gdir, path_ref_tstar, path_histalp=None):
+def histalp_climate_tasks(gdirs, path_ref_tstar, path_histalp=None):
     """
     Execute the needed climate task when working with HISTALP (or any
     other custom climate) data, which are:
@@ -128,23 +148,24 @@ def histalp_climate_tasks(gdir, path_ref_tstar, path_histalp=None):
     Path to custom climate file must be given if not already set in cfg.PATHS.
     Mass balance calibration with custom climate file must be performed beforehand.
 
-    :param gdir: (str) path to glacier directory
+    :param gdirs: glacier directory or list of glacier directories
     :param path_ref_tstar: (str) path to custom reference t* calibration list
     :param path_histalp: (str, optional) path to custom climate file
     """
+    gdirs = _as_list(gdirs)
     # set the path to custom climate file if given as parameter
     if path_histalp is not None:
         cfg.PATHS['climate_file'] = path_histalp
     # read the reference t* calibration list
     ref_tstar = pd.read_csv(path_ref_tstar)
     # execute climate tasks
-    tasks.process_custom_climate_data(gdir)
-    tasks.distribute_t_stars([gdir], ref_df=ref_tstar)
-    tasks.apparent_mb(gdir)
+    execute_entity_task(tasks.process_custom_climate_data, gdirs)
+    tasks.distribute_t_stars(gdirs, ref_df=ref_tstar)
+    execute_entity_task(tasks.apparent_mb, gdirs)
     pass
 
 
-def thick_inversion(gdir, glen_a=None, fs=0.):
+def thick_inversion(gdirs, glen_a=None, fs=0.):
     """
     Executes the needed inversion tasks for this glacier, which are:
         - preparing the needed data
@@ -153,221 +174,386 @@ def thick_inversion(gdir, glen_a=None, fs=0.):
             whilst conserving the total estimated volume
     Ice creep parameter and sliding factor can be passed as argument,
     otherwise the OGGM default values are used.
-    :param gdir: path to glacier directory
+    :param gdirs: glacier directory or list of glacier directories
     :param glen_a: (float, optional) creep parameter, 2.4e-24
     :param fs: ()
     """
+    gdirs = _as_list(gdirs)
     if not glen_a:
         glen_a = cfg.PARAMS['glen_a']
-    tasks.prepare_for_inversion(gdir)
-    tasks.volume_inversion(gdir, glen_a=glen_a, fs=fs)
-    tasks.filter_inversion_output(gdir)
+    execute_entity_task(tasks.prepare_for_inversion, gdirs)
+    execute_entity_task(tasks.volume_inversion, gdirs, glen_a=glen_a, fs=fs)
+    execute_entity_task(tasks.filter_inversion_output, gdirs)
     pass
 
 
-def cru():
-    """ Use the above defined function to set up the model for the Upper Grindelwald Glacier
-    and run it with the CRU climate data from 1902 to 2016.
-    The glacier lenght evolution will be saved in the `histalp_lenght.csv` file.
-    """
+# paths to the HISTALP mass balance calibration and climate file
+PATH_REF_TSTAR = '/Users/oberrauch/work/grindelwald/working_directories/mb_calib_wd/ref_tstars.csv'
+PATH_HISTALP = '/Users/oberrauch/work/grindelwald/raw_data/histalp_merged_full.nc'
+
+# run configurations for the Upper Grindelwald Glacier
+RUN_CONFIGS = {
+    'cru': {
+        'rgi_id': 'RGI60-11.01270',
+        'climate': 'cru',
+        'ys': 1902,
+        'ye': 2016,
+        'params': {
+            'rgi_version': 6,
+            'use_multiple_flowlines': True,
+            'border': 70,
+            'continue_on_error': False,
+            'use_intersects': False,
+            'run_mb_calibration': False
+        }
+    },
+    'histalp': {
+        'rgi_id': 'RGI60-11.01270',
+        'climate': 'histalp',
+        'ys': 1802,
+        'ye': 2014,
+        'params': {
+            'rgi_version': 6,
+            'use_multiple_flowlines': True,
+            'border': 70,
+            'continue_on_error': False,
+            'use_intersects': False,
+            'run_mb_calibration': True
+        }
+    }
+}
 
-    # specify the RGI ID for the Upper Grindelwald Glacier
-    rgi_id = 'RGI60-11.01270'
-    # specify path to working directory
-    wdir = '/Users/oberrauch/work/grindelwald/working_directories/first_run_wd'
+# name of the file (in the glacier directory) storing the stage fingerprints
+FINGERPRINT_FILE = 'pipeline_fingerprints.json'
 
-    # specify parameters and corresponding values
-    params = {
-        'rgi_version': 6,
-        'use_multiple_flowlines': True,
-        'border': 70,
-        'continue_on_error': False,
-        'use_intersects': False,
-        'run_mb_calibration': False
 
-    }
+def _file_signature(path):
+    """ Returns path, modification time and size of an input file. """
+    if path is None or not os.path.isfile(path):
+        return path
+    stat = os.stat(path)
+    return [path, stat.st_mtime, stat.st_size]
 
-    # initialize
-    gdir = init_single_glacier(rgi_id, wdir=wdir, params=params)
-    # preprocessing
-    prepo(gdir)
 
-    # climate - cru
-    cru_climate_tasks(gdir)
+def fingerprint(previous, inputs):
+    """ Computes the fingerprint of a pipeline stage from the fingerprint of
+    the previous stage and the inputs of the stage itself. Hence, changing
+    the inputs of one stage changes the fingerprints of all later stages.
+
+    :param previous: (str) fingerprint of the previous stage
+    :param inputs: (dict) inputs of the stage, json serializable
+    :return: (str) fingerprint
+    """
+    inputs = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1((previous + inputs).encode()).hexdigest()
+
+
+def _read_fingerprints(path):
+    """ Reads the stored stage fingerprints of a glacier directory. """
+    path = os.path.join(path, FINGERPRINT_FILE)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def _write_fingerprints(path, fingerprints):
+    """ Stores the stage fingerprints in the glacier directory. """
+    with open(os.path.join(path, FINGERPRINT_FILE), 'w') as fp:
+        json.dump(fingerprints, fp, indent=2, sort_keys=True)
+
+
+def _has_files(gdir, filenames, filesuffix=''):
+    """ Checks whether all given files exist in the glacier directory (or
+    in memory, see `gdir_cache.MemoryGlacierDirectory`). """
+    if isinstance(gdir, MemoryGlacierDirectory):
+        return all(gdir.has_file(f, filesuffix=filesuffix) for f in filenames)
+    return all(os.path.exists(gdir.get_filepath(f, filesuffix=filesuffix))
+               for f in filenames)
+
+
+def run_pipeline(rgi_id='RGI60-11.01270', climate='histalp', ys=1802,
+                 ye=2014, params=None, glen_a=None, fs=0., wdir=None,
+                 path_ref_tstar=PATH_REF_TSTAR, path_histalp=PATH_HISTALP):
+    """ Runs the model for one glacier from start to finish, as specified
+    by the given run configuration (see `RUN_CONFIGS`). The pipeline
+    consists of the following stages:
+        - init: initialize the glacier directory
+        - prepo: GIS and centerline preprocessing
+        - climate: climate tasks (CRU or HISTALP)
+        - inversion: ice thickness inversion
+        - run: model run over the given years
+    The inputs of each stage are fingerprinted and stored in the glacier
+    directory. A stage is skipped, if its fingerprint did not change and
+    its output files exist. Every climate source has its own glacier
+    directory (in the subdirectory `<climate>` of the working directory),
+    since the calibration parameters differ, so that alternating between
+    CRU and HISTALP runs does not reset the stages of the other one. The
+    glacier length is written to the file `<climate>_length.csv` in the
+    working directory.
+
+    :param rgi_id: (str) RGI ID for glacier of interest
+    :param climate: (str, optional) climate source, 'cru' or 'histalp'
+    :param ys: (int, optional) start year of the model run
+    :param ye: (int, optional) end year of the model run
+    :param params: (dict, optional) params to be changed/set in config
+    :param glen_a: (float, optional) creep parameter, OGGM default if None
+    :param fs: (float, optional) sliding parameter
+    :param wdir: (str, optional) path to working directory
+    :param path_ref_tstar: (str, optional) path to custom reference t*
+        calibration list, only used with HISTALP
+    :param path_histalp: (str, optional) path to HISTALP climate file
+    :return: (pd.Series) glacier length, index by year
+    """
+    if wdir is None:
+        wdir = '/Users/oberrauch/work/grindelwald/working_directories/first_run_wd'
+    suff = '_{}'.format(climate)
+    # separate OGGM working directory for every climate source
+    climate_wdir = os.path.join(wdir, climate)
+
+    # fingerprint all stages
+    fingerprints = dict()
+    fingerprints['init'] = fingerprint('', {'rgi_id': rgi_id,
+                                            'params': params})
+    fingerprints['prepo'] = fingerprint(fingerprints['init'], {})
+    if climate == 'histalp':
+        climate_inputs = {'climate': climate,
+                          'ref_tstar': _file_signature(path_ref_tstar),
+                          'climate_file': _file_signature(path_histalp)}
+    else:
+        climate_inputs = {'climate': climate}
+    fingerprints['climate'] = fingerprint(fingerprints['prepo'],
+                                          climate_inputs)
+    fingerprints['inversion'] = fingerprint(fingerprints['climate'],
+                                            {'glen_a': glen_a, 'fs': fs})
+    run_key = 'run' + suff
+    fingerprints[run_key] = fingerprint(fingerprints['inversion'],
+                                        {'ys': ys, 'ye': ye})
+
+    # compare with the fingerprints of the last run
+    gdir_dir = gdir_path(rgi_id, os.path.join(climate_wdir, 'per_glacier'))
+    stored = _read_fingerprints(gdir_dir)
+    if stored.get('init') != fingerprints['init']:
+        # glacier directory is reset, i.e. all stages must be run
+        stored = dict()
+
+    def is_done(stage):
+        return stored.get(stage) == fingerprints[stage]
+
+    # initialize, keep the glacier directory if nothing changed
+    gdir = init_single_glacier(rgi_id, wdir=climate_wdir, params=params,
+                               reset=not is_done('init'))
+    stored['init'] = fingerprints['init']
+    _write_fingerprints(gdir.dir, stored)
+
+    # preprocessing
+    if not (is_done('prepo') and _has_files(gdir, ['inversion_flowlines'])):
+        prepo(gdir)
+        stored['prepo'] = fingerprints['prepo']
+        _write_fingerprints(gdir.dir, stored)
+
+    # climate tasks
+    if climate == 'histalp':
+        # the climate file path is needed by the later stages as well
+        cfg.PATHS['climate_file'] = path_histalp
+    if not (is_done('climate') and
+            _has_files(gdir, ['climate_monthly', 'local_mustar'])):
+        if climate == 'histalp':
+            histalp_climate_tasks(gdir, path_ref_tstar, path_histalp)
+        else:
+            cru_climate_tasks(gdir)
+        stored['climate'] = fingerprints['climate']
+        _write_fingerprints(gdir.dir, stored)
     # print result of climate task to console
     # t*: year at which Grindelwald was in equilibrium
     # mu*: temperature sensitivity
     print(pd.read_csv(gdir.get_filepath('local_mustar')))
 
     # inversion
-    thick_inversion(gdir)
-
-    # final preparation for the run
-    execute_entity_task(tasks.init_present_time_glacier, [gdir])
-
-    # define massbalance model
-    mbmod = massbalance.PastMassBalance(gdir)
-
-    # run model for years with climate information
-    flowline.robust_model_run(gdir, output_filesuffix='_cru',
-                              mb_model=mbmod, ys=1902, ye=2016)
+    if not (is_done('inversion') and _has_files(gdir, ['inversion_output'])):
+        thick_inversion(gdir, glen_a=glen_a, fs=fs)
+        stored['inversion'] = fingerprints['inversion']
+        _write_fingerprints(gdir.dir, stored)
+
+    # model run
+    if not (is_done(run_key) and
+            _has_files(gdir, ['model_diagnostics'], filesuffix=suff)):
+        # final preparation for the run
+        execute_entity_task(tasks.init_present_time_glacier, [gdir])
+        # run model for years with climate information, using the
+        # tabulated past mass balance model (shared between runs)
+        run_tabulated_mb(gdir, ys=ys, ye=ye, output_filesuffix=suff)
+        stored[run_key] = fingerprints[run_key]
+        _write_fingerprints(gdir.dir, stored)
 
     # compile output - yields xarray
-    ds = utils.compile_run_output([gdir], filesuffix='_cru')
+    ds = utils.compile_run_output([gdir], filesuffix=suff)
     # convert xarray length data set into pandas series
     length = ds.length.to_series()
-    # set name to 'cru'
-    length.name = 'cru'
+    # set name to climate source
+    length.name = climate
     # drop RGI ID index
     year_index = length.index.droplevel(level=1).astype(int)
     # exchange index
     length.index = year_index
     # write to file
-    path = os.path.join(wdir, 'cru_length.csv')
+    path = os.path.join(wdir, '{}_length.csv'.format(climate))
     length.to_csv(path)
 
-    pass
+    return length
+
+
+def cru():
+    """ Use the above defined function to set up the model for the Upper Grindelwald Glacier
+    and run it with the CRU climate data from 1902 to 2016.
+    The glacier lenght evolution will be saved in the `cru_lenght.csv` file.
+    """
+    run_pipeline(**RUN_CONFIGS['cru'])
 
 
 def histalp():
     """ Use the above defined function to set up the model for the Upper Grindelwald Glacier
-    and run it with the HISTALP climate data from 1802 to 2003.
+    and run it with the HISTALP climate data from 1802 to 2014.
     The glacier lenght evolution will be saved in the `histalp_lenght.csv` file.
     """
+    run_pipeline(**RUN_CONFIGS['histalp'])
 
-    # specify the RGI ID for the Upper Grindelwald Glacier
-    rgi_id = 'RGI60-11.01270'
-    # specify path to working directory
-    wdir = '/Users/oberrauch/work/grindelwald/working_directories/first_run_wd'
-
-    # specify parameters and corresponding values
-    params = {
-        'rgi_version': 6,
-        'use_multiple_flowlines': True,
-        'border': 70,
-        'continue_on_error': False,
-        'use_intersects': False,
-        'run_mb_calibration': True
-    }
 
-    # initialize
-    gdir = init_single_glacier(rgi_id, wdir=wdir, params=params)
-    # preprocessing
-    prepo(gdir)
+def run(use_histalp=True):
+    """ Use the above defined function to set up the model for the Upper Grindelwald Glacier
+    and run it with either the HISTALP or the CRU climate data (see `histalp()` and `cru()`).
+    """
+    if use_histalp:
+        histalp()
+    else:
+        cru()
 
-    # climate - histalp
-    path_ref_tstar = '/Users/oberrauch/work/grindelwald/working_directories/mb_calib_wd/ref_tstars.csv'
-    path_histalp = '/Users/oberrauch/work/grindelwald/raw_data/histalp_merged_full.nc'
-    histalp_climate_tasks(gdir, path_ref_tstar, path_histalp)
-    # print result of climate task to console
-    # t*: year at which Grindelwald was in equilibrium
-    # mu*: temperature sensitivity
-    print(pd.read_csv(gdir.get_filepath('local_mustar')))
 
-    # inversion
-    thick_inversion(gdir)
+def init_glaciers(rgi_ids, wdir=None, paths=None, params=None,
+                  processes=None, reset=True):
+    """ Same as `init_single_glacier()`, but for a list of glaciers, using
+    OGGM multiprocessing. The glaciers are sorted by area (largest first),
+    so that the longest tasks start first and the workers are evenly loaded.
+
+    :param rgi_ids: (list of str) RGI IDs of the glaciers of interest
+    :param wdir: (str, optional) name, and/or relative path to working directory
+    :param paths: (dict, optional) path to be changed/set in config
+    :param params: (dict, optional) params to be changed/set in config
+    :param processes: (int, optional) number of worker processes,
+        all available CPUs as default
+    :param reset: (bool, optional) delete existing glacier directories
+    :return: (list) glacier directories, sorted by area
+    """
+    # load the OGGM parameter file
+    cfg.initialize()
+
+    # change/set paths in parameter file
+    if paths is not None:
+        for p, v in paths.items():
+            cfg.PATHS[p] = v
 
-    # final preparation for the run
-    execute_entity_task(tasks.init_present_time_glacier, [gdir])
+    # change/set parameters in parameter file
+    if params is not None:
+        for p, v in params.items():
+            cfg.PARAMS[p] = v
 
-    # define massbalance model
-    mbmod = massbalance.PastMassBalance(gdir)
+    # use OGGM multiprocessing
+    cfg.PARAMS['use_multiprocessing'] = True
+    cfg.PARAMS['mp_processes'] = processes if processes else -1
 
-    # run model for years with climate information
-    flowline.robust_model_run(gdir, output_filesuffix='_histalp',
-                              mb_model=mbmod, ys=1802, ye=2014)
+    # get RGI entries, sorted by area for load balancing
+    df_rgi = get_rgi_entities(rgi_ids)
+    df_rgi = df_rgi.sort_values('Area', ascending=False)
 
-    # compile output - yields xarray
-    ds = utils.compile_run_output([gdir], filesuffix='_histalp')
-    # convert xarray length data set into pandas series
-    length = ds.length.to_series()
-    # set name to 'histalp'
-    length.name = 'histalp'
-    # drop RGI ID index
-    year_index = length.index.droplevel(level=1).astype(int)
-    # exchange index
-    length.index = year_index
-    # write to file
-    path = os.path.join(wdir, 'histalp_length.csv')
-    length.to_csv(path)
-    pass
+    # define name of working directory if no given
+    if wdir is None:
+        wdir = os.path.join(os.getcwd(), 'working_dir')
+    # create local working directory (where OGGM will write its output)
+    utils.mkdir(wdir)
+    # set path in config
+    cfg.PATHS['working_dir'] = wdir
+    # some user output
+    print('Working directory: ', wdir)
 
+    # Go - initialize working directories
+    return workflow.init_glacier_regions(df_rgi, reset=reset)
 
-def run(use_histalp=True):
-    """ Use the above defined function to set up the model for the Upper Grindelwald Glacier
-    and run it with the HISTALP climate data from 1802 to 2003.
-    The glacier lenght evolution will be saved in the `histalp_lenght.csv` file.
-    """
 
-    # specify the RGI ID for the Upper Grindelwald Glacier
-    rgi_id = 'RGI60-11.01270'
-    # specify path to working directory
-    wdir = '/Users/oberrauch/work/grindelwald/working_directories/first_run_wd'
-
-    # specify parameters and corresponding values
-    params = {
-        'rgi_version': 6,
-        'use_multiple_flowlines': True,
-        'border': 70,
-        'continue_on_error': False,
-        'use_intersects': False,
-        'run_mb_calibration': use_histalp
-    }
+def run_tabulated_mb(gdir, ys=None, ye=None, output_filesuffix=''):
+    """ Runs the model with the (tabulated) glacier wide past mass balance
+    model, as done by `run_pipeline()`. Can be used as entity task, e.g.
+    for `run_batch()`.
 
-    # initialize
-    gdir = init_single_glacier(rgi_id, wdir=wdir, params=params)
-    # preprocessing
-    prepo(gdir)
+    :param gdir: (oggm.GlacierDirectory) glacier directory, ready to run
+    :param ys: (int, optional) start year of the model run
+    :param ye: (int, optional) end year of the model run
+    :param output_filesuffix: (str, optional) suffix of the output files
+    """
+    mbmod = get_tabulated_mb(gdir)
+    flowline.robust_model_run(gdir, output_filesuffix=output_filesuffix,
+                              mb_model=mbmod, ys=ys, ye=ye)
+
+
+def run_batch(rgi_ids, climate='histalp', ys=1802, ye=2014, params=None,
+              glen_a=None, fs=0., wdir=None, processes=None,
+              path_ref_tstar=PATH_REF_TSTAR, path_histalp=PATH_HISTALP):
+    """ Runs the model for many glaciers (e.g. the region around
+    Grindelwald), with the same stages as `run_pipeline()`. Every task is
+    executed for the whole list of glaciers at once, using OGGM
+    multiprocessing. The model runs use the same (glacier wide) mass balance
+    model as `run_pipeline()`. The glacier lengths are written to the file
+    `<climate>_length_batch.csv` in the working directory.
+
+    :param rgi_ids: (list of str) RGI IDs of the glaciers of interest
+    :param climate: (str, optional) climate source, 'cru' or 'histalp'
+    :param ys: (int, optional) start year of the model run
+    :param ye: (int, optional) end year of the model run
+    :param params: (dict, optional) params to be changed/set in config
+    :param glen_a: (float, optional) creep parameter, OGGM default if None
+    :param fs: (float, optional) sliding parameter
+    :param wdir: (str, optional) path to working directory
+    :param processes: (int, optional) number of worker processes,
+        all available CPUs as default
+    :param path_ref_tstar: (str, optional) path to custom reference t*
+        calibration list, only used with HISTALP
+    :param path_histalp: (str, optional) path to HISTALP climate file
+    :return: (pd.DataFrame) glacier lengths, index by year, one column
+        per glacier
+    """
+    if wdir is None:
+        wdir = '/Users/oberrauch/work/grindelwald/working_directories/first_run_batch_wd'
+    suff = '_{}'.format(climate)
 
-    # run climate tasks
-    if use_histalp:
-        # climate - use_histalp
-        path_ref_tstar = '/Users/oberrauch/work/grindelwald/working_directories/mb_calib_wd/ref_tstars.csv'
-        path_histalp = '/Users/oberrauch/work/grindelwald/raw_data/histalp_merged_full.nc'
-        histalp_climate_tasks(gdir, path_ref_tstar, path_histalp)
-        # print result of climate task to console
-        # t*: year at which Grindelwald was in equilibrium
-        # mu*: temperature sensitivity
-        print(pd.read_csv(gdir.get_filepath('local_mustar')))
-        # set file name/suffix
-        suff = 'histalp'
+    # initialize and preprocessing
+    gdirs = init_glaciers(rgi_ids, wdir=wdir, params=params,
+                          processes=processes)
+    prepo(gdirs)
+
+    # climate tasks
+    if climate == 'histalp':
+        histalp_climate_tasks(gdirs, path_ref_tstar, path_histalp)
     else:
-        # climate - cru
-        cru_climate_tasks(gdir)
-        # print result of climate task to console
-        # t*: year at which Grindelwald was in equilibrium
-        # mu*: temperature sensitivity
-        print(pd.read_csv(gdir.get_filepath('local_mustar')))
-        # set file name/suffix
-        suff = 'cru'
+        cru_climate_tasks(gdirs)
 
     # inversion
-    thick_inversion(gdir)
+    thick_inversion(gdirs, glen_a=glen_a, fs=fs)
 
-    # final preparation for the run
-    execute_entity_task(tasks.init_present_time_glacier, [gdir])
-
-    # define massbalance model
-    mbmod = massbalance.PastMassBalance(gdir)
-
-    # run model for years with climate information
-    flowline.robust_model_run(gdir, output_filesuffix=suff,
-                              mb_model=mbmod, ys=1802, ye=2014)
+    # final preparation and model run, using the same mass balance
+    # model as for single glaciers
+    execute_entity_task(tasks.init_present_time_glacier, gdirs)
+    execute_entity_task(run_tabulated_mb, gdirs, ys=ys, ye=ye,
+                        output_filesuffix=suff)
 
     # compile output - yields xarray
-    ds = utils.compile_run_output([gdir], filesuffix=suff)
-    # convert xarray length data set into pandas series
-    length = ds.length.to_series()
-    # set name to 'use_histalp'
-    length.name = suff
-    # drop RGI ID index
-    year_index = length.index.droplevel(level=1).astype(int)
-    # exchange index
-    length.index = year_index
+    ds = utils.compile_run_output(gdirs, filesuffix=suff)
+    # convert into DataFrame, one column per glacier
+    length = ds.length.to_pandas()
+    length.index = length.index.astype(int)
     # write to file
-    path = os.path.join(wdir, '{}_length.csv'.format(suff))
+    path = os.path.join(wdir, '{}_length_batch.csv'.format(climate))
     length.to_csv(path)
-    pass
+
+    return length
 
 
 def read_and_plot():
@@ -385,8 +571,8 @@ def read_and_plot():
     length_data = pd.concat([length_lec, length_histalp, length_cru], axis=1)
 
     # compute the offset between (measured) relative changes
-    # and (modeled) absolute length
-    offset_lec2hist = length_data[['lec', 'histalp']].dropna().iloc[0].diff().values[-1]
+    # and (modeled) absolute length, over all common years
+    offset_lec2hist = offset_to(length_data.lec, length_data.histalp)
     # add offset to leclerq lenght changes
     length_data.lec += offset_lec2hist
 
@@ -405,10 +591,10 @@ if __name__ == '__main__':
     # cru()
     # run(use_histalp=False)
 
-    # run the glacier with HISTALP climate data
+    # run the glacier with HISTALP climate data,
+    # repeated runs skip all stages whose inputs did not change
     histalp()
-    run(use_histalp=True)
-    
+
     # read the lenght data files and create plot
     read_and_plot()
     pass
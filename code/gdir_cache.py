@@ -0,0 +1,273 @@
+""" Caching routines for OGGM glacier directories.
+
+The GIS and centerline preprocessing of a glacier does not depend on
+any of the calibration parameters (precipitation scaling factor, t*,
+Glen's A, ...). Hence, it is computed once, stored as snapshot and all
+later runs start from a copy of this snapshot.
+
+In parameter sweeps, the intermediate results of the OGGM tasks (e.g.
+inversion output, model flowlines) are written to file only to be read
+again by the next task. The `MemoryGlacierDirectory` keeps those pickles
+in memory instead.
+"""
+
+# standard libraries
+import os
+import glob
+import shutil
+import pickle
+# oggm modules
+import oggm
+from oggm import cfg, utils
+from oggm.core import gis, centerlines
+# local modules
+from utils import get_rgi_entities
+
+# default location of the preprocessing snapshots
+CACHE_DIR = '/Users/oberrauch/work/grindelwald/working_directories/prepro_cache/'
+
+# files which are not changed by any task after the centerline
+# preprocessing and can therefore be hardlinked instead of copied
+_LINK_SUFFIXES = ('.tif', '.shp', '.shx', '.dbf', '.prj', '.cpg')
+_LINK_FILES = ('glacier_grid.json', 'dem_source.txt')
+
+# marker file, written after the snapshot is complete
+_COMPLETE = '.snapshot_complete'
+
+
+class MemoryGlacierDirectory(oggm.GlacierDirectory):
+    """ Glacier directory which keeps all pickled objects in memory.
+
+    Pickles which are not yet in memory are read from disk once. All
+    written pickles are kept in memory and only written to disk if
+    `persist` is set. The objects are stored as pickled byte strings, so
+    that every read returns a new (independent) object, just like reading
+    from file, but without file I/O and compression.
+    """
+
+    def __init__(self, *args, persist=False, **kwargs):
+        """ Same arguments as `oggm.GlacierDirectory`, plus:
+
+        :param persist: (bool, optional) write pickles also to disk
+        """
+        super(MemoryGlacierDirectory, self).__init__(*args, **kwargs)
+        self.persist = persist
+        self._pickles = dict()
+
+    def read_pickle(self, filename, use_compression=None, filesuffix=''):
+        key = (filename, filesuffix)
+        if key not in self._pickles:
+            # read from disk only once
+            var = super(MemoryGlacierDirectory, self).read_pickle(
+                filename, use_compression=use_compression,
+                filesuffix=filesuffix)
+            self._pickles[key] = pickle.dumps(var, protocol=-1)
+            return var
+        return pickle.loads(self._pickles[key])
+
+    def write_pickle(self, var, filename, use_compression=None,
+                     filesuffix=''):
+        self._pickles[(filename, filesuffix)] = pickle.dumps(var, protocol=-1)
+        if self.persist:
+            super(MemoryGlacierDirectory, self).write_pickle(
+                var, filename, use_compression=use_compression,
+                filesuffix=filesuffix)
+
+    def has_file(self, filename, filesuffix=''):
+        """ Checks if a file exists, either in memory or on disk. """
+        if (filename, filesuffix) in self._pickles:
+            return True
+        if filesuffix:
+            return os.path.exists(self.get_filepath(filename,
+                                                    filesuffix=filesuffix))
+        return super(MemoryGlacierDirectory, self).has_file(filename)
+
+    def flush(self):
+        """ Writes all pickles kept in memory to disk. """
+        for (filename, filesuffix), var in self._pickles.items():
+            super(MemoryGlacierDirectory, self).write_pickle(
+                pickle.loads(var), filename, filesuffix=filesuffix)
+
+
+def snapshot_name(rgi_id, border, use_intersects, rgi_version):
+    """ Returns the name of the preprocessing snapshot directory, built
+    from all parameters which affect the preprocessing.
+
+    :param rgi_id: (str) RGI ID, e.g. RGI60-11.01270
+    :param border: (int) number of grid points around the glacier outline
+    :param use_intersects: (bool) whether intersects are used
+    :param rgi_version: (str) RGI version
+    :return: (str) snapshot directory name
+    """
+    return '{}_border_{:d}_intersects_{:d}_rgi_{}'.format(
+        rgi_id, int(border), int(bool(use_intersects)), rgi_version)
+
+
+def gdir_path(rgi_id, base_dir=None):
+    """ Returns the path of a glacier directory, following the OGGM
+    directory structure `per_glacier/RGI60-11/RGI60-11.01/RGI60-11.01270`.
+
+    :param rgi_id: (str) RGI ID, e.g. RGI60-11.01270
+    :param base_dir: (str, optional) base directory, the `per_glacier`
+        directory in the current working directory by default
+    :return: (str) path to glacier directory
+    """
+    if base_dir is None:
+        base_dir = os.path.join(cfg.PATHS['working_dir'], 'per_glacier')
+    return os.path.join(base_dir, rgi_id[:8], rgi_id[:11], rgi_id)
+
+
+def _link_or_copy(src, dst):
+    """ Hardlinks files which are never changed after the preprocessing,
+    all other files (which are re-written by the OGGM tasks in place) are
+    copied. Falls back to copying if hardlinks are not possible. """
+    fn = os.path.basename(src)
+    if fn.endswith(_LINK_SUFFIXES) or fn in _LINK_FILES:
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def copy_gdir(src, dst):
+    """ Copies the content of the glacier directory `src` to `dst`. An
+    already existing destination directory is replaced.
+
+    :param src: (str) path to source glacier directory
+    :param dst: (str) path to destination glacier directory
+    """
+    if os.path.exists(dst):
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst, copy_function=_link_or_copy,
+                    ignore=shutil.ignore_patterns(_COMPLETE))
+
+
+def _pid_running(pid):
+    """ Checks whether a process with the given pid is running. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, but owned by another user
+        pass
+    return True
+
+
+def clean_tmp_snapshots(snapshot):
+    """ Removes the temporary snapshot directories (`<snapshot>.tmp<pid>`)
+    left by crashed processes, i.e. directories without the completion
+    marker whose process is not running anymore.
+
+    :param snapshot: (str) path to snapshot directory
+    :return: (list) paths of the removed directories
+    """
+    removed = []
+    for tmp_dir in glob.glob(glob.escape(snapshot) + '.tmp*'):
+        pid = tmp_dir[len(snapshot) + len('.tmp'):]
+        complete = os.path.isfile(os.path.join(tmp_dir, _COMPLETE))
+        if complete or not pid.isdigit():
+            continue
+        if int(pid) == os.getpid() or not _pid_running(int(pid)):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            removed.append(tmp_dir)
+    return removed
+
+
+def prepro(gdir, rgi_entity):
+    """ Runs the GIS and centerline preprocessing tasks on the given
+    glacier directory.
+
+    :param gdir: (oggm.GlacierDirectory) glacier directory
+    :param rgi_entity: RGI entry of the glacier
+    """
+    # GIS
+    gis.define_glacier_region(gdir, entity=rgi_entity)
+    gis.glacier_masks(gdir)
+
+    # Centerlines
+    centerlines.compute_centerlines(gdir)
+    centerlines.initialize_flowlines(gdir)
+    centerlines.compute_downstream_line(gdir)
+    centerlines.compute_downstream_bedshape(gdir)
+    centerlines.catchment_area(gdir)
+    centerlines.catchment_intersections(gdir)
+    centerlines.catchment_width_geom(gdir)
+    centerlines.catchment_width_correction(gdir)
+
+
+def get_preprocessed_gdir(rgi_id, rgi_version='6', rgi_region='11',
+                          cache_dir=None, in_memory=False, persist=False):
+    """ Returns a glacier directory in the current working directory,
+    which contains the results of all GIS and centerline tasks.
+
+    The preprocessing snapshot is keyed on the RGI ID, the border, the
+    intersects switch and the RGI version. If a matching snapshot exists,
+    it is copied (or hardlinked, where safe) into the working directory
+    without recomputing anything. Otherwise the preprocessing is run and
+    the result is stored as new snapshot. The border and intersects
+    parameters are read from `cfg.PARAMS`, so the config must be set up
+    beforehand.
+
+    :param rgi_id: (str) RGI ID, e.g. RGI60-11.01270
+    :param rgi_version: (str, optional) RGI version, 6 as default
+    :param rgi_region: (str, optional) RGI region, needed for intersects
+    :param cache_dir: (str, optional) path to the snapshot directory
+    :param in_memory: (bool, optional) return a `MemoryGlacierDirectory`,
+        which keeps all pickles written by later tasks in memory
+    :param persist: (bool, optional) write pickles also to disk,
+        only used in combination with `in_memory`
+    :return: (oggm.GlacierDirectory) preprocessed glacier directory
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    # path to snapshot
+    name = snapshot_name(rgi_id, cfg.PARAMS['border'],
+                         cfg.PARAMS['use_intersects'], rgi_version)
+    snapshot = os.path.join(cache_dir, name)
+
+    if os.path.isfile(os.path.join(snapshot, _COMPLETE)):
+        # restore glacier directory from snapshot
+        copy_gdir(snapshot, gdir_path(rgi_id))
+        return _open_gdir(rgi_id, in_memory, persist)
+
+    # remove incomplete snapshots of crashed processes
+    clean_tmp_snapshots(snapshot)
+
+    # get RGI entity
+    rgi_df = get_rgi_entities([rgi_id], rgi_version=rgi_version)
+    rgi_entity = rgi_df.iloc[0]
+
+    # specify intersects
+    if cfg.PARAMS['use_intersects']:
+        cfg.set_intersects_db(utils.get_rgi_intersects_region_file(rgi_region))
+
+    # prepare glacier directory and run preprocessing
+    gdir = oggm.GlacierDirectory(rgi_entity, reset=True)
+    prepro(gdir, rgi_entity)
+
+    # store snapshot, using a temporary directory so that
+    # parallel processes never see an incomplete snapshot
+    tmp_dir = '{}.tmp{:d}'.format(snapshot, os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    shutil.copytree(gdir.dir, tmp_dir)
+    open(os.path.join(tmp_dir, _COMPLETE), 'w').close()
+    try:
+        os.rename(tmp_dir, snapshot)
+    except OSError:
+        # another process was faster (or an incomplete snapshot exists)
+        shutil.rmtree(tmp_dir)
+
+    if in_memory:
+        return _open_gdir(rgi_id, in_memory, persist)
+    return gdir
+
+
+def _open_gdir(rgi_id, in_memory=False, persist=False):
+    """ Opens the existing glacier directory in the working directory. """
+    if in_memory:
+        return MemoryGlacierDirectory(rgi_id, persist=persist)
+    return oggm.GlacierDirectory(rgi_id)
@@ -10,54 +10,43 @@ The two most prelevant model parameters are the ice creep parameter
 ## Import
 # import externals libs
 import os
-import shutil
+import copy
+import multiprocessing
 import numpy as np
 import pandas as pd
 import xarray as xr
-import geopandas as gpd
-import matplotlib.pyplot as plt
+from scipy import optimize
 
 # import OGGM modules
 import oggm
 from oggm import cfg, utils
-from oggm.utils import get_demo_file, get_rgi_glacier_entities
-from oggm.core import gis, climate, centerlines, massbalance, flowline, inversion
+from oggm.utils import get_demo_file
+from oggm.core import climate, flowline, inversion
 
-from mb_calibration_grindel import mb_calib
+from mb_calibration_grindel import get_ref_tstars
+import gdir_cache
+import skill
+from sweep_store import SweepStore
+from ensemble_flowline import EnsembleFluxModel
+from mb_table import get_tabulated_mb
 
 
-def glen_a(factors, prcp_fac=None, ref_df=None, path=None,
-           t_star=None, bias=0):
-    """ Run model with different values for the creep parameter A.
-    Compute correlation coefficient and rmsd to length reference.
-    Returns findings as DataFrame, and stores them to file (if path is
-    given).
+def init_config(wdir=None):
+    """ Loads the default parameter file and sets the parameters used for
+    all Glen A experiments (working directory, border, intersects and the
+    HistAlp climate/mass balance hyper parameters).
 
     Parameters:
     -----------
-    factors : float array like
-        numerical factors with which the default A parameter is scaled
-    prcp_fac : float, optional, default: None
-        precipitation scaling factor
-    ref_df : pandas.DataFrame
-        table with t_star and mb residual for reference glaciers
-    path : string, optional
-        file path where to store results
-    t_star : float, optional, default: None
-        equilibrium year used for the mass balance calibration
-    bias : float, optional, default: 0
-        mass balance residual in [mm w.e. yr-1]
-
-    Returns:
-    --------
-    @TODO
+    wdir : string, optional
+        path to the OGGM working directory, the working example directory
+        is used as default
     """
-
-    ## Initialize
     # load default parameter file
     cfg.initialize()
     # specify working directory
-    wdir = '/Users/oberrauch/work/grindelwald/working_directories/working_example/'
+    if not wdir:
+        wdir = '/Users/oberrauch/work/grindelwald/working_directories/working_example/'
     cfg.PATHS['working_dir'] = wdir
 
     # set border high enough for idealized experiment
@@ -68,169 +57,416 @@ def glen_a(factors, prcp_fac=None, ref_df=None, path=None,
 
     # set climate/massbalance hyper parameters for HistAlp dataset
     cfg.PARAMS['baseline_climate'] = 'HISTALP'
-    if prcp_fac:
-        cfg.PARAMS['prcp_scaling_factor'] = prcp_fac
-    else:
-        cfg.PARAMS['prcp_scaling_factor'] = 1.75
+    cfg.PARAMS['prcp_scaling_factor'] = 1.75
     cfg.PARAMS['temp_melt'] = -1.75
 
+
+def prepare_glacier(cache_dir=None, in_memory=True, persist=False):
+    """ First stage of the Glen A pipeline, independent of all calibration
+    parameters: restores the GIS/centerline preprocessing from the snapshot
+    cache and processes the HistAlp climate file. Has to be run once per
+    glacier directory, after `init_config()`.
+
+    Parameters:
+    -----------
+    cache_dir : string, optional
+        path to the directory of preprocessing snapshots, see `gdir_cache`
+    in_memory : bool, optional, default: True
+        keep the intermediate pickles (inversion output, model flowlines,
+        climate info, ...) in memory, see `gdir_cache.MemoryGlacierDirectory`
+    persist : bool, optional, default: False
+        write the intermediate pickles to disk nevertheless
+
+    Returns:
+    --------
+    oggm.GlacierDirectory
+    """
     ## Preprocessing
-    # get RGI entity
+    # get glacier directory with GIS and centerline preprocessing,
+    # restored from the snapshot cache if possible
     rgi_id = 'RGI60-11.01270'
-    rgi_df = get_rgi_glacier_entities([rgi_id], version='6')
-    rgi_entity = rgi_df.iloc[0]
+    gdir = gdir_cache.get_preprocessed_gdir(rgi_id, rgi_version='6',
+                                            cache_dir=cache_dir,
+                                            in_memory=in_memory,
+                                            persist=persist)
 
-    # specify intersects
-    cfg.set_intersects_db(utils.get_rgi_intersects_region_file('11'))
+    ## Climate
+    # process the HistAlp climate file
+    climate.process_histalp_data(gdir)
 
-    # prepare glacier directory
-    gdir = oggm.GlacierDirectory(rgi_entity, reset=True)
+    return gdir
 
-    # ### GIS
-    gis.define_glacier_region(gdir, entity=rgi_entity)
-    gis.glacier_masks(gdir)
 
-    # ### Centerlines
-    centerlines.compute_centerlines(gdir)
-    centerlines.initialize_flowlines(gdir)
-    centerlines.compute_downstream_line(gdir)
-    centerlines.compute_downstream_bedshape(gdir)
-    centerlines.catchment_area(gdir)
-    centerlines.catchment_intersections(gdir)
-    centerlines.catchment_width_geom(gdir)
-    centerlines.catchment_width_correction(gdir)
+def calibrate_climate(gdir, prcp_fac=None, ref_df=None, t_star=None, bias=0):
+    """ Second stage of the Glen A pipeline, to be run once per
+    (t*, prcp_fac) pair: computes the temperature sensitivity mu*
+    and prepares the inversion, which both do not depend on Glen's A.
+
+    Parameters:
+    -----------
+    gdir : oggm.GlacierDirectory
+        glacier directory, as returned by `prepare_glacier()`
+    prcp_fac : float, optional, default: None
+        precipitation scaling factor, 1.75 if not given
+    ref_df : pandas.DataFrame
+        table with t_star and mb residual for reference glaciers
+    t_star : float, optional, default: None
+        equilibrium year used for the mass balance calibration
+    bias : float, optional, default: 0
+        mass balance residual in [mm w.e. yr-1]
+
+    Returns:
+    --------
+    mb_table.TabulatedMassBalance instance (tabulated PastMassBalance),
+    shared by all calls with the same climate calibration
+    """
+    # set precipitation scaling factor
+    if prcp_fac:
+        cfg.PARAMS['prcp_scaling_factor'] = prcp_fac
+    else:
+        cfg.PARAMS['prcp_scaling_factor'] = 1.75
 
     ## Climate and mass balance parameters
-    # process the HistAlp climate file
-    climate.process_histalp_data(gdir)
     if (t_star is not None) and (bias is not None):
         climate.local_t_star(gdir, tstar=t_star, bias=bias)
     else:
         climate.local_t_star(gdir, ref_df=ref_df)
     climate.mu_star_calibration(gdir)
 
+    ## Inversion
+    # prepare the ice thickness inversion (depends only on mu*)
+    inversion.prepare_for_inversion(gdir)
+
     ## Mass balance
-    # instance mass balance model using the historic climate file
-    mb_model = massbalance.PastMassBalance(gdir)
-
-    # store default values for Glen's A parameter
-    inv_glen_a = cfg.PARAMS['inversion_glen_a']
-    glen_a = cfg.PARAMS['glen_a']
-
-    # create DataFrame
-    df = pd.DataFrame(index=factors,
-                      columns=['corr', 'rmsd', 'rmsd_bc', 'amp_diff'])
-
-    for f in factors:
-        # Change the creep parameter
-        cfg.PARAMS['inversion_glen_a'] = inv_glen_a * f
-        cfg.PARAMS['glen_a'] = glen_a * f
-
-        ## Inversion
-        # run ice thicknes inversion
-        inversion.prepare_for_inversion(gdir)
-        inversion.mass_conservation_inversion(gdir)
-        inversion.filter_inversion_output(gdir)
+    # tabulated mass balance model using the historic climate file
+    return get_tabulated_mb(gdir)
 
-        ## Dynamic model
-        # finalize the preprocessing
-        flowline.init_present_time_glacier(gdir)
 
-        ## Model
-        # read needed file
-        ci = gdir.read_pickle('climate_info')
-        fls = gdir.read_pickle('model_flowlines')
+def can_scale_inversion():
+    """ Checks whether the inversion result can be scaled analytically to
+    another creep parameter, i.e. whether the ice thickness is proportional
+    to A^(-1/(n+2)). This is the case without sliding and without shape
+    factor (which depends on the thickness itself).
 
-        # now we can use the flowline model
-        model = flowline.FluxBasedModel(fls, mb_model=mb_model,
-                                        y0=ci['baseline_hydro_yr_0'])
+    Returns:
+    --------
+    bool
+    """
+    fs = cfg.PARAMS.get('inversion_fs', 0)
+    shape_factor = cfg.PARAMS.get('use_shape_factor_for_inversion', None)
+    return (not fs) and (shape_factor in [None, False, 'None', ''])
 
-        # run model over entire HistAlp period
-        run_ds, diag_ds = model.run_until_and_store(2014)
 
-        # get modeled length changes as DataFrame
-        length_mod = diag_ds.length_m.to_dataframe()[['hydro_year', 'length_m']]
-        length_mod = length_mod.reindex(index=length_mod.hydro_year)
-        length_mod.drop('hydro_year', axis=1, inplace=True)
-        length_mod.columns = ['model']
+def invert_glen_a(gdir, glen_a, cache=None):
+    """ Ice thickness inversion with the given creep parameter (without
+    filtering). If a cache is given, the first call solves the inversion
+    and stores the raw result in the cache. Later calls scale the cached
+    thickness and volume by (A / A_0)^(-1/(n+2)), as long as this is exact
+    (see `can_scale_inversion()`), otherwise the inversion is solved again.
+    The cache is only valid as long as the mass balance calibration (i.e.
+    the ice flux) does not change.
 
-        # get reference length (Leclercq)
-        fn = '/Users/oberrauch/work/grindelwald/data/length_ref_abs.csv'
-        length_ref = pd.read_csv(fn, index_col=0)
+    Parameters:
+    -----------
+    gdir : oggm.GlacierDirectory
+        glacier directory, prepared for the inversion
+    glen_a : float
+        creep parameter used for the inversion
+    cache : dict, optional
+        (empty) dictionary, used to store the first inversion result
+    """
+    if cache and can_scale_inversion():
+        # scale the stored solution
+        ratio = (glen_a / cache['glen_a']) ** (-1 / (cfg.PARAMS['glen_n'] + 2))
+        out = copy.deepcopy(cache['output'])
+        for cl in out:
+            cl['thick'] = cl['thick'] * ratio
+            cl['volume'] = cl['volume'] * ratio
+        gdir.write_pickle(out, 'inversion_output')
+        gdir.write_pickle({'glen_a': glen_a, 'fs': 0.}, 'inversion_params')
+        return
+
+    # solve the inversion
+    inversion.mass_conservation_inversion(gdir, glen_a=glen_a)
+    if cache is not None and not cache:
+        cache['glen_a'] = glen_a
+        cache['output'] = gdir.read_pickle('inversion_output')
+
+
+def run_glen_a_factor(gdir, mb_model, factor, ye=2014, inversion_cache=None):
+    """ Third stage of the Glen A pipeline, to be run for every A factor:
+    ice thickness inversion and dynamic run with the scaled creep
+    parameter. The scaled A values are passed to the inversion and the
+    flowline model directly, `cfg.PARAMS` remains untouched.
+
+    Parameters:
+    -----------
+    gdir : oggm.GlacierDirectory
+        glacier directory, as returned by `calibrate_climate()`
+    mb_model : massbalance.MassBalanceModel
+        mass balance model used for the dynamic run
+    factor : float
+        numerical factor with which the default A parameter is scaled
+    ye : int, optional, default: 2014
+        end year of the model run
+    inversion_cache : dict, optional
+        inversion result of another A factor (with the same mass balance
+        calibration), see `invert_glen_a()`
 
-        # combine both records
-        length_df = pd.concat([length_ref, length_mod], axis=1)
+    Returns:
+    --------
+    pandas.DataFrame with modeled length, index by hydrological year
+    """
+    ## Inversion
+    # run ice thicknes inversion (or scale the cached one)
+    invert_glen_a(gdir, cfg.PARAMS['inversion_glen_a'] * factor,
+                  cache=inversion_cache)
+    inversion.filter_inversion_output(gdir)
+
+    ## Dynamic model
+    # finalize the preprocessing
+    flowline.init_present_time_glacier(gdir)
+
+    ## Model
+    # read needed file (from memory if possible)
+    ci = gdir.read_pickle('climate_info')
+    fls = gdir.read_pickle('model_flowlines')
+
+    # now we can use the flowline model
+    model = flowline.FluxBasedModel(fls, mb_model=mb_model,
+                                    y0=ci['baseline_hydro_yr_0'],
+                                    glen_a=cfg.PARAMS['glen_a'] * factor)
+
+    # run model over entire HistAlp period
+    run_ds, diag_ds = model.run_until_and_store(ye)
+
+    # get modeled length changes as DataFrame
+    length_mod = diag_ds.length_m.to_dataframe()[['hydro_year', 'length_m']]
+    length_mod = length_mod.reindex(index=length_mod.hydro_year)
+    length_mod.drop('hydro_year', axis=1, inplace=True)
+    length_mod.columns = ['model']
+
+    return length_mod
+
+
+def run_glen_a_factors(gdir, mb_model, factors, ye=2014, inversion_cache=None):
+    """ Same as `run_glen_a_factor()`, but for all given factors at once:
+    the flowlines of all inversions are collected and all A factors run
+    as one ensemble (see `ensemble_flowline.EnsembleFluxModel`), instead
+    of one flowline model per factor. All members advance with the time
+    step of the fastest member, hence the length differs slightly from
+    the one of `run_glen_a_factor()`.
 
-        # get control data
-        control = length_df.loc[1894:]
-        # compute correlation coefficient
-        corr = control.corr().iloc[0, 1]
-        # compute rmsd anomaly
-        rmsd = utils.rmsd(control.length_ref, control.model)
-        rmsd_bc = utils.rmsd_bc(control.length_ref, control.model)
+    Parameters:
+    -----------
+    gdir : oggm.GlacierDirectory
+        glacier directory, as returned by `calibrate_climate()`
+    mb_model : massbalance.MassBalanceModel
+        mass balance model used for the dynamic runs
+    factors : float array like
+        numerical factors with which the default A parameter is scaled
+    ye : int, optional, default: 2014
+        end year of the model runs
+    inversion_cache : dict, optional
+        inversion result of another A factor (with the same mass balance
+        calibration), see `invert_glen_a()`
+
+    Returns:
+    --------
+    pandas.DataFrame with modeled length, index by A factor and one column
+    per hydrological year
 
-        # compute amplitude
-        amp = control.max() - control.min()
-        amp_diff = amp.diff().iloc[-1]
+    Raises:
+    -------
+    RuntimeError if a member failed (domain exceeded or NaN), as
+    `FluxBasedModel.run_until()` does for single runs
+    """
+    # inversion and model flowlines for every factor
+    members_fls = list()
+    for factor in factors:
+        invert_glen_a(gdir, cfg.PARAMS['inversion_glen_a'] * factor,
+                      cache=inversion_cache)
+        inversion.filter_inversion_output(gdir)
+        flowline.init_present_time_glacier(gdir)
+        members_fls.append(gdir.read_pickle('model_flowlines'))
+
+    # run all factors at once, over the entire HistAlp period
+    ci = gdir.read_pickle('climate_info')
+    model = EnsembleFluxModel(members_fls, mb_model,
+                              y0=ci['baseline_hydro_yr_0'],
+                              glen_a=cfg.PARAMS['glen_a'] * np.asarray(factors))
+    diag_ds = model.run_until_and_store(ye)
+    if diag_ds.failed.any():
+        raise RuntimeError('Model run failed for the A factors {}.'.format(
+            list(np.asarray(factors)[diag_ds.failed.values])))
+
+    length_mod = diag_ds.length_m.to_pandas()
+    length_mod.index = factors
+    length_mod.columns = length_mod.columns.astype(int)
+    return length_mod
+
+
+def score_glen_a_factors(gdir, mb_model, factors, length_ref=None, path=None,
+                         inversion_cache=None, ensemble=False):
+    """ Runs the A dependent part of the pipeline for all given factors
+    and scores the resulting length against the reference. The inversion
+    is solved only once, all other factors scale this solution (if exact,
+    see `invert_glen_a()`).
 
-        # add to Dataframe
-        df.loc[f] = [corr, rmsd, rmsd_bc, amp_diff]
+    Parameters:
+    -----------
+    gdir : oggm.GlacierDirectory
+        glacier directory, as returned by `calibrate_climate()`
+    mb_model : massbalance.MassBalanceModel
+        mass balance model used for the dynamic runs
+    factors : float array like
+        numerical factors with which the default A parameter is scaled
+    length_ref : pandas.Series, optional
+        reference length, the Leclercq record is read from file if not given
+    path : string, optional
+        file path where to store results
+    inversion_cache : dict, optional
+        inversion cache, to be shared between calls with the same mass
+        balance calibration, a new one is used if not given
+    ensemble : bool, optional, default: False
+        run all factors as one ensemble (see `run_glen_a_factors()`, the
+        length differs slightly from the single runs), otherwise one model
+        run per factor
+
+    Returns:
+    --------
+    pandas.DataFrame with the columns `corr`, `rmsd`, `rmsd_bc` and
+    `amp_diff`, index by A factor
+    """
+    if inversion_cache is None:
+        inversion_cache = dict()
+    if length_ref is None:
+        # get reference length (Leclercq)
+        length_ref = skill.read_length_ref('leclercq')
+
+    # run model for all factors and collect the length (factors x years)
+    if ensemble:
+        length_mod = run_glen_a_factors(gdir, mb_model, factors,
+                                        inversion_cache=inversion_cache)
+    else:
+        length_mod = [run_glen_a_factor(gdir, mb_model, f,
+                                        inversion_cache=inversion_cache).model
+                      for f in factors]
+        length_mod = pd.concat(length_mod, axis=1).T
+
+    # score all runs at once
+    df = skill.score(length_mod.values, length_mod.columns.values,
+                     length_ref.values, length_ref.index.values, y0=1894)
+    df = df[['corr', 'rmsd', 'rmsd_bc', 'amp_diff']]
+    df.index = factors
 
     if path:
         # store to file
         df.to_csv(path)
 
-    # reset the creep parameter to default values
-    cfg.PARAMS['inversion_glen_a'] = inv_glen_a
-    cfg.PARAMS['glen_a'] = glen_a
-
     return df
 
 
-def cross_correlation_with_mb_calibration():
+def glen_a(factors, prcp_fac=None, ref_df=None, path=None,
+           t_star=None, bias=0, wdir=None, cache_dir=None):
+    """ Run model with different values for the creep parameter A.
+    Compute correlation coefficient and rmsd to length reference.
+    Returns findings as DataFrame, and stores them to file (if path is
+    given).
+
+    The pipeline is split into three stages (`prepare_glacier()`,
+    `calibrate_climate()` and `run_glen_a_factor()`), which can be used
+    separately to avoid repeating the A independent work.
+
+    Parameters:
+    -----------
+    factors : float array like
+        numerical factors with which the default A parameter is scaled
+    prcp_fac : float, optional, default: None
+        precipitation scaling factor
+    ref_df : pandas.DataFrame
+        table with t_star and mb residual for reference glaciers
+    path : string, optional
+        file path where to store results
+    t_star : float, optional, default: None
+        equilibrium year used for the mass balance calibration
+    bias : float, optional, default: 0
+        mass balance residual in [mm w.e. yr-1]
+    wdir : string, optional
+        path to the OGGM working directory, the working example directory
+        is used as default
+    cache_dir : string, optional
+        path to the directory of preprocessing snapshots, see `gdir_cache`
+
+    Returns:
+    --------
+    pandas.DataFrame with the columns `corr`, `rmsd`, `rmsd_bc` and
+    `amp_diff`, index by A factor
+    """
+
+    ## Initialize
+    init_config(wdir)
+
+    ## Preprocessing and climate
+    gdir = prepare_glacier(cache_dir=cache_dir)
+
+    ## Mass balance calibration
+    mb_model = calibrate_climate(gdir, prcp_fac=prcp_fac, ref_df=ref_df,
+                                 t_star=t_star, bias=bias)
+
+    ## Inversion and dynamic runs
+    return score_glen_a_factors(gdir, mb_model, factors, path=path)
+
+
+def cross_correlation_with_mb_calibration(overwrite=False):
     """ Runs the above defined `glen_a()` rountine for different
     precipitation scaling factors (in a loop). The mass balance
     calibration is performed for each precipitation scaling factor.
 
     Each precipitation scaling factor results in one file, which is
-    store in the ../data/length_corr/ directory.
+    store in the ../data/length_corr/ directory. Existing files are
+    skipped, unless `overwrite` is set.
 
     """
 
     # iterate over different precipitation scaling factors
     prcp_factors = np.linspace(1, 1.75, 16)
     for prcp_fac in prcp_factors:
-        # check if mb calibration already produced correct t* file
-        fn = '{:.2f}'.format((prcp_fac)).replace('.', '_')
-        fn = '/Users/oberrauch/work/grindelwald/ref_tstars/ref_tstars_prcp_{}.csv'.format(fn)
-        if os.path.isfile(fn):
-            # read prepared t* reference list
-            ref_df = pd.read_csv(fn, index_col=0)
-        else:
-            # run mass balance calibration
-            mb_calib(prcp_fac)
-            # read t* reference list
-            ref_df = pd.read_csv('/Users/oberrauch/oggm-fork/oggm/grindel/mb_calib_wd/ref_tstars.csv')
+        # skip already computed precipitation scaling factors
+        fp = '../data/length_corr/length_corr_prcp_fac_{:.2f}.csv'.format(prcp_fac)
+        if os.path.isfile(fp) and not overwrite:
+            continue
+        # get t* reference list, the mass balance calibration
+        # runs only if not found in the calibration cache
+        ref_df, _ = get_ref_tstars(prcp_fac)
         # define factors scaling the creep parameters
         factors = np.concatenate((np.linspace(0.1, 1, 9, endpoint=False),
                                   np.linspace(1, 20, 20)))
         # compute length correlation for different A parameters
-        fp = '../data/length_corr/length_corr_prcp_fac_{:.2f}.csv'.format(prcp_fac)
         glen_a(factors, prcp_fac=prcp_fac, ref_df=ref_df, path=fp)
 
 
-def cross_correlation_without_mb_calibration():
+def cross_correlation_without_mb_calibration(overwrite=False):
     """ Runs the above defined `glen_a()` rountine for different
     precipitation scaling factors (in a loop), using mu_star based on
     the reference t_start list.
 
     Each precipitation scaling factor results in one file, which is
-    store in the ../data/length_corr_no_mb_calib/ directory.
+    store in the ../data/length_corr_no_mb_calib/ directory. Existing
+    files are skipped, unless `overwrite` is set.
 
     """
+    # the A independent preprocessing is done only once
+    init_config()
+    gdir = prepare_glacier()
+
     # iterate over different precipitation factors
     prcp_factors = np.linspace(1, 1.75, 16)
     for prcp_fac in prcp_factors:
+        # skip already computed precipitation scaling factors
+        fp = '../data/length_corr_no_mb_calib/length_corr_prcp_fac_{:.2f}.csv'.format(prcp_fac)
+        if os.path.isfile(fp) and not overwrite:
+            continue
         # define factors scaling the creep parameters
         factors = np.concatenate((np.linspace(0.1, 1, 9, endpoint=False),
                                   np.linspace(1, 20, 20)))
@@ -238,17 +474,18 @@ def cross_correlation_without_mb_calibration():
         fn = get_demo_file('oggm_ref_tstars_rgi6_histalp.csv')
         ref_df = pd.read_csv(fn, index_col=0)
         # compute length correlation for different A parameters
-        fp = '../data/length_corr_no_mb_calib/length_corr_prcp_fac_{:.2f}.csv'.format(prcp_fac)
-        glen_a(factors, prcp_fac=prcp_fac, path=fp, ref_df=ref_df)
+        mb_model = calibrate_climate(gdir, prcp_fac=prcp_fac, ref_df=ref_df)
+        score_glen_a_factors(gdir, mb_model, factors, path=fp)
 
 
-def cross_correlation_tstar_prcpfac_glena_files():
+def cross_correlation_tstar_prcpfac_glena_files(overwrite=False):
     """ Runs the above defined `glen_a()` rountine for different
     precipitation scaling factors and different 'equilibrium years'
     t_star (in a nested loop). No mass balance calibration is performed.
 
     Each precipitation scaling factor results in one file, which is
-    store in the ../data/length_corr_t_star/ directory.
+    store in the ../data/length_corr_t_star/ directory. Existing files
+    are skipped, unless `overwrite` is set.
 
     """
     # specify range of t* to test
@@ -257,6 +494,10 @@ def cross_correlation_tstar_prcpfac_glena_files():
     y1 = 1960
     t_stars = np.arange(y0, y1+1, step)
 
+    # the A independent preprocessing is done only once
+    init_config()
+    gdir = prepare_glacier()
+
     # iterate over all t*
     for t_star in t_stars:
 
@@ -269,18 +510,92 @@ def cross_correlation_tstar_prcpfac_glena_files():
             # compute length correlation for different A parameters
             fp = ('../data/length_corr_t_star/length_corr_t_star_{:d}'
                   '_prcp_fac_{:.2f}.csv'.format(t_star, prcp_fac))
-            glen_a(factors, prcp_fac=prcp_fac, path=fp, t_star=t_star)
+            if os.path.isfile(fp) and not overwrite:
+                continue
+            mb_model = calibrate_climate(gdir, prcp_fac=prcp_fac,
+                                         t_star=t_star)
+            score_glen_a_factors(gdir, mb_model, factors, path=fp)
+
+
+def _glen_a_cell(args):
+    """ Runs the `glen_a()` routine for one single (t*, prcp_fac) cell of
+    the parameter grid. Used as worker function by the process pool in
+    `cross_correlation_tstar_prcpfac_glena()`, hence the single argument.
+
+    Each cell gets its own working directory (below the given base
+    directory), so that parallel workers do not share glacier directories.
+
+    Parameters:
+    -----------
+    args : tuple
+        (t_star, prcp_fac, glen_a_factors, base_dir, cache_dir)
+
+    Returns:
+    --------
+    t_star, prcp_fac and the DataFrame returned by `glen_a()`
+    """
+    t_star, prcp_fac, glen_a_factors, base_dir, cache_dir = args
+    # isolated working directory for this cell
+    wdir = None
+    if base_dir:
+        wdir = os.path.join(base_dir, 't_star_{:d}_prcp_fac_{:.2f}'.format(
+            int(t_star), prcp_fac))
+        utils.mkdir(wdir)
+    # compute length correlation for different A parameters
+    # the preprocessing is restored from the shared snapshot cache
+    df = glen_a(glen_a_factors, prcp_fac=prcp_fac, t_star=t_star, wdir=wdir,
+                cache_dir=cache_dir)
+    return t_star, prcp_fac, df
 
 
 def cross_correlation_tstar_prcpfac_glena(t_stars,
                                           prcp_factors,
-                                          glen_a_factors):
+                                          glen_a_factors,
+                                          processes=None,
+                                          base_dir=None,
+                                          store=None,
+                                          cache_dir=None):
     """ Runs the above defined `glen_a()` rountine for different
     precipitation scaling factors and different 'equilibrium years'
     t_star (in a nested loop). No mass balance calibration is performed.
 
-    The results are returned as a pd.DataFrame, no data is store in files.
+    The (t*, prcp_fac) cells are independent of each other and can be
+    farmed out to a process pool, whereby every worker runs in its own
+    working directory below `base_dir`. All Glen A factors of one cell
+    are computed by the same worker. The GIS and centerline preprocessing
+    is computed (at most) once, stored in the snapshot cache and restored
+    by every worker.
+
+    If the path to a sweep store is given, every finished cell is
+    committed to the store immediately. Cells already found in the store
+    are not computed again, which allows to resume an interrupted sweep.
+
+    The results are returned as a xr.Dataset.
 
+    Parameters:
+    -----------
+    t_stars : int array like
+        equilibrium years used for the mass balance calibration
+    prcp_factors : float array like
+        precipitation scaling factors
+    glen_a_factors : float array like
+        numerical factors with which the default A parameter is scaled
+    processes : int, optional, default: None
+        number of worker processes, the grid is computed serially
+        if not given (or one)
+    base_dir : string, optional
+        directory below which the per cell working directories are
+        created, needed if running in parallel
+    store : string, optional
+        path to the SQLite file of the sweep store, see `sweep_store`
+    cache_dir : string, optional
+        path to the directory of preprocessing snapshots, shared by all
+        workers, see `gdir_cache`
+
+    Returns:
+    --------
+    xr.Dataset with the variables `corr`, `rmsd`, `rmsd_bc` and `amp_diff`
+    on the (glen_a_fac, prcp_fac, t_star) grid
     """
     # create xarray Dataset with coordinates
     ds = xr.Dataset()
@@ -302,24 +617,243 @@ def cross_correlation_tstar_prcpfac_glena(t_stars,
     ds['rmsd_bc'] = (['glen_a_fac', 'prcp_fac', 't_star'], dummy.copy())
     ds['amp_diff'] = (['glen_a_fac', 'prcp_fac', 't_star'], dummy.copy())
 
-    # iterate over all t*
-    for t_star in t_stars:
-        # iterate over different precipitation factors
-        for prcp_fac in prcp_factors:
-            # define factors scaling the creep parameters
-
-            # read reference t* list
-            # compute length correlation for different A parameters
-            df = glen_a(glen_a_factors, prcp_fac=prcp_fac, t_star=t_star)
-            for glen_a_fac, row in df.iterrows():
-                for column, value in row.iteritems():
-                    ds[column].loc[dict(t_star=t_star,
-                                        prcp_fac=prcp_fac,
-                                        glen_a_fac=glen_a_fac)] = value
+    # one job per (t*, prcp_fac) cell
+    parallel = processes is not None and processes > 1
+    if parallel and not base_dir:
+        raise ValueError('A base directory is needed to run in parallel, '
+                         'since every worker needs its own working '
+                         'directory.')
+    jobs = [(t_star, prcp_fac, glen_a_factors, base_dir, cache_dir)
+            for t_star in t_stars for prcp_fac in prcp_factors]
+
+    if store:
+        # add already computed cells and skip them
+        store = SweepStore(store)
+        store.fill_dataset(ds)
+        jobs = [job for job in jobs if not store.done(*job[:3])]
+
+    def _collect(t_star, prcp_fac, df):
+        # add results to Dataset and commit them to the store
+        _fill_cell(ds, df, t_star, prcp_fac)
+        if store:
+            store.add(t_star, prcp_fac, df)
+
+    try:
+        if parallel and jobs:
+            # create the preprocessing snapshot beforehand, so that the
+            # workers do not all run the preprocessing at the same time
+            wdir = os.path.join(base_dir, 'prepro')
+            utils.mkdir(wdir)
+            init_config(wdir)
+            prepare_glacier(cache_dir=cache_dir)
+            # distribute cells over worker processes,
+            # cells are added as soon as they are finished
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.imap_unordered(_glen_a_cell, jobs)
+                for t_star, prcp_fac, df in results:
+                    _collect(t_star, prcp_fac, df)
+        elif jobs:
+            # the A independent preprocessing is done only once
+            init_config()
+            gdir = prepare_glacier(cache_dir=cache_dir)
+            length_ref = skill.read_length_ref('leclercq')
+            # iterate over all cells
+            for t_star, prcp_fac, _, _, _ in jobs:
+                mb_model = calibrate_climate(gdir, prcp_fac=prcp_fac,
+                                             t_star=t_star)
+                df = score_glen_a_factors(gdir, mb_model, glen_a_factors,
+                                          length_ref=length_ref)
+                _collect(t_star, prcp_fac, df)
+    finally:
+        if store:
+            store.close()
 
     return ds
 
 
+def _fill_cell(ds, df, t_star, prcp_fac):
+    """ Writes the results of one `glen_a()` call (i.e. one (t*, prcp_fac)
+    cell) into the given Dataset.
+    """
+    for glen_a_fac, row in df.iterrows():
+        for column, value in row.iteritems():
+            ds[column].loc[dict(t_star=t_star,
+                                prcp_fac=prcp_fac,
+                                glen_a_fac=glen_a_fac)] = value
+
+
+class GlenAObjective(object):
+    """ Objective function for the adaptive calibration search, mapping
+    (t*, prcp_fac, A factor) onto a skill score of the modeled length.
+
+    The climate calibration is only repeated if t* or the precipitation
+    scaling factor changed since the last evaluation. Every evaluated point
+    is kept in the trace and (if given) committed to the sweep store, where
+    already computed points are looked up before running the model.
+    """
+
+    def __init__(self, gdir, length_ref=None, score='rmsd', store=None):
+        """ Initializes the objective.
+
+        Parameters:
+        -----------
+        gdir : oggm.GlacierDirectory
+            glacier directory, as returned by `prepare_glacier()`
+        length_ref : pandas.Series, optional
+            reference length, the Leclercq record is read from file if
+            not given
+        score : string, optional, default: 'rmsd'
+            score to minimize, either 'rmsd', 'rmsd_bc' or 'corr' (whereby
+            1 - corr is minimized)
+        store : sweep_store.SweepStore, optional
+            store of already computed points
+        """
+        self.gdir = gdir
+        if length_ref is None:
+            length_ref = skill.read_length_ref('leclercq')
+        self.length_ref = length_ref
+        self.score = score
+        self.store = store
+        self.trace = list()
+        self._cell = None
+        self._mb_model = None
+        self._inversion_cache = dict()
+
+    def evaluate(self, t_star, prcp_fac, glen_a_fac):
+        """ Computes all skill scores for the given parameters.
+
+        Returns:
+        --------
+        pandas.Series with the scores `corr`, `rmsd`, `rmsd_bc` and
+        `amp_diff`, all NaN if the model run failed
+        """
+        scores = None
+        if self.store is not None:
+            scores = self.store.get(t_star, prcp_fac, glen_a_fac)
+        if scores is None:
+            try:
+                # climate calibration only if t* or prcp_fac changed
+                if self._cell != (t_star, prcp_fac):
+                    self._cell = None
+                    self._inversion_cache = dict()
+                    self._mb_model = calibrate_climate(
+                        self.gdir, prcp_fac=prcp_fac, t_star=t_star)
+                    self._cell = (t_star, prcp_fac)
+                df = score_glen_a_factors(
+                    self.gdir, self._mb_model, [glen_a_fac],
+                    length_ref=self.length_ref,
+                    inversion_cache=self._inversion_cache)
+            except (RuntimeError, ValueError, FloatingPointError):
+                # e.g. invalid mu* or numerical instabilities
+                df = pd.DataFrame(np.nan, index=[glen_a_fac],
+                                  columns=['corr', 'rmsd', 'rmsd_bc',
+                                           'amp_diff'])
+            else:
+                if self.store is not None:
+                    self.store.add(t_star, prcp_fac, df)
+            scores = df.iloc[0]
+        self.trace.append(dict(t_star=t_star, prcp_fac=prcp_fac,
+                               glen_a_fac=glen_a_fac, **scores))
+        return scores
+
+    def __call__(self, t_star, prcp_fac, glen_a_fac):
+        """ Returns the value to minimize, infinity for failed runs. """
+        scores = self.evaluate(t_star, prcp_fac, glen_a_fac)
+        value = scores[self.score]
+        if self.score == 'corr':
+            value = 1 - value
+        return value if np.isfinite(value) else np.inf
+
+    def trace_df(self):
+        """ Returns all evaluated points and their scores as DataFrame,
+        in order of evaluation. """
+        return pd.DataFrame(self.trace, columns=['t_star', 'prcp_fac',
+                                                 'glen_a_fac', 'corr', 'rmsd',
+                                                 'rmsd_bc', 'amp_diff'])
+
+
+def search_glen_a(x0=(1950, 1.75, 1.), bounds=((1917, 1987), (1., 2.5),
+                                               (0.1, 20.)),
+                  score='rmsd', max_evals=60, objective=None, store=None,
+                  wdir=None):
+    """ Adaptive alternative to the exhaustive parameter grids: searches the
+    (t*, prcp_fac, A factor) combination with the best skill score with the
+    Nelder-Mead simplex algorithm. The search runs in the unit cube spanned
+    by the bounds, the A factor on a logarithmic scale. t* is rounded to
+    full years, the scaling factors to three decimals, so that repeated
+    points are looked up instead of computed again.
+
+    Parameters:
+    -----------
+    x0 : tuple, optional
+        start values of (t*, prcp_fac, A factor)
+    bounds : tuple, optional
+        (min, max) of t*, prcp_fac and A factor
+    score : string, optional, default: 'rmsd'
+        score to minimize, see `GlenAObjective`
+    max_evals : int, optional, default: 60
+        maximal number of objective evaluations (i.e. model runs)
+    objective : callable, optional
+        objective function f(t_star, prcp_fac, glen_a_fac), with a
+        `trace_df()` method, a `GlenAObjective` for the Upper Grindelwald
+        Glacier is created by default
+    store : string, optional
+        path to the SQLite file of the sweep store, see `sweep_store`
+    wdir : string, optional
+        path to the OGGM working directory
+
+    Returns:
+    --------
+    best parameters (pandas.Series with `t_star`, `prcp_fac`, `glen_a_fac`
+    and the scores) and the trace of all evaluations (pandas.DataFrame)
+    """
+    if store:
+        store = SweepStore(store)
+    if objective is None:
+        init_config(wdir)
+        gdir = prepare_glacier()
+        objective = GlenAObjective(gdir, score=score, store=store)
+
+    # transformation between unit cube and parameter space
+    lower = np.array([bounds[0][0], bounds[1][0], np.log10(bounds[2][0])])
+    upper = np.array([bounds[0][1], bounds[1][1], np.log10(bounds[2][1])])
+
+    def to_params(x):
+        p = lower + np.clip(x, 0, 1) * (upper - lower)
+        return int(np.round(p[0])), round(p[1], 3), round(10 ** p[2], 3)
+
+    def to_unit(t_star, prcp_fac, glen_a_fac):
+        p = np.array([t_star, prcp_fac, np.log10(glen_a_fac)])
+        return (p - lower) / (upper - lower)
+
+    values = dict()
+
+    def fun(x):
+        params = to_params(x)
+        if params not in values:
+            values[params] = objective(*params)
+        return values[params]
+
+    # initial simplex, spanning a fifth of each parameter range
+    start = np.clip(to_unit(*x0), 0, 0.8)
+    simplex = np.vstack([start] + [start + 0.2 * np.eye(3)[i]
+                                   for i in range(3)])
+    try:
+        optimize.minimize(fun, start, method='Nelder-Mead',
+                          options={'maxfev': max_evals,
+                                   'initial_simplex': simplex,
+                                   'xatol': 1e-3, 'fatol': 1e-2})
+    finally:
+        if store:
+            store.close()
+
+    # best evaluated point
+    trace = objective.trace_df()
+    value = trace[score] if score != 'corr' else 1 - trace['corr']
+    best = trace.loc[value.idxmin()] if value.notnull().any() else None
+    return best, trace
+
+
 if __name__ == '__main__':
     import time
 
@@ -333,11 +867,23 @@ if __name__ == '__main__':
     # specify range of glen A scaling factor
     glen_a_factors = np.array([0.1, 0.5, 1, 2, 10])
 
+    # specify number of worker processes and their working directories
+    processes = multiprocessing.cpu_count()
+    base_dir = '/Users/oberrauch/work/grindelwald/working_directories/glen_a_sweep/'
+    # finished cells are stored immediately, allowing to resume the sweep
+    store = '/Users/oberrauch/work/grindelwald/data/glen_a_sweep.sqlite'
+    # preprocessing snapshots, shared by all workers
+    cache_dir = gdir_cache.CACHE_DIR
+
     start = time.time()
 
     ds = cross_correlation_tstar_prcpfac_glena(t_stars,
                                                prcp_factors,
-                                               glen_a_factors)
+                                               glen_a_factors,
+                                               processes=processes,
+                                               base_dir=base_dir,
+                                               store=store,
+                                               cache_dir=cache_dir)
 
     # display computation time
     print('Elapsed time:', time.time() - start, '[s]')
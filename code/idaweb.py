@@ -5,6 +5,9 @@ provided by the IDAWEB service (https://gate.meteoswiss.ch/idaweb/more.do)
 import numpy as np
 import pandas as pd
 import os
+import io
+import json
+import multiprocessing
 
 # specify column names, depending on the selected language
 
@@ -71,57 +74,102 @@ def read_index_file(path, file_type='Data', lang='en'):
     return data
 
 
-def read_legend_file(path, encoding='latin-1', lang='en'):
-    """
+def _slice_fwf(lines, colspecs):
+    """ Converts lines of a fixed width table into a DataFrame, by slicing
+    the columns directly from the given lines. The first line holds the
+    column names, the first column is used as index. Blank lines are skipped
+    and numeric columns are converted, as `pd.read_fwf` does it.
 
-    :param path:
-    :param encoding:
-    :param lang:
-    :return:
+    :param lines: (list of str) table lines, including the header line
+    :param colspecs: (list of tuples) fixed column widths (start, end)
+    :return: (pd.DataFrame) table
     """
-    # open file
-    fh = open(path, encoding=encoding)
+    rows = [[line[a:b].strip() for a, b in colspecs]
+            for line in lines if line.strip()]
+    header, rows = rows[0], rows[1:]
+    # name unnamed columns like pandas does
+    header = [h if h else 'Unnamed: {:d}'.format(i)
+              for i, h in enumerate(header)]
+    table = pd.DataFrame(rows, columns=header).replace('', np.nan)
+    # convert numeric columns
+    for col in table.columns:
+        try:
+            table[col] = pd.to_numeric(table[col])
+        except (ValueError, TypeError):
+            pass
+    table = table.set_index(header[0])
+    if header[0].startswith('Unnamed'):
+        table.index.name = None
+    return table
 
-    # dump all lines of file in dict whith line number as key
-    lines = dict()
-    for l_no, line in enumerate(fh):
-        lines[l_no] = line.strip()
 
-    # close file handler
-    fh.close()
-
-    # convert dictionary into Series, allowing
-    # to search keys (indeces) by values
-    lines = pd.Series(lines)
+def read_legend_file(path, encoding='latin-1', lang='en'):
+    """ Reads the legend file of an IDAWEB order, which contains
+    a station table and a parameter table (both in fixed width format).
+    The file is read only once, both sections are located in one scan
+    and sliced from the buffered lines.
+
+    :param path: (str) path to legend file
+    :param encoding: (str, optional) file encoding, latin-1 by default
+    :param lang: (str, optional) language of the order, 'en' or 'de'
+    :return: station table (pd.DataFrame), parameter table (pd.DataFrame)
+    """
+    # read all lines of the file at once
+    with open(path, encoding=encoding) as fh:
+        lines = fh.read().splitlines()
+
+    # find the section headings 'Station' and 'Parameter'
+    station_line = param_line = None
+    for l_no, line in enumerate(lines):
+        line = line.strip()
+        if station_line is None and line == legend_file[lang]['station']:
+            station_line = l_no
+        elif station_line is not None and line == legend_file[lang]['param']:
+            param_line = l_no
+            break
+    if station_line is None or param_line is None:
+        raise IndexError('Legend sections not found in {}'.format(path))
+
+    # the station section starts after the heading followed by a
+    # horizontal line and ends with the parameter section
+    colspecs = [(0, 10), (10, 47), (47, 64), (64, 115), (115, 140),
+                (140, 157), (157, 200)]
+    stn = _slice_fwf(lines[station_line + 2:param_line - 1], colspecs)
+
+    # the parameter section starts after the heading followed by a
+    # horizontal line and ends with the file (ignoring the last line)
+    colspecs = [(0, 10), (10, 47), (47, 200)]
+    param = _slice_fwf(lines[param_line + 2:len(lines) - 1], colspecs)
 
-    # get start and end of station sections
-    # starts with the heading 'Station' followed
-    # by some horizonal lines and
-    # ends with the paramter section
-    start_line = lines[lines == legend_file[lang]['station']].index[0] + 2
-    end_line = lines[lines == legend_file[lang]['param']].index[0] - 2
+    # return stations and parameter
+    return stn, param
 
-    # specify fixed column widths
-    colspecs = [(0, 10), (10, 47), (47, 64), (64, 115), (115, 140), (140, 157), (157, 200)]
 
-    # read station list from file
-    stn = pd.read_fwf(path, colspecs=colspecs, encoding=encoding, index_col=0,
-                      skiprows=lambda l: (l < start_line) or (l > end_line))
+# IDAWEB timestamp formats, identified by their length
+time_formats = {
+    4: '%Y',
+    6: '%Y%m',
+    8: '%Y%m%d',
+    10: '%Y%m%d%H',
+    12: '%Y%m%d%H%M'
+}
 
-    # get start and end of parameter sections
-    # starts with the heading 'Parameter' followed
-    # by some horizonal lines and ends with the file
-    start_line = lines[lines == legend_file[lang]['param']].index[0] + 2
-    end_line = lines.size - 2
 
-    # specify fixed column widths
-    colspecs = [(0, 10), (10, 47), (47, 200)]
+def parse_time(values, fmt=None):
+    """ Converts IDAWEB timestamps (e.g. yyyymm, yyyymmdd, yyyymmddHH) into
+    datetime objects. If no format is given, it is determined by the length
+    of the first timestamp. All timestamps are parsed at once.
 
-    # read parameter list from file
-    param = pd.read_fwf(path, colspecs=colspecs, encoding=encoding, index_col=0,
-                        skiprows=lambda l: (l < start_line) or (l > end_line))
-    # return stations and parameter
-    return stn, param
+    :param values: (array like) timestamps as strings or integers
+    :param fmt: (str, optional) explicit timestamp format, e.g. '%Y%m%d'
+    :return: (pd.DatetimeIndex)
+    """
+    values = pd.Index(values).astype(str).str.strip()
+    if not len(values):
+        return pd.DatetimeIndex([])
+    if fmt is None:
+        fmt = time_formats[len(values[0])]
+    return pd.DatetimeIndex(pd.to_datetime(values, format=fmt))
 
 
 def read_data_file(path, date_parser=None, drop_station=True):
@@ -142,6 +190,378 @@ def read_data_file(path, date_parser=None, drop_station=True):
     return data
 
 
+def _read_data_header(path, encoding='latin-1'):
+    """ Reads the header of an IDAWEB data file and counts the station
+    blocks (i.e. the header lines) in the same pass.
+
+    :param path: (str) path to data file
+    :param encoding: (str, optional) file encoding, latin-1 by default
+    :return: number of lines before the header line (int), column names
+        (list of str), station of the first row (str), number of station
+        blocks (int)
+    """
+    with open(path, encoding=encoding) as fh:
+        for l_no, line in enumerate(fh):
+            if line.startswith('stn;'):
+                columns = line.strip().split(';')
+                station = fh.readline().split(';')[0].strip()
+                # a further header line starts the block of another station
+                n_blocks = 1 + sum(1 for line in fh if line.startswith('stn;'))
+                return l_no, columns, station, n_blocks
+    raise ValueError('No header line found in {}'.format(path))
+
+
+def read_data_typed(path, usecols=None, time_format=None, drop_station=True,
+                    encoding='latin-1'):
+    """ Typed fast path of `read_data_file()`, for data files of one single
+    station. The timestamps are parsed vectorized with the given (or the
+    detected) IDAWEB format, the values are read as float32 and the station
+    is taken from the first row, so that the station column is never read.
+    Data files with multiple station blocks (e.g. order61305) are not
+    supported and raise a ValueError, see `read_data_blocks()` instead.
+
+    :param path: (str) path to data file
+    :param usecols: (list of str, optional) subset of parameters to read,
+        all parameters as default
+    :param time_format: (str, optional) timestamp format, e.g. '%Y%m%d',
+        determined by the length of the timestamps as default
+    :param drop_station: (bool, optional) add the station to the column
+        names instead of keeping the station column
+    :param encoding: (str, optional) file encoding, latin-1 by default
+    :return: (pd.DataFrame) data, index by time
+    """
+    skiprows, columns, station, n_blocks = _read_data_header(
+        path, encoding=encoding)
+    if n_blocks > 1:
+        raise ValueError('{} contains {:d} station blocks, use '
+                         'read_data_blocks() instead'.format(path, n_blocks))
+    params = [c for c in columns if c not in ['stn', 'time']]
+    if usecols is not None:
+        missing = set(usecols) - set(params)
+        if missing:
+            raise ValueError('Parameter(s) {} not in {}'.format(
+                ', '.join(sorted(missing)), path))
+        params = [p for p in params if p in usecols]
+
+    # read file, timestamps as strings and values as float32
+    dtype = {p: np.float32 for p in params}
+    dtype['time'] = str
+    data = pd.read_csv(path, sep=';', encoding=encoding, skiprows=skiprows,
+                       usecols=['time'] + params, dtype=dtype,
+                       na_values='-')
+    data.index = parse_time(data.pop('time').values, fmt=time_format)
+    data.index.name = 'time'
+
+    if drop_station:
+        # add station to column names
+        data.columns = ['{}_{}'.format(c, station) for c in data.columns]
+    else:
+        data.insert(0, 'stn', station)
+
+    return data
+
+
+def read_data_blocks(path, encoding='latin-1'):
+    """ Reads an IDAWEB data file into a long table with the columns
+    `station`, `param`, `time` and `value`. Data files with multiple
+    stations consist of several blocks (each one with its own header line,
+    possibly with different parameters), which are read separately.
+
+    :param path: (str) path to data file
+    :param encoding: (str, optional) file encoding, latin-1 by default
+    :return: (pd.DataFrame) long table
+    """
+    # read file and split into blocks, each starting with a header line
+    with open(path, encoding=encoding) as fh:
+        text = fh.read()
+    blocks = text.split('\nstn;')[1:]
+
+    tables = []
+    for block in blocks:
+        block = 'stn;' + block
+        # explicit dtypes, derived from the header line of the block
+        dtype = {c: np.float32 for c in block[:block.index('\n')].split(';')}
+        dtype.update({'stn': str, 'time': str})
+        data = pd.read_csv(io.StringIO(block), sep=';', na_values='-',
+                           dtype=dtype)
+        data = data.dropna(subset=['time'])
+        # convert into long format
+        data = data.melt(id_vars=['stn', 'time'], var_name='param')
+        tables.append(data)
+
+    columns = ['station', 'param', 'time', 'value']
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    data = pd.concat(tables, ignore_index=True)
+    data.rename(columns={'stn': 'station'}, inplace=True)
+    data['time'] = parse_time(data.time.values)
+    return data[columns]
+
+
+def _read_legend_any_lang(path):
+    """ Reads legend file, trying all known languages. """
+    for lang in legend_file:
+        try:
+            return read_legend_file(path, lang=lang)
+        except IndexError:
+            pass
+    raise RuntimeError('Unknown legend file format: {}'.format(path))
+
+
+def _read_index_any_lang(path):
+    """ Reads all entries of the index file, detecting the language by the
+    column names.
+
+    :param path: (str) path to index file
+    :return: index (pd.DataFrame), language (str)
+    """
+    data = read_index_file(path, file_type='all')
+    for lang, cols in index_columns.items():
+        if cols['name'] in data.columns and cols['period'] in data.columns:
+            return data, lang
+    raise RuntimeError('Unknown index file format: {}'.format(path))
+
+
+def _read_order_file(args):
+    """ Reads one data file and the corresponding legend file of an order.
+    Used as worker function by the process pool in `read_archive()`.
+
+    :param args: (tuple) (order name, path to data file)
+    :return: long table of the data file, station and parameter table
+    """
+    order, path = args
+    data = read_data_blocks(path)
+    data['order'] = order
+
+    # read corresponding legend file, if available
+    legend = path.replace('_data.txt', '_legend.txt')
+    stn = param = None
+    if os.path.isfile(legend):
+        stn, param = _read_legend_any_lang(legend)
+        # add unit of parameters (first column, independent of language)
+        units = param.iloc[:, 0]
+        data['unit'] = data.param.map(units)
+    return data, stn, param
+
+
+def _order_number(order):
+    """ Sort key of order directories, by order number (e.g. order61301),
+    so that e.g. order9999 precedes order10000.
+
+    :param order: (str) name or path of order directory
+    :return: (tuple) order number (-1 if none), name
+    """
+    name = os.path.basename(os.path.normpath(order))
+    digits = ''.join(c for c in name if c.isdigit())
+    return int(digits) if digits else -1, name
+
+
+def list_orders(archive_path):
+    """ Lists all order directories (named `order*`) in the archive.
+
+    :param archive_path: (str) path to IDAWEB archive, e.g. raw_data/idaweb_data
+    :return: (list) order directory names, sorted by order number
+    """
+    return sorted((d for d in os.listdir(archive_path)
+                   if d.startswith('order') and
+                   os.path.isdir(os.path.join(archive_path, d))),
+                  key=_order_number)
+
+
+def archive_signature(archive_path):
+    """ Returns modification time and size of every file in all order
+    directories, used to invalidate the archive cache.
+
+    :param archive_path: (str) path to IDAWEB archive
+    :return: (dict) relative file path: [mtime, size]
+    """
+    signature = dict()
+    for order in list_orders(archive_path):
+        order_path = os.path.join(archive_path, order)
+        for fn in sorted(os.listdir(order_path)):
+            stat = os.stat(os.path.join(order_path, fn))
+            signature[os.path.join(order, fn)] = [stat.st_mtime, stat.st_size]
+    return signature
+
+
+def read_archive(archive_path, cache_path=None, processes=None):
+    """ Reads all data and legend files of all orders in the IDAWEB archive
+    (in parallel) and joins them into one long table with the columns
+    `station`, `param`, `time`, `value`, `unit` and `order`. Values which
+    are delivered by multiple orders are kept only once (from the latest
+    order, i.e. the one with the highest order number).
+
+    If a cache path is given, the table is stored as pickle file. It is
+    read from there as long as no file in the archive changed (judged by
+    modification time and size), otherwise the archive is parsed again.
+
+    :param archive_path: (str) path to IDAWEB archive, e.g. raw_data/idaweb_data
+    :param cache_path: (str, optional) path to pickle cache file
+    :param processes: (int, optional) number of worker processes,
+        number of CPUs as default
+    :return: (pd.DataFrame) long table
+    """
+    signature = archive_signature(archive_path)
+
+    # check the cache
+    if cache_path:
+        sig_path = cache_path + '.json'
+        if os.path.isfile(cache_path) and os.path.isfile(sig_path):
+            with open(sig_path, 'r') as fp:
+                if json.load(fp) == signature:
+                    return pd.read_pickle(cache_path)
+
+    # list data files of all orders
+    jobs = []
+    for order in list_orders(archive_path):
+        order_path = os.path.join(archive_path, order)
+        _, _, data_files = list_files(order_path)
+        jobs += [(order, os.path.join(order_path, f))
+                 for f in sorted(data_files)]
+
+    if jobs:
+        # read all files in parallel
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_read_order_file, jobs)
+        # join all tables (in order of the jobs, i.e. by order number),
+        # keep duplicates from the latest order only
+        data = pd.concat([r[0] for r in results], ignore_index=True,
+                         sort=False)
+        data.drop_duplicates(subset=['station', 'param', 'time'],
+                             keep='last', inplace=True)
+        data.sort_values(['station', 'param', 'time'], kind='mergesort',
+                         inplace=True)
+        data.reset_index(drop=True, inplace=True)
+    else:
+        # no data files in the archive
+        data = pd.DataFrame(columns=['station', 'param', 'time', 'value',
+                                     'order', 'unit'])
+
+    # store to cache
+    if cache_path:
+        data.to_pickle(cache_path)
+        with open(cache_path + '.json', 'w') as fp:
+            json.dump(signature, fp)
+
+    return data
+
+
+def order_periods(order_path, lang=None):
+    """ Returns station, parameter and covered time range of every data file
+    in the order, using the `Period` column of the index file. Station and
+    parameter are taken from the file name, e.g.
+    order_61301_SLFFIR_rre150d0_1_data.txt.
+
+    :param order_path: (str) path to order directory
+    :param lang: (str, optional) language of the order, 'en' or 'de',
+        detected from the index file as default
+    :return: (pd.DataFrame) columns `file`, `station`, `param`, `start` and
+        `end`, or None if the order has no index file
+    """
+    index, _, _ = list_files(order_path)
+    if not index:
+        return None
+    # read index file, keep data files only
+    index_path = os.path.join(order_path, index)
+    if lang is None:
+        index, lang = _read_index_any_lang(index_path)
+    else:
+        index = read_index_file(index_path, file_type='all', lang=lang)
+    cols = index_columns[lang]
+    index = index.loc[index[cols['name']].str.endswith('_data.txt', na=False)]
+
+    # get station and parameter from file name
+    tokens = index[cols['name']].str.split('_')
+    periods = pd.DataFrame({'file': index[cols['name']].values,
+                            'station': tokens.str[2].values,
+                            'param': tokens.str[3].values})
+    # parse start and end of the period
+    period = index[cols['period']].str.split('-')
+    periods['start'] = [parse_time([p])[0] for p in period.str[0]]
+    periods['end'] = [parse_time([p])[0] for p in period.str[1]]
+    return periods
+
+
+def update_station_table(table_path, order_paths, param, stations=None,
+                         lang=None):
+    """ Updates a station data table (e.g. raw_data/station_data/
+    daily_precip_slf.csv, index by time and one column per station) with
+    the given IDAWEB orders. Only rows newer than the last valid value of
+    each station are appended. Data files, which do not cover any new
+    period (according to the index file), are not read at all.
+    Overlapping timestamps are kept only once, existing values are kept.
+
+    :param table_path: (str) path to station data table, created if missing
+    :param order_paths: (list of str) paths to order directories
+    :param param: (str) IDAWEB parameter, e.g. rre150d0
+    :param stations: (list of str, optional) station codes, all columns of
+        the existing table as default (all stations for a new table)
+    :param lang: (str, optional) language of the orders, 'en' or 'de',
+        detected for every order as default
+    :return: (pd.DataFrame) updated table
+    """
+    # read existing table
+    if os.path.isfile(table_path):
+        table = pd.read_csv(table_path, index_col=0, parse_dates=True)
+        if stations is None:
+            stations = list(table.columns)
+    else:
+        table = pd.DataFrame(index=pd.DatetimeIndex([]))
+    table.index.name = 'time'
+
+    # last valid timestamp of every station
+    last = {stn: table[stn].last_valid_index() for stn in table.columns}
+
+    new = []
+    for order_path in sorted(order_paths, key=_order_number):
+        periods = order_periods(order_path, lang=lang)
+        if periods is None:
+            # no index file, read all station blocks of the data files
+            _, _, data_files = list_files(order_path)
+            for f in data_files:
+                data = read_data_blocks(os.path.join(order_path, f))
+                data = data.loc[data.param == param]
+                if stations is not None:
+                    data = data.loc[data.station.isin(stations)]
+                new.append(data.pivot(index='time', columns='station',
+                                      values='value'))
+            continue
+
+        periods = periods.loc[periods.param == param]
+        if stations is not None:
+            periods = periods.loc[periods.station.isin(stations)]
+        for _, row in periods.iterrows():
+            # skip files without new period
+            stn_last = last.get(row.station)
+            if stn_last is not None and row.end <= stn_last:
+                continue
+            data = read_data_typed(os.path.join(order_path, row.file),
+                                   usecols=[param])
+            data.columns = [row.station]
+            new.append(data)
+
+    # keep only rows after the last valid value of each station
+    for data in new:
+        for stn in data.columns:
+            stn_last = last.get(stn)
+            if stn_last is not None:
+                data.loc[data.index <= stn_last, stn] = np.nan
+    new = [data.dropna(how='all') for data in new]
+    new = [data for data in new if not data.empty]
+    if not new:
+        return table
+
+    # merge new rows into table, keeping the first value per timestamp
+    for data in new:
+        data = data.loc[~data.index.duplicated(keep='first')]
+        table = table.combine_first(data)
+    table = table.sort_index()
+    table.index.name = 'time'
+    table.to_csv(table_path)
+
+    return table
+
+
 def get_wgs_limits(c_lon, c_lat, width, height, out='str'):
     """ Computes vertices window of given length and width around given centerpoint
     in WGS 84 coordinates. Default return type can be used in the IDAWEB data form.
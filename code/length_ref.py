@@ -0,0 +1,218 @@
+""" Reference length record of the Upper Grindelwald Glacier, reconciled
+from all available length sources.
+
+The sources (Leclercq, GLAMOS, the collected record in
+`grindelwald_lengths_all.csv`) are given as length changes with arbitrary
+offsets. The offsets are solved by least squares over all years where two
+sources overlap, the shifted records are averaged and the result is aligned
+to the absolute length reference. The reconciled record is cached, so that
+all scorers read the same precomputed series.
+"""
+
+# standard libraries
+import os
+import json
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+
+# oggm modules
+from oggm.utils import get_demo_file
+# local modules
+from utils import get_leclercq_length
+
+# length sources
+GLAMOS_FILE = '/Users/oberrauch/work/grindelwald/raw_data/length_data/glamos_length_change.csv'
+LENGTHS_ALL_FILE = '/Users/oberrauch/work/grindelwald/raw_data/glacier_data/grindelwald_lengths_all.csv'
+# absolute length reference, used to set the absolute level
+ABS_FILE = '/Users/oberrauch/work/grindelwald/data/length_ref_abs.csv'
+# cached reconciled length record
+CACHE_FILE = '/Users/oberrauch/work/grindelwald/data/length_ref_reconciled.csv'
+
+# names of the sources, in order of priority (the first one is kept fixed)
+SOURCES = ['glamos', 'leclercq', 'lengths_all']
+
+# reconciled records of this process, key by cache path
+_references = dict()
+
+
+def read_glamos(path=GLAMOS_FILE, glacier='Oberer Grindelwaldgletscher'):
+    """ Reads the GLAMOS length changes of the given glacier and returns
+    the cumulative length change, index by year of observation.
+
+    :param path: (str, optional) path to GLAMOS length change file
+    :param glacier: (str, optional) glacier name, as used by GLAMOS
+    :return: (pd.Series) cumulative length change [m]
+    """
+    # skip the copyright notice, the header spans three lines
+    data = pd.read_csv(path, sep=';', skiprows=6, encoding='latin-1')
+    data = data.iloc[2:]
+    data = data.loc[data['glacier name'] == glacier]
+    # index by year of the end of the observation period
+    years = data['end date of observation'].str[:4].astype(int).values
+    dl = pd.Series(data['length change'].astype(float).values, index=years)
+    dl = dl.groupby(level=0).sum().cumsum()
+    dl.index.name = 'years'
+    dl.name = 'glamos'
+    return dl
+
+
+def read_lengths_all(path=LENGTHS_ALL_FILE):
+    """ Reads the collected length record of the Upper Grindelwald Glacier.
+
+    :param path: (str, optional) path to length file
+    :return: (pd.Series) length change [m], index by year
+    """
+    dl = pd.read_csv(path, index_col=0).iloc[:, 0].astype(float)
+    dl.index = dl.index.astype(int)
+    dl.index.name = 'years'
+    dl.name = 'lengths_all'
+    return dl
+
+
+def read_leclercq(rgi_id='11.01270'):
+    """ Reads the Leclercq length record (see `utils.get_leclercq_length`).
+
+    :param rgi_id: (str, optional) RGI ID in format region.glacier
+    :return: (pd.Series) length change [m], index by year
+    """
+    dl = get_leclercq_length(rgi_id).iloc[:, 0].dropna()
+    dl.index = dl.index.astype(int)
+    dl.index.name = 'years'
+    dl.name = 'leclercq'
+    return dl
+
+
+def _read_source(source):
+    """ Reads the given length source. """
+    readers = {'glamos': read_glamos, 'leclercq': read_leclercq,
+               'lengths_all': read_lengths_all}
+    return readers[source]()
+
+
+def solve_offsets(records):
+    """ Solves the offsets between length records by least squares, i.e.
+    minimizes the sum of squared differences between all pairs of shifted
+    records over all years where both are available. The offset of the first
+    record is fixed to zero.
+
+    :param records: (list of pd.Series) length records, index by year
+    :return: (np.array) offsets, one per record
+    """
+    n = len(records)
+    rows = []
+    rhs = []
+    # records connected to the first one by a chain of overlaps
+    connected = np.zeros(n, dtype=bool)
+    connected[:1] = True
+    overlaps = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            # years where both records are available
+            common = records[i].dropna().index.intersection(
+                records[j].dropna().index)
+            # x_i + c_i = x_j + c_j, for every common year
+            row = np.zeros((len(common), n))
+            row[:, i] = 1
+            row[:, j] = -1
+            rows.append(row)
+            rhs.append(records[j].loc[common].values -
+                       records[i].loc[common].values)
+            if len(common):
+                overlaps.append((i, j))
+    a = np.concatenate(rows) if rows else np.zeros((0, n))
+    b = np.concatenate(rhs) if rhs else np.zeros(0)
+
+    # every record needs to be connected to the first one, otherwise the
+    # offsets between separate groups of records are undetermined
+    for _ in range(n):
+        for i, j in overlaps:
+            connected[i] = connected[j] = connected[i] or connected[j]
+    if not connected.all():
+        raise ValueError('Records not connected to the first record by '
+                         'overlaps: {}'.format(
+                             ', '.join(str(records[k].name)
+                                       for k in np.flatnonzero(~connected))))
+
+    # keep the first offset fixed
+    offsets = np.zeros(n)
+    if n > 1:
+        offsets[1:] = np.linalg.lstsq(a[:, 1:], b, rcond=None)[0]
+    return offsets
+
+
+def offset_to(record, target):
+    """ Returns the offset, which aligns the record with the target record
+    in the least squares sense over all common years (i.e. the mean
+    difference).
+
+    :param record: (pd.Series) length record, index by year
+    :param target: (pd.Series) target length record, index by year
+    :return: (float) offset to add to the record
+    """
+    return solve_offsets([target, record])[1]
+
+
+def reconcile(records, absolute=None):
+    """ Shifts all records by the least squares offsets and averages them
+    into one record. If an absolute length record is given, the result is
+    aligned with it.
+
+    :param records: (list of pd.Series) length records, index by year
+    :param absolute: (pd.Series, optional) absolute length reference
+    :return: (pd.Series) reconciled length record, index by year
+    """
+    offsets = solve_offsets(records)
+    shifted = pd.concat([r + c for r, c in zip(records, offsets)], axis=1)
+    ref = shifted.mean(axis=1).sort_index()
+    if absolute is not None:
+        ref += offset_to(ref, absolute.dropna())
+    ref.index.name = 'years'
+    ref.name = 'length_ref'
+    return ref
+
+
+def _signature():
+    """ Returns modification time and size of all source files. """
+    files = [GLAMOS_FILE, LENGTHS_ALL_FILE, ABS_FILE,
+             get_demo_file('Glacier_Lengths_Leclercq.nc')]
+    signature = dict()
+    for f in files:
+        stat = os.stat(f)
+        signature[f] = [stat.st_mtime, stat.st_size]
+    return signature
+
+
+def get_reference(cache_path=CACHE_FILE, overwrite=False):
+    """ Returns the reconciled absolute length record. All sources are read
+    in parallel, reconciled and the result is stored as csv file. As long as
+    none of the source files changed, the cached record is returned (and
+    read from file only once per process and cache path).
+
+    :param cache_path: (str, optional) path to cache file
+    :param overwrite: (bool, optional) recompute even if cached
+    :return: (pd.Series) absolute length [m], index by year
+    """
+    signature = _signature()
+    sig_path = cache_path + '.json'
+
+    if not overwrite and os.path.isfile(cache_path) and \
+            os.path.isfile(sig_path):
+        with open(sig_path, 'r') as fp:
+            if json.load(fp) == signature:
+                if cache_path not in _references:
+                    _references[cache_path] = pd.read_csv(
+                        cache_path, index_col=0).iloc[:, 0]
+                return _references[cache_path]
+
+    # read all sources in parallel (mostly I/O)
+    with ThreadPool(len(SOURCES)) as pool:
+        records = pool.map(_read_source, SOURCES)
+    absolute = pd.read_csv(ABS_FILE, index_col=0).iloc[:, 0]
+
+    reference = reconcile(records, absolute=absolute)
+    reference.to_csv(cache_path, header=True)
+    with open(sig_path, 'w') as fp:
+        json.dump(signature, fp)
+    _references[cache_path] = reference
+    return reference
@@ -5,27 +5,57 @@ with different precipitation scaling factors.
 # Python imports
 import json
 import os
+import re
+import shutil
+import hashlib
+import multiprocessing
 
 # Libs
 import numpy as np
+import pandas as pd
 
 # Locals
+import oggm
 from oggm import cfg, utils, tasks, workflow
 from oggm.workflow import execute_entity_task
-
-
-def mb_calib(prcp_fac):
-    # RGI Version
-    rgi_version = '61'
-
+from gdir_cache import copy_gdir
+from utils import get_rgi_entities
+
+
+# default location of the calibration cache
+CACHE_DIR = '/Users/oberrauch/work/grindelwald/mb_calib_cache/'
+# default output directory of `mb_calib_batch()`
+OUT_DIR = '/Users/oberrauch/work/grindelwald/ref_tstars'
+# parameters of the earlier calibrations (ref_tstars_prcp_X_XX.csv files
+# computed before the cache existed), see `seed_calib_cache()`
+LEGACY_PARAMS = {'temp_melt': -1.75, 'baseline_y0': 1850,
+                 'baseline_climate': 'HISTALP', 'rgi_version': '61'}
+# OGGM default parameters used by these calibrations
+LEGACY_MB_CALIB_PARAMS = {'temp_default_gradient': -0.0065,
+                          'temp_all_solid': 0., 'temp_all_liq': 2.}
+
+# hashes of the climate files, computed only once per process
+_file_hashes = dict()
+
+
+def init_calib_config(wdir, prcp_fac=1.75, temp_melt=-1.75,
+                      baseline_y0=1850, baseline_climate='HISTALP',
+                      use_multiprocessing=False):
+    """ Initializes OGGM and sets up the parameters of the mass balance
+    calibration.
+
+    :param wdir: (str) path to the working directory
+    :param prcp_fac: (float, optional) precipitation scaling factor
+    :param temp_melt: (float, optional) melt temperature threshold
+    :param baseline_y0: (int, optional) first year of the baseline climate
+    :param baseline_climate: (str, optional) baseline climate data set
+    :param use_multiprocessing: (bool, optional) use OGGM multiprocessing
+    """
     # Initialize OGGM and set up the run parameters
     cfg.initialize(logging_level='WORKFLOW')
 
     # Local paths (where to write the OGGM run output)
-    WORKING_DIR = os.path.join(os.getcwd(), 'mb_calib_wd')
-    utils.mkdir(WORKING_DIR, reset=True)
-    cfg.PATHS['working_dir'] = WORKING_DIR
-
+    cfg.PATHS['working_dir'] = wdir
 
     # The following code block alters certain parameters from
     # the default config file.
@@ -34,22 +64,35 @@ def mb_calib(prcp_fac):
     cfg.PARAMS['run_mb_calibration'] = True
 
     # We are using which baseline data?
-    cfg.PARAMS['baseline_climate'] = 'HISTALP'
+    cfg.PARAMS['baseline_climate'] = baseline_climate
 
     # No need for intersects since this has an effect on the inversion only
     cfg.PARAMS['use_intersects'] = False
 
     # Use multiprocessing?
-    cfg.PARAMS['use_multiprocessing'] = False
+    cfg.PARAMS['use_multiprocessing'] = use_multiprocessing
 
     # Set to True for operational runs
     cfg.PARAMS['continue_on_error'] = False
 
     # Other params: see https://oggm.org/2018/08/10/histalp-parameters/
     # a different mass balance model?!
-    cfg.PARAMS['baseline_y0'] = 1850
+    cfg.PARAMS['baseline_y0'] = baseline_y0
     cfg.PARAMS['prcp_scaling_factor'] = prcp_fac
-    cfg.PARAMS['temp_melt'] = -1.75
+    cfg.PARAMS['temp_melt'] = temp_melt
+
+
+def mb_calib_prepo(rgi_version='61'):
+    """ Runs the factor independent part of the calibration in the current
+    working directory: selects the Alpine reference glaciers, processes
+    their climate data and runs the GIS and centerline tasks. The config
+    must be set up beforehand (see `init_calib_config()`).
+
+    :param rgi_version: (str, optional) RGI version
+    :return: (list) glacier directories of the reference glaciers,
+        sorted by area
+    """
+    WORKING_DIR = cfg.PATHS['working_dir']
 
     # The next step is to get all the reference glaciers,
     # i.e. glaciers with mass balance measurements.
@@ -65,9 +108,8 @@ def mb_calib(prcp_fac):
     # For HISTALP only RGI reg 11
     rids = [rid for rid in rids if '-11.' in rid]
 
-    # Make a new dataframe with those (this takes a while)
-    print('Reading the RGI shapefiles...')
-    rgidf = utils.get_rgi_glacier_entities(rids, version=rgi_version)
+    # Make a new dataframe with those, from the local RGI index
+    rgidf = get_rgi_entities(rids, rgi_version=rgi_version)
     print('For RGIV{} we have {} candidate reference '
           'glaciers.'.format(rgi_version, len(rgidf)))
 
@@ -113,6 +155,17 @@ def mb_calib(prcp_fac):
     for task in task_list:
         execute_entity_task(task, gdirs)
 
+    return gdirs
+
+
+def mb_calib_climate(gdirs):
+    """ Runs the factor dependent part of the calibration, i.e. computes
+    the reference t* list and mu* of all reference glaciers, with the
+    parameters currently set in the config. The results are stored in
+    the working directory (`ref_tstars.csv`, `mb_calib_params.json`).
+
+    :param gdirs: (list) glacier directories, see `mb_calib_prepo()`
+    """
     # Climate tasks
     tasks.compute_ref_t_stars(gdirs)
     execute_entity_task(tasks.local_t_star, gdirs)
@@ -120,19 +173,370 @@ def mb_calib(prcp_fac):
 
     # We store the associated params
     mb_calib = gdirs[0].read_pickle('climate_info')['mb_calib_params']
-    with open(os.path.join(WORKING_DIR, 'mb_calib_params.json'), 'w') as fp:
+    with open(os.path.join(cfg.PATHS['working_dir'],
+                           'mb_calib_params.json'), 'w') as fp:
         json.dump(mb_calib, fp)
 
 
-if __name__ == '__main__':
-    prcp_factors = np.linspace(1, 1.75, 16)
-    for prcp_fac in prcp_factors:
-        # run mass balance calibration
-        mb_calib(prcp_fac)
+def mb_calib(prcp_fac, temp_melt=-1.75, baseline_y0=1850,
+             baseline_climate='HISTALP', rgi_version='61', wdir=None):
+    """ Runs the mass balance calibration for all Alpine reference
+    glaciers with the given parameters. The reference t* list
+    (`ref_tstars.csv`) and the calibration parameters
+    (`mb_calib_params.json`) are stored in the working directory.
+
+    :param prcp_fac: (float) precipitation scaling factor
+    :param temp_melt: (float, optional) melt temperature threshold
+    :param baseline_y0: (int, optional) first year of the baseline climate
+    :param baseline_climate: (str, optional) baseline climate data set
+    :param rgi_version: (str, optional) RGI version
+    :param wdir: (str, optional) path to the working directory,
+        `./mb_calib_wd` as default
+    :return: (str) path to the working directory
+    """
+    # Local paths (where to write the OGGM run output)
+    if wdir is None:
+        wdir = os.path.join(os.getcwd(), 'mb_calib_wd')
+    utils.mkdir(wdir, reset=True)
+
+    # Initialize OGGM and set up the run parameters
+    init_calib_config(wdir, prcp_fac=prcp_fac, temp_melt=temp_melt,
+                      baseline_y0=baseline_y0,
+                      baseline_climate=baseline_climate)
+
+    # Preprocessing and calibration
+    gdirs = mb_calib_prepo(rgi_version=rgi_version)
+    mb_calib_climate(gdirs)
+
+    return wdir
+
+
+def _mb_calib_factor(args):
+    """ Runs the calibration for one precipitation scaling factor, starting
+    from a copy of the preprocessed working directory. Used as worker
+    function by the process pool in `mb_calib_batch()`.
+
+    :param args: (tuple) (prepro_wdir, wdir, rgi_ids, prcp_fac, temp_melt,
+        baseline_y0, baseline_climate)
+    :return: prcp_fac, path to the working directory
+    """
+    (prepro_wdir, wdir, rgi_ids, prcp_fac, temp_melt,
+     baseline_y0, baseline_climate) = args
+    # copy the preprocessed working directory (hardlinks where safe)
+    copy_gdir(prepro_wdir, wdir)
+    init_calib_config(wdir, prcp_fac=prcp_fac, temp_melt=temp_melt,
+                      baseline_y0=baseline_y0,
+                      baseline_climate=baseline_climate)
+    # open the existing glacier directories
+    gdirs = [oggm.GlacierDirectory(rgi_id) for rgi_id in rgi_ids]
+    mb_calib_climate(gdirs)
+    return prcp_fac, wdir
+
+
+def mb_calib_batch(prcp_factors, out_dir=None, base_dir=None,
+                   processes=None, temp_melt=-1.75, baseline_y0=1850,
+                   baseline_climate='HISTALP', rgi_version='61',
+                   cache_dir=None):
+    """ Runs the mass balance calibration for many precipitation scaling
+    factors. The factor independent preprocessing of the reference
+    glaciers (climate processing, GIS and centerline tasks) is done only
+    once, the climate tasks (`compute_ref_t_stars`, `local_t_star` and
+    `mu_star_calibration`) run concurrently for all factors, each in its
+    own copy of the working directory.
+
+    Factors found in the calibration cache (see `lookup_calib()`) are not
+    computed again. One `ref_tstars_prcp_X_XX.csv` file per factor is
+    written to `out_dir`, and the new results are added to the cache.
+
+    :param prcp_factors: (float array like) precipitation scaling factors
+    :param out_dir: (str, optional) directory of the reference t* lists
+    :param base_dir: (str, optional) directory for the working directories,
+        `./mb_calib_batch` as default
+    :param processes: (int, optional) number of worker processes, one per
+        factor (and CPU) as default
+    :param temp_melt: (float, optional) melt temperature threshold
+    :param baseline_y0: (int, optional) first year of the baseline climate
+    :param baseline_climate: (str, optional) baseline climate data set
+    :param rgi_version: (str, optional) RGI version
+    :param cache_dir: (str, optional) path to the calibration cache
+    :return: (dict) path to the reference t* list for each factor
+    """
+    if out_dir is None:
+        out_dir = OUT_DIR
+    if base_dir is None:
+        base_dir = os.path.join(os.getcwd(), 'mb_calib_batch')
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    utils.mkdir(out_dir)
+
+    def _copy_ref_tstars(prcp_fac, src):
         # add prcp scaling factor to file name
-        src = os.path.join(cfg.PATHS['working_dir'], 'ref_tstars.csv')
-        dir = '/Users/oberrauch/work/grindelwald/ref_tstars'
-        fn = 'ref_tstars_prcp_{:.2f}'.format(prcp_fac).replace('.', '_') + '.csv'
-        dst = os.path.join(dir, fn)
-        os.rename(src, dst)
+        fn = 'ref_tstars_prcp_{:.2f}'.format(prcp_fac).replace('.', '_')
+        dst = os.path.join(out_dir, fn + '.csv')
+        if os.path.abspath(src) != os.path.abspath(dst):
+            shutil.copy2(src, dst)
+        paths[prcp_fac] = dst
+
+    # skip the factors which are already in the calibration cache
+    # (the config is needed to locate the climate files)
+    if not cfg.PATHS:
+        cfg.initialize(logging_level='WORKFLOW')
+    paths = dict()
+    params = dict()
+    for prcp_fac in prcp_factors:
+        params[prcp_fac] = calib_params(prcp_fac, temp_melt=temp_melt,
+                                        baseline_y0=baseline_y0,
+                                        baseline_climate=baseline_climate,
+                                        rgi_version=rgi_version)
+        entry = lookup_calib(params[prcp_fac], cache_dir=cache_dir)
+        if entry is not None:
+            _copy_ref_tstars(prcp_fac, os.path.join(entry, 'ref_tstars.csv'))
+    prcp_factors = [f for f in prcp_factors if f not in paths]
+    if not prcp_factors:
+        return paths
+    processes = min(processes, len(prcp_factors))
+
+    # factor independent preprocessing, using OGGM multiprocessing
+    prepro_wdir = os.path.join(base_dir, 'prepro')
+    utils.mkdir(prepro_wdir, reset=True)
+    init_calib_config(prepro_wdir, temp_melt=temp_melt,
+                      baseline_y0=baseline_y0,
+                      baseline_climate=baseline_climate,
+                      use_multiprocessing=True)
+    gdirs = mb_calib_prepo(rgi_version=rgi_version)
+    rgi_ids = [gdir.rgi_id for gdir in gdirs]
+
+    # one job per precipitation scaling factor
+    jobs = [(prepro_wdir,
+             os.path.join(base_dir, 'prcp_{:.2f}'.format(prcp_fac)),
+             rgi_ids, prcp_fac, temp_melt, baseline_y0, baseline_climate)
+            for prcp_fac in prcp_factors]
+
+    with multiprocessing.Pool(processes) as pool:
+        for prcp_fac, wdir in pool.imap_unordered(_mb_calib_factor, jobs):
+            _copy_ref_tstars(prcp_fac, os.path.join(wdir, 'ref_tstars.csv'))
+            # add results to the calibration cache
+            entry = os.path.join(cache_dir, calib_key(params[prcp_fac]))
+            if not os.path.isdir(entry):
+                store_calib(wdir, params[prcp_fac], entry)
+
+    return paths
+
+
+def file_hash(path):
+    """ Returns the SHA1 hash of the file content. The hash is computed
+    only once per process, as long as size and modification time of the
+    file do not change.
+
+    :param path: (str) path to file
+    :return: (str) hex digest
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(2**20), b''):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+
+def climate_files(baseline_climate='HISTALP'):
+    """ Returns the paths to the climate files used by OGGM for the given
+    baseline climate (downloading them if necessary).
+
+    :param baseline_climate: (str, optional) baseline climate data set
+    :return: (list of str) paths to climate files
+    """
+    if baseline_climate == 'HISTALP':
+        return [utils.get_histalp_file(var='tmp'),
+                utils.get_histalp_file(var='pre')]
+    if baseline_climate == 'CRU':
+        return [utils.get_cru_file(var='tmp'),
+                utils.get_cru_file(var='pre')]
+    return [cfg.PATHS['climate_file']]
+
+
+def calib_params(prcp_fac, temp_melt=-1.75, baseline_y0=1850,
+                 baseline_climate='HISTALP', rgi_version='61',
+                 climate_hashes=None):
+    """ Returns all parameters which affect the mass balance calibration
+    as dictionary, including the hashes of the climate files.
+    Needs an initialized OGGM config to locate the climate files, unless
+    their hashes are given.
+    """
+    if climate_hashes is None:
+        climate_hashes = [file_hash(f) for f in
+                          climate_files(baseline_climate)]
+    return {'prcp_scaling_factor': round(float(prcp_fac), 6),
+            'temp_melt': round(float(temp_melt), 6),
+            'baseline_y0': int(baseline_y0),
+            'baseline_climate': baseline_climate,
+            'rgi_version': str(rgi_version),
+            'climate_files': list(climate_hashes)}
+
+
+def calib_key(params):
+    """ Returns the cache key of the given calibration parameters,
+    i.e. the SHA1 hash of their JSON representation.
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def seed_calib(path, params, entry):
+    """ Stores the reference t* list of an earlier calibration as cache
+    entry, see `seed_calib_cache()`.
+
+    :param path: (str) path to the reference t* list
+    :param params: (dict) calibration parameters, see `calib_params()`
+    :param entry: (str) path to the cache entry
+    """
+    tmp_dir = '{}.tmp{:d}'.format(entry, os.getpid())
+    utils.mkdir(tmp_dir, reset=True)
+    shutil.copy2(path, os.path.join(tmp_dir, 'ref_tstars.csv'))
+    mb_calib_params = dict(LEGACY_MB_CALIB_PARAMS,
+                           temp_melt=params['temp_melt'],
+                           prcp_scaling_factor=params['prcp_scaling_factor'])
+    with open(os.path.join(tmp_dir, 'mb_calib_params.json'), 'w') as fp:
+        json.dump(mb_calib_params, fp)
+    with open(os.path.join(tmp_dir, 'params.json'), 'w') as fp:
+        json.dump(dict(params, seeded_from=path), fp, indent=2,
+                  sort_keys=True)
+    try:
+        os.rename(tmp_dir, entry)
+    except OSError:
+        # another process stored the same entry in the meantime
+        shutil.rmtree(tmp_dir)
+
+
+def seed_calib_cache(legacy_dir, climate_hashes, cache_dir=None):
+    """ Stores the reference t* lists of earlier calibrations
+    (`ref_tstars_prcp_X_XX.csv`, computed with `LEGACY_PARAMS`) in the
+    calibration cache. The climate files of these calibrations were not
+    recorded, hence the hashes of the climate files they were computed
+    with (see `file_hash()`) must be given. The entries are used only
+    as long as the current climate files have the same hashes.
+
+    The output directory of `mb_calib_batch()` is refused, since its
+    files are not necessarily computed with the given climate files.
+
+    :param legacy_dir: (str) directory of the earlier reference t* lists
+    :param climate_hashes: (list of str) hashes of the climate files
+        (temperature, precipitation) used by the earlier calibrations
+    :param cache_dir: (str, optional) path to the calibration cache
+    :return: (dict) path to the cache entry for each factor
+    """
+    if os.path.abspath(legacy_dir) == os.path.abspath(OUT_DIR):
+        raise ValueError('The output directory of mb_calib_batch() can not '
+                         'be used to seed the calibration cache.')
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    utils.mkdir(cache_dir)
+    pattern = re.compile(r'^ref_tstars_prcp_(\d+)_(\d+)\.csv$')
+    entries = dict()
+    for fn in sorted(os.listdir(legacy_dir)):
+        match = pattern.match(fn)
+        if not match:
+            continue
+        prcp_fac = float('{}.{}'.format(*match.groups()))
+        params = calib_params(prcp_fac, climate_hashes=climate_hashes,
+                              **LEGACY_PARAMS)
+        entry = os.path.join(cache_dir, calib_key(params))
+        if not os.path.isdir(entry):
+            seed_calib(os.path.join(legacy_dir, fn), params, entry)
+        entries[prcp_fac] = entry
+    return entries
+
+
+def lookup_calib(params, cache_dir=None):
+    """ Returns the path to the cache entry of the given calibration
+    parameters, if the calibration is cached.
+
+    :param params: (dict) calibration parameters, see `calib_params()`
+    :param cache_dir: (str, optional) path to the calibration cache
+    :return: (str) path to the cache entry, or None on a cache miss
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    entry = os.path.join(cache_dir, calib_key(params))
+    if os.path.isdir(entry):
+        return entry
+    return None
+
+
+def get_ref_tstars(prcp_fac, temp_melt=-1.75, baseline_y0=1850,
+                   baseline_climate='HISTALP', rgi_version='61',
+                   cache_dir=None):
+    """ Returns the reference t* list and the mass balance calibration
+    parameters for the given parameters. The results are looked up in a
+    content addressed cache (keyed on all calibration parameters and the
+    climate file hashes, see also `seed_calib_cache()`). On a cache miss,
+    the calibration runs and its results are stored in the cache.
+
+    :param prcp_fac: (float) precipitation scaling factor
+    :param temp_melt: (float, optional) melt temperature threshold
+    :param baseline_y0: (int, optional) first year of the baseline climate
+    :param baseline_climate: (str, optional) baseline climate data set
+    :param rgi_version: (str, optional) RGI version
+    :param cache_dir: (str, optional) path to the calibration cache
+    :return: reference t* list (pd.DataFrame), calibration parameters (dict)
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    # the config is needed to locate the climate files
+    if not cfg.PATHS:
+        cfg.initialize(logging_level='WORKFLOW')
+    params = calib_params(prcp_fac, temp_melt=temp_melt,
+                          baseline_y0=baseline_y0,
+                          baseline_climate=baseline_climate,
+                          rgi_version=rgi_version)
+    entry = lookup_calib(params, cache_dir=cache_dir)
+
+    if entry is None:
+        # cache miss: run mass balance calibration
+        entry = os.path.join(cache_dir, calib_key(params))
+        wdir = mb_calib(prcp_fac, temp_melt=temp_melt,
+                        baseline_y0=baseline_y0,
+                        baseline_climate=baseline_climate,
+                        rgi_version=rgi_version)
+        store_calib(wdir, params, entry)
+
+    # read t* reference list and calibration parameters
+    ref_df = pd.read_csv(os.path.join(entry, 'ref_tstars.csv'), index_col=0)
+    with open(os.path.join(entry, 'mb_calib_params.json'), 'r') as fp:
+        mb_calib_params = json.load(fp)
+
+    return ref_df, mb_calib_params
+
+
+def store_calib(wdir, params, entry):
+    """ Copies the calibration results from the working directory into
+    the given cache entry, together with the calibration parameters.
+    A temporary directory is used, so that the entry appears only once
+    it is complete.
+
+    :param wdir: (str) working directory of the calibration
+    :param params: (dict) calibration parameters, see `calib_params()`
+    :param entry: (str) path to the cache entry
+    """
+    tmp_dir = '{}.tmp{:d}'.format(entry, os.getpid())
+    utils.mkdir(tmp_dir, reset=True)
+    for fn in ['ref_tstars.csv', 'mb_calib_params.json']:
+        shutil.copy2(os.path.join(wdir, fn), tmp_dir)
+    with open(os.path.join(tmp_dir, 'params.json'), 'w') as fp:
+        json.dump(params, fp, indent=2, sort_keys=True)
+    try:
+        os.rename(tmp_dir, entry)
+    except OSError:
+        # another process stored the same entry in the meantime
+        shutil.rmtree(tmp_dir)
+
 
+if __name__ == '__main__':
+    # run mass balance calibration for all precipitation scaling factors,
+    # the results are stored as ref_tstars_prcp_X_XX.csv files
+    prcp_factors = np.linspace(1, 1.75, 16)
+    mb_calib_batch(prcp_factors, out_dir=OUT_DIR)
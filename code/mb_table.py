@@ -0,0 +1,123 @@
+""" Tabulated annual mass balance model.
+
+`massbalance.PastMassBalance` computes the temperature lapse, the solid
+precipitation fraction and the melt from the monthly climate at every
+call, i.e. every year for every flowline. Here, the annual specific mass
+balance is computed once for the entire climate period on a fine
+elevation grid, and interpolated linearly at run time. The tables are
+cached per glacier directory, climate file and climate calibration (mu*,
+bias and the mass balance parameters of `cfg.PARAMS`), so that all runs
+with the same climate settings (e.g. all A factors of one sweep cell)
+share the same table.
+"""
+
+import os
+import numpy as np
+
+# oggm modules
+from oggm import cfg
+from oggm.core import massbalance
+
+# default elevation grid of the tables [m asl]
+MIN_HEIGHT = 0.
+MAX_HEIGHT = 5000.
+DZ = 5.
+# maximal number of cached tables per process
+MAX_TABLES = 64
+# parameters read by `massbalance.PastMassBalance`
+MB_PARAMS = ['temp_all_solid', 'temp_all_liq', 'temp_melt',
+             'prcp_scaling_factor', 'temp_default_gradient',
+             'temp_local_gradient_bounds', 'use_bias_for_run']
+
+# cached tables of this process, by glacier and climate calibration
+_tables = dict()
+
+
+class TabulatedMassBalance(massbalance.MassBalanceModel):
+    """ Annual mass balance, interpolated from a table (years x heights)
+    precomputed with the given mass balance model. Heights outside the
+    table are clipped to its range. Monthly mass balance is not tabulated
+    and passed on to the underlying model.
+    """
+
+    def __init__(self, mb_model, heights=None, years=None):
+        """ Computes the table.
+
+        :param mb_model: (massbalance.MassBalanceModel) mass balance model
+            to tabulate, e.g. `PastMassBalance`
+        :param heights: (1-D array, optional) elevation grid [m asl], from
+            MIN_HEIGHT to MAX_HEIGHT every DZ meters as default
+        :param years: (int array like, optional) years to tabulate, all
+            years of the mass balance model (e.g. 1802-2014) as default
+        """
+        super(TabulatedMassBalance, self).__init__()
+        if heights is None:
+            heights = np.arange(MIN_HEIGHT, MAX_HEIGHT + DZ, DZ)
+        if years is None:
+            years = mb_model.years
+        self.mb_model = mb_model
+        self.heights = np.asarray(heights, dtype=float)
+        self.years = np.unique(np.asarray(years, dtype=int))
+        self.hemisphere = getattr(mb_model, 'hemisphere', 'nh')
+        self.valid_bounds = getattr(mb_model, 'valid_bounds', None)
+        # contiguous years only, so that the row index is year - y0
+        if not np.all(np.diff(self.years) == 1):
+            raise ValueError('Years must be contiguous.')
+        self.table = np.array([mb_model.get_annual_mb(self.heights, year=yr)
+                               for yr in self.years])
+
+    def get_annual_mb(self, heights, year=None, fl_id=None):
+        """ Annual mass balance [m ice s-1] at the given heights, interpolated
+        from the table.
+
+        :param heights: (array) heights [m asl]
+        :param year: (int) (hydrological) year
+        :param fl_id: (int, optional) flowline index, ignored
+        :return: (array) mass balance, same shape as heights
+        """
+        iyr = int(np.floor(year)) - self.years[0]
+        if not 0 <= iyr < self.years.size:
+            raise ValueError('Year {} out of the tabulated period '
+                             '{}-{}.'.format(year, self.years[0],
+                                             self.years[-1]))
+        return np.interp(heights, self.heights, self.table[iyr])
+
+    def get_monthly_mb(self, heights, year=None, fl_id=None):
+        """ Monthly mass balance of the underlying model (not tabulated). """
+        return self.mb_model.get_monthly_mb(heights, year=year)
+
+
+def get_tabulated_mb(gdir, filename='climate_monthly', input_filesuffix='',
+                     heights=None):
+    """ Returns the tabulated `PastMassBalance` of the given glacier, for the
+    current climate calibration (mu*, bias) and mass balance parameters
+    (see MB_PARAMS). The table is computed only once per process, glacier
+    directory, climate file (path, modification time and size) and
+    calibration.
+
+    :param gdir: (oggm.GlacierDirectory) glacier directory with calibrated
+        mass balance (i.e. after `climate.mu_star_calibration()`)
+    :param filename: (str, optional) climate file name
+    :param input_filesuffix: (str, optional) climate file suffix
+    :param heights: (1-D array, optional) elevation grid [m asl], see
+        `TabulatedMassBalance`
+    :return: (TabulatedMassBalance) mass balance model
+    """
+    mustar = gdir.read_json('local_mustar')
+    bias = mustar['bias'] if cfg.PARAMS['use_bias_for_run'] else 0.
+    fpath = gdir.get_filepath(filename, filesuffix=input_filesuffix)
+    stat = os.stat(fpath)
+    # (lists, e.g. the gradient bounds, as tuples to be hashable)
+    params = tuple(tuple(v) if isinstance(v, list) else v
+                   for v in (cfg.PARAMS[k] for k in MB_PARAMS))
+    key = (gdir.rgi_id, gdir.dir, fpath, stat.st_mtime, stat.st_size,
+           mustar['mu_star_glacierwide'], bias, params,
+           None if heights is None else tuple(heights))
+    if key not in _tables:
+        mb_model = massbalance.PastMassBalance(
+            gdir, filename=filename, input_filesuffix=input_filesuffix)
+        if len(_tables) >= MAX_TABLES:
+            # drop the oldest table
+            del _tables[next(iter(_tables))]
+        _tables[key] = TabulatedMassBalance(mb_model, heights=heights)
+    return _tables[key]
@@ -12,7 +12,7 @@ import xarray as xr
 
 
 def create_oggm_histalp_file(t_file, p_file, o_file,
-                             ys=1801, ye=2014):
+                             ys=1801, ye=2014, bbox=None, chunk_years=10):
 
     # Function to rewrite the ZAMG HISTALP netCDF Data to a file which is
     # readable by oggm.core.climate.process_custom_climate_data
@@ -28,6 +28,11 @@ def create_oggm_histalp_file(t_file, p_file, o_file,
     # files and path must be provided as input
     # adaption could be made to download the data automatically
     #
+    # The data is read lazily (dask) in chunks of `chunk_years` years. The
+    # requested time period and bounding box are selected before anything
+    # is loaded, the values are kept in single precision and the output file
+    # is written chunk by chunk. Hence, the memory usage is bounded by the
+    # chunk size and not by the grid size.
     #
     # INPUT
     # t_file = path+filename of temperature grid.
@@ -38,16 +43,26 @@ def create_oggm_histalp_file(t_file, p_file, o_file,
     #          e.g. 'data/histalp_merged.nc'
     # ys = Start year of requested time span. Default = 1801
     # ye = End year of requested time span (inclunding 01. Dec). Default = 2003
+    # bbox = Optional bounding box [lon_min, lon_max, lat_min, lat_max].
+    #        Default = None, i.e. the entire domain
+    # chunk_years = Number of years processed at once. Default = 10
 
     # Define a reference date which will be used from here
     reference_date = pd.Timestamp('1801-01-01 00:00:00')
 
-    # open HISTALP data files
-    tdata = xr.open_dataset(t_file, decode_times=False)
-    pdata = xr.open_dataset(p_file, decode_times=False)
+    # open HISTALP data files lazily, in chunks along the time axis
+    chunks = {'time': 12 * chunk_years}
+    tdata = xr.open_dataset(t_file, decode_times=False, chunks=chunks)
+    pdata = xr.open_dataset(p_file, decode_times=False, chunks=chunks)
+
+    # requested time period, as days since reference date
+    oindex = (pd.date_range(start=str(ys), end='%d-12-01' % ye, freq='MS') -
+              reference_date).days.astype(float)
 
     # loop over files to extract date information
-    for data in [tdata, pdata]:
+    datasets = []
+    raw_data = [tdata, pdata]
+    for data in raw_data:
         # process HISTALP monthly data
         units = data.time.units
         # check if really monthly
@@ -63,17 +78,34 @@ def create_oggm_histalp_file(t_file, p_file, o_file,
         periods = data.sizes['time']
         month = pd.date_range(start=start, periods=periods, freq='MS')
         days = (month - reference_date).days
-        data.time.values = days.astype(float)
+        data = data.assign_coords(time=days.astype(float))
         data.time.attrs['units'] = 'days since %s' % reference_date
 
+        # select requested time period (before loading any data)
+        data = data.sel(time=oindex)
+
+        # select bounding box (before loading any data)
+        if bbox is not None:
+            lon_min, lon_max, lat_min, lat_max = bbox
+            lon = data.lon.values
+            lat = data.lat.values
+            data = data.isel(lon=np.flatnonzero((lon >= lon_min) &
+                                                (lon <= lon_max)),
+                             lat=np.flatnonzero((lat >= lat_min) &
+                                                (lat <= lat_max)))
+        datasets.append(data)
+    tdata, pdata = datasets
+
     # check if there is lat/lon matches
     if (tdata.lon.values-pdata.lon.values != 0).any():
         raise Exception
     if (tdata.lat.values-pdata.lat.values != 0).any():
         raise Exception
 
-    # create output array with merge
-    out = xr.merge([tdata, pdata]).astype(float)
+    # create output array with merge (lazy, single precision)
+    out = xr.merge([tdata, pdata])
+    out = out.drop('ZONES')
+    out = out.astype(np.float32)
 
     # some Attributes
     out.attrs['file_info'] = 'Merged HISTALP precipitation and temperature ' +\
@@ -83,24 +115,21 @@ def create_oggm_histalp_file(t_file, p_file, o_file,
     out.attrs['references'] = 'http://www.zamg.ac.at/histalp'
 
     # rename variables according to OGGM usage
-    out.rename({'HSURF': 'hgt',
-                'T_2M': 'temp',
-                'TOT_PREC': 'prcp'},
-               inplace=True)
+    out = out.rename({'HSURF': 'hgt',
+                      'T_2M': 'temp',
+                      'TOT_PREC': 'prcp'})
 
     out.temp.attrs['units'] = 'degC'
     out.prcp.attrs['units'] = 'mm'
     out.hgt.attrs['units'] = 'm'
 
-    out = out.drop('ZONES')
-
-    # select requested time period
-    oindex = (pd.date_range(start=str(ys), end='%d-12-01' % ye, freq='MS') -
-              reference_date).days
-    out = out.loc[{'time': oindex}]
+    # write to output path, chunk by chunk
+    encoding = {var: {'dtype': 'float32'} for var in out.data_vars}
+    out.to_netcdf(o_file, encoding=encoding)
 
-    # write to output path
-    out.to_netcdf(o_file)
+    # close input files
+    for data in raw_data:
+        data.close()
 
 
 if __name__ == '__main__':
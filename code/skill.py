@@ -0,0 +1,157 @@
+""" Skill scores of modeled glacier length against a length reference,
+computed for many model runs at once.
+
+The modeled lengths are given as 2-D array (runs x years), all scores are
+computed in one vectorized pass. Missing values (NaN) are ignored, in the
+same way as pandas does it.
+"""
+
+import numpy as np
+import pandas as pd
+
+# reference length records
+LENGTH_REF = {
+    'leclercq': '/Users/oberrauch/work/grindelwald/data/length_ref_abs.csv',
+    'glamos': '/Users/oberrauch/work/grindelwald/data/length_ref_glamos.csv'
+}
+
+# names of the computed scores
+SCORES = ['corr', 'rmsd', 'rmsd_bc', 'rmsd_anomaly', 'amp_diff']
+
+
+def read_length_ref(source='leclercq'):
+    """ Reads the reference length record from file.
+
+    :param source: (str, optional) either 'leclercq' (absolute length),
+        'glamos' (cumulative length change) or 'reconciled' (absolute length
+        reconciled from all sources, computed on first use, see
+        `length_ref.get_reference()`)
+    :return: (pd.Series) reference length, index by year
+    """
+    if source == 'reconciled':
+        # imported here, since it needs the OGGM sample data
+        from length_ref import get_reference
+        return get_reference()
+    ref = pd.read_csv(LENGTH_REF[source], index_col=0)
+    return ref.iloc[:, 0]
+
+
+def align(lengths, years, ref, ref_years, y0=1894, y1=None):
+    """ Brings modeled and reference length onto a common year axis, i.e.
+    the union of both year axes between `y0` and `y1`. Years without data
+    are filled with NaN.
+
+    :param lengths: (2-D array) modeled length, runs x years
+    :param years: (1-D array) years of the modeled length
+    :param ref: (1-D array) reference length
+    :param ref_years: (1-D array) years of the reference length
+    :param y0: (int, optional) first year of the control period
+    :param y1: (int, optional) last year of the control period
+    :return: modeled length (runs x years), reference length, years
+    """
+    lengths = np.atleast_2d(np.asarray(lengths, dtype=float))
+    years = np.asarray(years).astype(int)
+    ref = np.asarray(ref, dtype=float)
+    ref_years = np.asarray(ref_years).astype(int)
+
+    # common year axis within the control period
+    common = np.union1d(years, ref_years)
+    common = common[common >= y0]
+    if y1 is not None:
+        common = common[common <= y1]
+
+    # scatter both records onto the common axis
+    mod = np.full((lengths.shape[0], common.size), np.nan)
+    mask = np.isin(years, common)
+    mod[:, np.searchsorted(common, years[mask])] = lengths[:, mask]
+    obs = np.full(common.size, np.nan)
+    mask = np.isin(ref_years, common)
+    obs[np.searchsorted(common, ref_years[mask])] = ref[mask]
+
+    return mod, obs, common
+
+
+def score(lengths, years, ref, ref_years, y0=1894, y1=None):
+    """ Computes the skill scores of all model runs against the reference:
+        - corr: correlation coefficient (pairwise complete years)
+        - rmsd: root mean squared deviation (pairwise complete years)
+        - rmsd_bc: rmsd of the bias corrected records, following OGGM's
+          `utils.rmsd_bc` (identical to rmsd_anomaly by definition)
+        - rmsd_anomaly: rmsd of the anomalies to the respective mean,
+          following `utils.rmsd_anomaly`
+        - amp_diff: difference between modeled and reference amplitude
+          (max - min), each over all its available years
+    Means and amplitudes are computed over all available years of each
+    record, the deviations only over years where both records are available
+    (i.e. as pandas computes means and differences of aligned Series).
+
+    :param lengths: (2-D array) modeled length, runs x years
+    :param years: (1-D array) years of the modeled length
+    :param ref: (1-D array) reference length
+    :param ref_years: (1-D array) years of the reference length
+    :param y0: (int, optional) first year of the control period
+    :param y1: (int, optional) last year of the control period
+    :return: (pd.DataFrame) scores, one row per run
+    """
+    mod, obs, _ = align(lengths, years, ref, ref_years, y0=y0, y1=y1)
+
+    # valid values of both records, and pairwise valid values
+    mod_ok = np.isfinite(mod)
+    obs_ok = np.isfinite(obs)
+    pair_ok = mod_ok & obs_ok[np.newaxis, :]
+    n_pair = pair_ok.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # rmsd over pairwise complete years
+        diff = np.where(pair_ok, mod - obs, 0)
+        rmsd = np.sqrt((diff ** 2).sum(axis=1) / n_pair)
+
+        # anomalies to the mean over all available years
+        mod_mean = np.where(mod_ok, mod, 0).sum(axis=1) / mod_ok.sum(axis=1)
+        obs_mean = np.nanmean(obs) if obs_ok.any() else np.nan
+        diff = np.where(pair_ok, (mod - mod_mean[:, np.newaxis])
+                        - (obs - obs_mean), 0)
+        rmsd_anomaly = np.sqrt((diff ** 2).sum(axis=1) / n_pair)
+
+        # pearson correlation over pairwise complete years
+        mod_p = np.where(pair_ok, mod, 0)
+        obs_p = np.where(pair_ok, obs, 0)
+        mod_p = np.where(pair_ok, mod_p - (mod_p.sum(axis=1) /
+                                           n_pair)[:, np.newaxis], 0)
+        obs_p = np.where(pair_ok, obs_p - (obs_p.sum(axis=1) /
+                                           n_pair)[:, np.newaxis], 0)
+        corr = ((mod_p * obs_p).sum(axis=1) /
+                np.sqrt((mod_p ** 2).sum(axis=1) * (obs_p ** 2).sum(axis=1)))
+
+        # amplitude over all available years
+        mod_amp = (np.where(mod_ok, mod, -np.inf).max(axis=1) -
+                   np.where(mod_ok, mod, np.inf).min(axis=1))
+        mod_amp[~mod_ok.any(axis=1)] = np.nan
+        obs_amp = np.nanmax(obs) - np.nanmin(obs) if obs_ok.any() else np.nan
+        amp_diff = mod_amp - obs_amp
+
+    # set scores without any common year to NaN
+    corr[n_pair < 2] = np.nan
+    rmsd[n_pair == 0] = np.nan
+    rmsd_anomaly[n_pair == 0] = np.nan
+
+    return pd.DataFrame({'corr': corr, 'rmsd': rmsd, 'rmsd_bc': rmsd_anomaly,
+                         'rmsd_anomaly': rmsd_anomaly, 'amp_diff': amp_diff},
+                        columns=SCORES)
+
+
+def score_df(length_df, ref, y0=1894, y1=None):
+    """ Wrapper around `score()` for DataFrames, e.g. the (t* x year) length
+    matrix produced by `t_star_tuning.py`.
+
+    :param length_df: (pd.DataFrame) modeled length, one row per run and
+        one column per year
+    :param ref: (pd.Series) reference length, index by year
+    :param y0: (int, optional) first year of the control period
+    :param y1: (int, optional) last year of the control period
+    :return: (pd.DataFrame) scores, with the same index as `length_df`
+    """
+    scores = score(length_df.values, length_df.columns.values,
+                   ref.values, ref.index.values, y0=y0, y1=y1)
+    scores.index = length_df.index
+    return scores
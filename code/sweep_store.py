@@ -0,0 +1,141 @@
+""" Persistent store for the results of the (t*, prcp_fac, glen_a_fac)
+parameter sweeps, based on a SQLite table.
+
+Every computed cell is committed as soon as it is finished, so that an
+interrupted sweep can be restarted and computes only the missing cells.
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# parameters (i.e. primary key) of each sweep cell
+PARAMS = ['t_star', 'prcp_fac', 'glen_a_fac']
+# default scores stored for each cell
+SCORES = ['corr', 'rmsd', 'rmsd_bc', 'amp_diff']
+
+# parameter values are rounded to avoid floating point mismatches
+_DECIMALS = 6
+
+
+def _key(value):
+    """ Rounds parameter values, so that they can be used as keys. """
+    return round(float(value), _DECIMALS)
+
+
+class SweepStore(object):
+    """ SQLite table with one row per (t_star, prcp_fac, glen_a_fac) cell.
+
+    The store is meant to be written by one single process (e.g. the main
+    process collecting the results of a process pool).
+    """
+
+    def __init__(self, path, scores=None):
+        """ Opens (or creates) the store.
+
+        :param path: (str) path to the SQLite database file
+        :param scores: (list of str, optional) names of the stored scores
+        """
+        self.path = path
+        self.scores = list(scores) if scores is not None else SCORES
+        # create parent directory if necessary
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(path)
+        columns = ', '.join(['{} REAL NOT NULL'.format(p) for p in PARAMS] +
+                            ['"{}" REAL'.format(s) for s in self.scores])
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cells ({}, PRIMARY KEY '
+                           '({}))'.format(columns, ', '.join(PARAMS)))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def done(self, t_star, prcp_fac, glen_a_factors):
+        """ Checks whether all given Glen A factors of the (t*, prcp_fac)
+        cell are stored already.
+
+        :param t_star: (int) equilibrium year
+        :param prcp_fac: (float) precipitation scaling factor
+        :param glen_a_factors: (float array like) Glen A scaling factors
+        :return: (bool)
+        """
+        stored = self._conn.execute(
+            'SELECT glen_a_fac FROM cells WHERE t_star = ? AND prcp_fac = ?',
+            (_key(t_star), _key(prcp_fac))).fetchall()
+        stored = set(row[0] for row in stored)
+        return all(_key(f) in stored for f in glen_a_factors)
+
+    def get(self, t_star, prcp_fac, glen_a_fac):
+        """ Returns the stored scores of one single parameter combination.
+
+        :param t_star: (int) equilibrium year
+        :param prcp_fac: (float) precipitation scaling factor
+        :param glen_a_fac: (float) Glen A scaling factor
+        :return: (pd.Series) scores, or None if not stored
+        """
+        row = self._conn.execute(
+            'SELECT {} FROM cells WHERE t_star = ? AND prcp_fac = ? AND '
+            'glen_a_fac = ?'.format(', '.join('"{}"'.format(s)
+                                              for s in self.scores)),
+            (_key(t_star), _key(prcp_fac), _key(glen_a_fac))).fetchone()
+        if row is None:
+            return None
+        return pd.Series(row, index=self.scores, dtype=float)
+
+    def add(self, t_star, prcp_fac, df):
+        """ Stores the results of one (t*, prcp_fac) cell and commits them
+        immediately. Already existing entries are replaced.
+
+        :param t_star: (int) equilibrium year
+        :param prcp_fac: (float) precipitation scaling factor
+        :param df: (pd.DataFrame) scores, index by Glen A scaling factor,
+            as returned by `glen_a.glen_a()`
+        """
+        rows = [(_key(t_star), _key(prcp_fac), _key(glen_a_fac)) +
+                tuple(float(row[s]) for s in self.scores)
+                for glen_a_fac, row in df.iterrows()]
+        sql = 'INSERT OR REPLACE INTO cells VALUES ({})'.format(
+            ', '.join(['?'] * (len(PARAMS) + len(self.scores))))
+        with self._conn:
+            self._conn.executemany(sql, rows)
+
+    def to_dataframe(self):
+        """ Returns all stored cells as DataFrame, with a
+        (t_star, prcp_fac, glen_a_fac) MultiIndex.
+        """
+        df = pd.read_sql_query('SELECT * FROM cells', self._conn)
+        return df.set_index(PARAMS).sort_index()
+
+    def fill_dataset(self, ds):
+        """ Writes all stored values, which lie on the coordinates of the
+        given Dataset, into the Dataset. The Dataset must have the
+        dimensions `t_star`, `prcp_fac` and `glen_a_fac` and one variable
+        per score.
+
+        :param ds: (xr.Dataset) sweep results
+        :return: (xr.Dataset) the same Dataset
+        """
+        df = self.to_dataframe()
+        # map stored (rounded) keys onto the coordinates
+        coords = {p: np.array([_key(v) for v in ds[p].values]) for p in PARAMS}
+        for (t_star, prcp_fac, glen_a_fac), row in df.iterrows():
+            index = dict()
+            for p, v in zip(PARAMS, (t_star, prcp_fac, glen_a_fac)):
+                match = np.flatnonzero(coords[p] == v)
+                if not match.size:
+                    break
+                index[p] = match[0]
+            else:
+                for s in self.scores:
+                    if s in ds:
+                        ds[s][index] = row[s]
+        return ds
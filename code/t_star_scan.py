@@ -0,0 +1,108 @@
+""" Computes the temperature sensitivity mu* for all candidate t* at once.
+
+OGGM's `local_t_star` reads the climate file and computes mu* for one
+single t*, using the mean over a 31 year window (2 * mu_star_halfperiod + 1)
+around t*. Here, the yearly climate on the glacier is read once and the
+window means for all candidates are computed with cumulative sums. The
+resulting mu* can be stored with `write_local_mustar()` instead of
+calling `local_t_star` for every candidate.
+"""
+
+import numpy as np
+import pandas as pd
+
+# oggm modules
+from oggm import cfg
+from oggm.core import climate
+
+
+def rolling_mean(data, window):
+    """ Returns the mean over all (complete) windows of the given length,
+    computed via cumulative sums.
+
+    :param data: (1-D array) data
+    :param window: (int) window length
+    :return: (1-D array) window means, of length `len(data) - window + 1`
+    """
+    csum = np.concatenate([[0.], np.cumsum(data, dtype=float)])
+    return (csum[window:] - csum[:-window]) / window
+
+
+def scan_t_star(gdir, t_stars=None):
+    """ Computes mu* and the window mean climate for all candidate t*,
+    following `oggm.core.climate.local_t_star` (without calving flux).
+
+    The returned DataFrame contains (index by t*):
+        - temp_melt: mean yearly melt temperature sum over the t* window
+        - prcp_solid: mean yearly solid precipitation over the t* window
+        - mu_star: temperature sensitivity, in [mm w.e. yr-1 K-1], clipped
+          to positive values if `cfg.PARAMS['clip_mu_star']`
+        - mb_window: apparent mass balance over the t* window, using the
+          corresponding mu*, in [mm w.e. yr-1] (zero unless mu* is clipped)
+        - valid: whether mu* is within the bounds accepted by OGGM
+
+    :param gdir: (oggm.GlacierDirectory) glacier directory with processed
+        climate data
+    :param t_stars: (int array like, optional) candidate t*, all years with
+        a complete window as default
+    :return: (pd.DataFrame) scan results, index by t*
+    """
+    # length of the t* window
+    mu_hp = int(cfg.PARAMS['mu_star_halfperiod'])
+    window = 2 * mu_hp + 1
+
+    # yearly climate on the glacier, for the entire period
+    years, temp_yr, prcp_yr = climate.mb_yearly_climate_on_glacier(gdir)
+
+    # window means, centered at t*
+    centers = years[mu_hp:len(years) - mu_hp]
+    temp_win = rolling_mean(temp_yr, window)
+    prcp_win = rolling_mean(prcp_yr, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu_star = prcp_win / temp_win
+    # clip and check bounds, as OGGM does
+    if cfg.PARAMS['clip_mu_star']:
+        mu_star = np.clip(mu_star, 0, None)
+    valid = (np.isfinite(mu_star) & (mu_star >= cfg.PARAMS['min_mu_star']) &
+             (mu_star <= cfg.PARAMS['max_mu_star']))
+    # apparent mass balance over the t* window
+    with np.errstate(invalid='ignore'):
+        mb_window = prcp_win - mu_star * temp_win
+
+    df = pd.DataFrame({'temp_melt': temp_win, 'prcp_solid': prcp_win,
+                       'mu_star': mu_star, 'mb_window': mb_window,
+                       'valid': valid}, index=centers,
+                      columns=['temp_melt', 'prcp_solid', 'mu_star',
+                               'mb_window', 'valid'])
+    df.index.name = 't_star'
+
+    if t_stars is not None:
+        df = df.reindex(np.asarray(t_stars))
+        df['valid'] = df['valid'].fillna(False).astype(bool)
+
+    return df
+
+
+def write_local_mustar(gdir, t_star, mu_star, bias=0.):
+    """ Stores the given t* and mu* (e.g. from `scan_t_star()`) in the
+    glacier directory, as `oggm.core.climate.local_t_star` does, but
+    without reading the climate again. Needed by `mu_star_calibration`
+    and `massbalance.PastMassBalance`.
+
+    :param gdir: (oggm.GlacierDirectory) glacier directory with processed
+        climate data
+    :param t_star: (int) t*
+    :param mu_star: (float) glacier wide mu*, in [mm w.e. yr-1 K-1]
+    :param bias: (float, optional) mass balance bias, in [mm w.e. yr-1]
+    """
+    # climate parameters of the calibration, checked by PastMassBalance
+    params = ['temp_default_gradient', 'temp_all_solid', 'temp_all_liq',
+              'temp_melt', 'prcp_scaling_factor']
+    ci = gdir.read_pickle('climate_info')
+    ci['mb_calib_params'] = {k: cfg.PARAMS[k] for k in params}
+    gdir.write_pickle(ci, 'climate_info')
+
+    df = {'rgi_id': gdir.rgi_id, 't_star': int(t_star), 'bias': bias,
+          'mu_star_glacierwide': float(mu_star)}
+    gdir.write_json(df, 'local_mustar')
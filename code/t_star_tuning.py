@@ -18,21 +18,23 @@ measurements (from the Leclercq dataset) are added to the file.
 import os
 import shutil
 import numpy as np
-import pandas as pd
 import xarray as xr
 import geopandas as gpd
 import matplotlib.pyplot as plt
 
 # import OGGM modules
-import oggm
-from oggm import cfg, graphics, utils
-from oggm.utils import get_demo_file, get_rgi_glacier_entities, rmsd
+from oggm import cfg, graphics
+from oggm.utils import get_demo_file, rmsd
 from oggm.tests.funcs import get_test_dir
-from oggm.core import gis, climate, centerlines, massbalance, flowline, inversion
+from oggm.core import climate, massbalance, flowline, inversion
 
 # import my modules
 import sys
 from utils import rmsd_anomaly, get_leclercq_length
+from gdir_cache import get_preprocessed_gdir
+from skill import score_df, read_length_ref
+from t_star_scan import scan_t_star, write_local_mustar
+from ensemble_flowline import EnsembleFluxModel
 
 ## Initilize
 # load default parameter file
@@ -53,29 +55,11 @@ cfg.PARAMS['prcp_scaling_factor'] = 1.75
 cfg.PARAMS['temp_melt'] = -1.75
 
 ## Preprocessing
-# get RGI entity
+# get glacier directory with GIS and centerline preprocessing,
+# restored from the snapshot cache if possible, keeping all
+# intermediate pickles (inversion output, flowlines) in memory
 rgi_id = 'RGI60-11.01270'
-rgi_df = get_rgi_glacier_entities([rgi_id], version='6')
-rgi_entity = rgi_df.iloc[0]
-
-# specify intersects
-cfg.set_intersects_db(utils.get_rgi_intersects_region_file('11'))
-# prepare glacier directory
-gdir = oggm.GlacierDirectory(rgi_entity, reset=True)
-
-# GIS tasks
-gis.define_glacier_region(gdir, entity=rgi_entity)
-gis.glacier_masks(gdir)
-
-# run center line preprocessing tasks
-centerlines.compute_centerlines(gdir)
-centerlines.initialize_flowlines(gdir)
-centerlines.compute_downstream_line(gdir)
-centerlines.compute_downstream_bedshape(gdir)
-centerlines.catchment_area(gdir)
-centerlines.catchment_intersections(gdir)
-centerlines.catchment_width_geom(gdir)
-centerlines.catchment_width_correction(gdir)
+gdir = get_preprocessed_gdir(rgi_id, rgi_version='6', in_memory=True)
 
 # process the HistAlp climate file
 climate.process_histalp_data(gdir)
@@ -89,16 +73,26 @@ step = 1
 mu_hp = int(cfg.PARAMS['mu_star_halfperiod'])
 t_stars = np.arange(y0+mu_hp, y1-mu_hp, step)
 
-# init empty container to store glacier length evolution
-length = pd.DataFrame(columns=np.arange(y0, y1+1))
-length.index.name = 't_star'
+# compute mu* for all t* at once, reading the climate only once
+scan = scan_t_star(gdir, t_stars)
+path = '/Users/oberrauch/work/grindelwald/data/mu_star_t_star.csv'
+scan.to_csv(path)
+# only t* with a valid mu* need a dynamic run
+t_stars = scan.index[scan.valid].values
 
+# collect mass balance model and flowlines of every t*
+mb_models = list()
+members_fls = list()
 for t_star in t_stars:
-    climate.local_t_star(gdir, tstar=t_star, bias=0)
+    # use mu* of the scan, no need to recalibrate
+    mu_star = scan.mu_star[t_star]
+    write_local_mustar(gdir, t_star, mu_star, bias=0)
+    # apparent mass balance along the flowlines, needed for the inversion
     climate.mu_star_calibration(gdir)
 
-    # instance mass balance model using the historic climate file
-    mb_model = massbalance.PastMassBalance(gdir)
+    # mass balance model using the historic climate file
+    mb_models.append(massbalance.PastMassBalance(gdir, mu_star=mu_star,
+                                                 bias=0))
 
     # run ice thicknes inversion
     inversion.prepare_for_inversion(gdir)
@@ -108,14 +102,23 @@ for t_star in t_stars:
     # finalize the preporcessing
     flowline.init_present_time_glacier(gdir)
 
-    # read flowlines from file
-    fls = gdir.read_pickle('model_flowlines')
-    # now we can use the flowline model
-    model = flowline.FluxBasedModel(fls, mb_model=mb_model, y0=y0)
-    # run model over entire HistAlp period
-    run_ds, diag_ds = model.run_until_and_store(y1)
-
-    length.loc[t_star] = diag_ds.length_m.to_dataframe()['length_m']
+    # read flowlines (from memory)
+    members_fls.append(gdir.read_pickle('model_flowlines'))
+
+# run all t* as one ensemble over entire HistAlp period
+# (all t* advance with the time step of the fastest glacier, hence the
+# length differs slightly from single FluxBasedModel runs, failed runs
+# have NaN length)
+model = EnsembleFluxModel(members_fls, mb_models, y0=y0)
+diag_ds = model.run_until_and_store(y1)
+if diag_ds.failed.any():
+    print('Failed t* runs:', t_stars[diag_ds.failed.values])
+
+# glacier length evolution, one row per t*
+length = diag_ds.length_m.to_pandas()
+length.index = t_stars
+length.columns = length.columns.astype(int)
+length.index.name = 't_star'
 
 # add reference length changes
 length_ref = get_leclercq_length(rgi_id=rgi_id.split('-')[-1])
@@ -127,4 +130,12 @@ length.index.name = 't_stars'
 
 # store DataFrame to file
 path = '/Users/oberrauch/work/grindelwald/data/length_t_star.csv'
-length.to_csv(path)
\ No newline at end of file
+length.to_csv(path)
+
+# compute skill scores of all t* runs against the absolute reference length
+# (the Leclercq length changes above have an arbitrary offset)
+scores = score_df(length.drop(length_ref.columns),
+                  read_length_ref('leclercq'))
+scores.index.name = 't_stars'
+path = '/Users/oberrauch/work/grindelwald/data/skill_t_star.csv'
+scores.to_csv(path)
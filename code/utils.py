@@ -1,30 +1,129 @@
 """ Some utility routines that didn't fit anywhere else. """
 
 ## Import section
+import os
+import netCDF4
 # gis modules
-import ogr
 import osr
+import geopandas as gpd
 import numpy as np
 import pandas as pd
 import xarray as xr
 
 # oggm modules
-from oggm.utils import get_rgi_glacier_entities, get_demo_file, rmsd
+from oggm.utils import get_rgi_region_file, get_demo_file, rmsd
 
+# location of the local RGI index files
+RGI_INDEX_DIR = '/Users/oberrauch/work/grindelwald/data/rgi_index/'
 
-def rgi_finder(rids, rgi_version='60'):
+# RGI indices already loaded by this process, key by (version, region)
+_rgi_index = dict()
+
+
+def rgi_index_path(rgi_version, rgi_region, index_dir=None):
+    """ Returns the path to the local RGI index file of the given region.
+
+    :param rgi_version: (str) RGI version, e.g. 60
+    :param rgi_region: (str) RGI region, e.g. 11
+    :param index_dir: (str, optional) path to index directory
+    :return: (str) path to index file
+    """
+    if index_dir is None:
+        index_dir = RGI_INDEX_DIR
+    return os.path.join(index_dir, 'rgi{}_region_{}.parquet'.format(
+        rgi_version, rgi_region))
+
+
+def build_rgi_index(rgi_version, rgi_region, index_dir=None):
+    """ Reads the RGI region shapefile and stores it as GeoParquet file,
+    index by RGI ID.
+
+    :param rgi_version: (str) RGI version, e.g. 60
+    :param rgi_region: (str) RGI region, e.g. 11
+    :param index_dir: (str, optional) path to index directory
+    :return: (gpd.GeoDataFrame) RGI entries of the region
+    """
+    path = rgi_index_path(rgi_version, rgi_region, index_dir=index_dir)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    # read region file
+    rgi_df = gpd.read_file(get_rgi_region_file(rgi_region,
+                                               version=rgi_version))
+    rgi_df.index = rgi_df.RGIId.values
+    # write to temporary file first, so that other processes
+    # never read an incomplete index file
+    tmp_path = '{}.tmp{:d}'.format(path, os.getpid())
+    rgi_df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return rgi_df
+
+
+def get_rgi_index(rgi_version, rgi_region, index_dir=None):
+    """ Returns all RGI entries of the given region, index by RGI ID. The
+    index file is built on first use and loaded only once per process.
+
+    :param rgi_version: (str) RGI version, e.g. 60
+    :param rgi_region: (str) RGI region, e.g. 11
+    :param index_dir: (str, optional) path to index directory
+    :return: (gpd.GeoDataFrame) RGI entries of the region
+    """
+    key = (str(rgi_version), str(rgi_region))
+    if key not in _rgi_index:
+        path = rgi_index_path(rgi_version, rgi_region, index_dir=index_dir)
+        if os.path.isfile(path):
+            _rgi_index[key] = gpd.read_parquet(path, memory_map=True)
+        else:
+            _rgi_index[key] = build_rgi_index(rgi_version, rgi_region,
+                                              index_dir=index_dir)
+    return _rgi_index[key]
+
+
+def get_rgi_entities(rgi_ids, rgi_version=None, index_dir=None):
+    """ Drop-in replacement of OGGM's `get_rgi_glacier_entities()`, using the
+    local RGI index instead of reading the region shapefile every time.
+
+    :param rgi_ids: (list of str) full RGI IDs, e.g. RGI60-11.01270
+    :param rgi_version: (str, optional) RGI version, inferred from the
+        prefix of the first RGI ID as default (e.g. 60 for RGI60-11.01270),
+        as OGGM does
+    :param index_dir: (str, optional) path to index directory
+    :return: (gpd.GeoDataFrame) RGI entries, in the given order
+    """
+    rgi_ids = list(rgi_ids)
+    if rgi_version is None:
+        rgi_version = rgi_ids[0].split('-')[0][-2:]
+    # group RGI IDs by region
+    regions = [rid.split('-')[1].split('.')[0] for rid in rgi_ids]
+    selection = []
+    for region in sorted(set(regions)):
+        rgi_df = get_rgi_index(rgi_version, region, index_dir=index_dir)
+        rids = [rid for rid, reg in zip(rgi_ids, regions) if reg == region]
+        missing = set(rids) - set(rgi_df.index)
+        if missing:
+            raise RuntimeError('Could not find RGI IDs: {}'.format(
+                ', '.join(sorted(missing))))
+        selection.append(rgi_df.loc[rids])
+    selection = pd.concat(selection).loc[rgi_ids]
+    selection = gpd.GeoDataFrame(selection, crs=selection.crs)
+    selection.reset_index(drop=True, inplace=True)
+    return selection
+
+
+def rgi_finder(rids, rgi_version='60', index_dir=None):
     """ Returns RGI entries for given RGI IDs in 'short' form.
 
     :param rids: (list of strings) RGI ID in the form region.glacier (eg. 11.01270)
     :param rgi_version: (str) RGI version, 6.0 as default
+    :param index_dir: (str, optional) path to RGI index directory
     :return: DataFrame with RGI entries, RGI ID as index
     """
 
     # specify RGI ID of glaciers of interest
     rids = ['RGI{}-{}'.format(rgi_version, rid) for rid in rids]
 
-    # get said RGI entries
-    rgi_dir = get_rgi_glacier_entities(rids, version=rgi_version)
+    # get said RGI entries from the local index
+    rgi_dir = get_rgi_entities(rids, rgi_version=rgi_version,
+                               index_dir=index_dir)
     # set RGIId as index
     rgi_dir.index = rgi_dir.RGIId
     # delete RGIId column
@@ -33,64 +132,197 @@ def rgi_finder(rids, rgi_version='60'):
     return rgi_dir
 
 
+# specify WGS84 EPGS code
+EPSG_WGS84 = 4326
+# specify Swiss LV03 EPSG code (used for IDAWEB station coordinates)
+EPSG_LV03 = 21781
+
+# coordinate transformations already created by this process,
+# key by (source EPSG, target EPSG)
+_transformations = dict()
+
+
+def get_transformation(epsg_in, epsg_out=EPSG_WGS84):
+    """ Returns the (cached) coordinate transformation between the two given
+    coordinate systems. Coordinates are always in x/y (i.e. lon/lat) order.
+
+    :param epsg_in: (int) epsg code of source corrdinate system
+    :param epsg_out: (int, optional) epsg code of target corrdinate system,
+        WGS84 as default
+    :return: (osr.CoordinateTransformation)
+    """
+    key = (int(epsg_in), int(epsg_out))
+    if key not in _transformations:
+        refs = []
+        for epsg in key:
+            ref = osr.SpatialReference()
+            ref.ImportFromEPSG(epsg)
+            # GDAL 3 uses the axis order of the authority, i.e. lat/lon
+            if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            refs.append(ref)
+        _transformations[key] = osr.CoordinateTransformation(*refs)
+    return _transformations[key]
+
+
+def transform_coords(x, y, epsg_in, epsg_out=EPSG_WGS84):
+    """ Transforms arrays of points from one coordinate system into
+    another one (specified via EPSG codes), in one single call.
+
+    :param x: (float array like) x coordinates (or longitudes)
+    :param y: (float array like) y coordinates (or latitudes)
+    :param epsg_in: (int) epsg code of source corrdinate system
+    :param epsg_out: (int, optional) epsg code of target corrdinate system,
+        WGS84 as default
+    :return: transformed x, y coordinates as arrays (of same shape as input)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = np.broadcast(x, y).shape
+    points = np.column_stack([np.broadcast_to(x, shape).ravel(),
+                              np.broadcast_to(y, shape).ravel()])
+    if not points.size:
+        return np.empty(shape), np.empty(shape)
+    # transform all points at once
+    trans = get_transformation(epsg_in, epsg_out)
+    points = np.array(trans.TransformPoints(points.tolist()))
+    return points[:, 0].reshape(shape), points[:, 1].reshape(shape)
+
+
 def convert_to_wgs84(lon, lat, EPSG):
     """ Converts point on projected coordinate system
     (specified via EPSG code) into WGS84 lon/lat coordinates.
+    See `transform_coords()` for arrays of points.
 
     :param lon: (float) longitude in projected corrdinate system
     :param lat: (float) latitude in projected corrdinate system
     :param EPSG: (int) epsg code of projected corrdinate system
     :return: lon, lat in WGS84 coordinates
     """
-    # specify WGS84 EPGS code
-    EPSG_WGS84 = 4326
-
-    # create a geometry from coordinates
-    point = ogr.Geometry(ogr.wkbPoint)
-    point.AddPoint(lon, lat)
-    # create coordinate transformation
-    in_ref = osr.SpatialReference()
-    in_ref.ImportFromEPSG(EPSG)
-    out_ref = osr.SpatialReference()
-    out_ref.ImportFromEPSG(EPSG_WGS84)
-    coord_trans = osr.CoordinateTransformation(in_ref, out_ref)
-    # transform point
-    point.Transform(coord_trans)
-
+    lon, lat = transform_coords([lon], [lat], EPSG)
     # return transformed coordinates
-    return point.GetX(), point.GetY()
+    return float(lon[0]), float(lat[0])
+
+
+def stations_to_wgs84(stations, column='Coordinates [km]'):
+    """ Converts the Swiss LV03 coordinates of IDAWEB stations (given as
+    'x/y' strings, e.g. '647900/168780') into WGS84 lon/lat coordinates.
+
+    :param stations: (pd.DataFrame) station table, e.g. slf_stations.csv
+    :param column: (str, optional) name of the coordinate column
+    :return: (pd.DataFrame) columns `lon` and `lat`, same index as stations
+    """
+    coords = stations[column].str.split('/', expand=True).astype(float)
+    lon, lat = transform_coords(coords[0].values, coords[1].values,
+                                EPSG_LV03)
+    return pd.DataFrame({'lon': lon, 'lat': lat}, index=stations.index,
+                        columns=['lon', 'lat'])
+
+
+# Leclercq lookup index (RGI ID -> LID -> netCDF group) of this process
+_leclercq_index = None
+
+
+def leclercq_index_path():
+    """ Returns the path of the Leclercq lookup index, which is stored next
+    to the length data file. """
+    f = get_demo_file('Glacier_Lengths_Leclercq.nc')
+    return os.path.splitext(f)[0] + '_index.csv'
+
+
+def build_leclercq_index(path=None):
+    """ Builds the lookup index RGI ID -> length index (LID) -> netCDF group
+    of the Leclercq data set and stores it as csv file.
+
+    :param path: (str, optional) path to index file,
+        next to the length data file as default
+    :return: (pd.DataFrame) index, with the columns `RGI_ID` (full RGI ID),
+        `LID` and `group`, index by RGI ID in format region.glacier
+    """
+    if path is None:
+        path = leclercq_index_path()
+    # get reference length record info (Leclercq)
+    links = pd.read_csv(get_demo_file('rgi_leclercq_links_2012_RGIV5.csv'))
+    # the database is not sorted by ID, groups are numbered from 1
+    f = get_demo_file('Glacier_Lengths_Leclercq.nc')
+    with xr.open_dataset(f) as dsg:
+        groups = pd.Series(np.arange(dsg['index'].size) + 1,
+                           index=dsg['index'].values)
+    index = pd.DataFrame({'RGI_ID': links.RGI_ID.values,
+                          'LID': links.LID.values,
+                          'group': groups.reindex(links.LID.values).values},
+                         columns=['RGI_ID', 'LID', 'group'],
+                         index=links.RGI_ID.str.split('-').str[-1].values)
+    index.index.name = 'rgi_id'
+    index = index.dropna(subset=['group'])
+    index['group'] = index.group.astype(int)
+    index.to_csv(path)
+    return index
+
+
+def get_leclercq_index():
+    """ Returns the Leclercq lookup index, which is built on first use and
+    loaded only once per process (see `build_leclercq_index()`). """
+    global _leclercq_index
+    if _leclercq_index is None:
+        path = leclercq_index_path()
+        if os.path.isfile(path):
+            _leclercq_index = pd.read_csv(path, index_col=0,
+                                          dtype={'rgi_id': str})
+        else:
+            _leclercq_index = build_leclercq_index(path)
+    return _leclercq_index
+
+
+def get_leclercq_lengths(rgi_ids, column='ref_dl'):
+    """ Returns the Leclercq length records of many glaciers, using the
+    lookup index instead of searching the links file and the data set for
+    every glacier. Glaciers without length records are not contained in
+    the result.
+
+    :param rgi_ids: (list of strings) RGI IDs in format region.glacier,
+        e.g. 11.01270
+    :param column: (str, optional) column name of the length records
+    :return: (dict) length records (pd.DataFrame), key by RGI ID
+    """
+    index = get_leclercq_index()
+    rgi_ids = [rid for rid in rgi_ids if rid in index.index]
+    lengths = dict()
+    if not rgi_ids:
+        return lengths
+    f = get_demo_file('Glacier_Lengths_Leclercq.nc')
+    # open the data set only once and read the groups directly
+    with netCDF4.Dataset(f) as nc:
+        for rgi_id in rgi_ids:
+            # every glacier is stored in its own group
+            grp_id = index.loc[[rgi_id], 'group'].iloc[0]
+            grp = nc.groups[str(grp_id)]
+            # read length records, masked values as NaN
+            dl = grp.variables['dL']
+            dim = dl.dimensions[0]
+            length_df = pd.DataFrame(
+                {column: np.ma.filled(dl[:].astype(float), np.nan)},
+                index=pd.Index(np.ma.getdata(grp.variables[dim][:]),
+                               name=dim))
+            length_df.name = grp.glacier_name
+            lengths[rgi_id] = length_df
+    return lengths
 
 
 def get_leclercq_length(rgi_id, column='ref_dl'):
     """ This functions does in essence the same as the function OGGM routine
     `GlacierDirectory.et_ref_length_data()`, i.e. reading the length records
     from the Leclercq data set. This routine does only works if you'r using the
-    RGI version 5...
+    RGI version 5... See `get_leclercq_lengths()` for many glaciers.
 
     :param rgi_id: (string) RGI ID in format region.glacier, e.g. 11.01270
     :return:
     """
-    # get reference length record info (Leclercq)
-    leclercq_df = pd.read_csv(get_demo_file('rgi_leclercq_links_2012_RGIV5.csv'))
-    glacier = leclercq_df[leclercq_df.RGI_ID.str.contains(rgi_id)]
+    lengths = get_leclercq_lengths([rgi_id], column=column)
     # exit routine if no length records found
-    if glacier.empty:
+    if rgi_id not in lengths:
         raise RuntimeError('No length data found for this glacier!')
-
-    # get length index (LID)
-    index = glacier.LID.values
-    # open the length data file
-    f = get_demo_file('Glacier_Lengths_Leclercq.nc')
-    with xr.open_dataset(f) as dsg:
-        # the database is not sorted by ID. Don't ask me...
-        grp_id = np.argwhere(dsg['index'].values == index)[0][0] + 1
-    with xr.open_dataset(f, group=str(grp_id)) as ds:
-        # read length records
-        length_df = ds.dL.to_dataframe()
-        length_df.columns = [column]
-        length_df.name = ds.glacier_name
-
-    return length_df
+    return lengths[rgi_id]
 
 
 def rmsd_anomaly(ref, data):
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+import code.emulator as emulator
+
+
+class TestEmulator(unittest.TestCase):
+    """ Testing the Gaussian process emulator on a known smooth function."""
+
+    def setUp(self):
+        # training points on a regular grid
+        t_star, prcp_fac = np.meshgrid(np.linspace(1920, 1980, 7),
+                                       np.linspace(1, 2.5, 5))
+        self.params = pd.DataFrame({'t_star': t_star.ravel(),
+                                    'prcp_fac': prcp_fac.ravel()})
+        self.outputs = self.function(self.params)
+
+    @staticmethod
+    def function(params):
+        # smooth outputs, e.g. length in three years
+        x = (params.t_star.values - 1950) / 30
+        y = params.prcp_fac.values - 1.75
+        return pd.DataFrame({1900: np.sin(2 * x) + y,
+                             1950: x * y + 1,
+                             2000: np.cos(x) - y ** 2}, index=params.index)
+
+    def test_gaussian_process(self):
+        x = np.linspace(0, 1, 8)[:, np.newaxis]
+        y = np.sin(3 * x[:, 0])
+        gp = emulator.GaussianProcess().fit(x, y - y.mean())
+        mean, var = gp.predict(x)
+        np.testing.assert_allclose(mean + y.mean(), y, atol=1e-2)
+        np.testing.assert_array_equal(gp.predict(x, return_var=False), mean)
+        # the variance grows away from the training data
+        _, var_far = gp.predict(np.array([[0.5 / 7], [3.]]))
+        self.assertLess(var_far[0], var_far[1])
+        self.assertTrue(np.all(var >= 0))
+
+    def test_fit_predict(self):
+        emu = emulator.Emulator(n_components=3).fit(self.params, self.outputs)
+
+        # training points are reproduced
+        mean, std = emu.predict(self.params, return_std=True)
+        self.assertEqual(list(mean.columns), list(self.outputs.columns))
+        np.testing.assert_allclose(mean.values, self.outputs.values,
+                                   atol=0.05)
+
+        # unseen points within the data are predicted well
+        test = pd.DataFrame({'t_star': [1935., 1962.],
+                             'prcp_fac': [1.4, 2.1]})
+        pred = emu.predict(test)
+        np.testing.assert_allclose(pred.values, self.function(test).values,
+                                   atol=0.1)
+
+        # the uncertainty grows away from the data
+        far = pd.DataFrame({'t_star': [1950., 1950., 2100.],
+                            'prcp_fac': [1.75, 1.75, 5.]})
+        _, std_far = emu.predict(far, return_std=True)
+        self.assertTrue(np.all(std_far.iloc[2] > std_far.iloc[0]))
+        self.assertTrue(np.all(std_far.iloc[0] <= std.values.max() + 1e-9))
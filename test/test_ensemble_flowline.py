@@ -0,0 +1,96 @@
+import unittest
+import numpy as np
+
+# oggm modules
+from oggm import cfg
+from oggm.core import flowline, massbalance
+from oggm.tests import funcs
+
+import code.ensemble_flowline as ensemble_flowline
+
+
+class TestEnsembleFluxModel(unittest.TestCase):
+    """ Comparing the ensemble members with OGGM's `FluxBasedModel` on the
+    idealized beds of the OGGM test suite."""
+
+    def setUp(self):
+        cfg.initialize()
+        self.glen_a = cfg.PARAMS['glen_a']
+        self.mb = massbalance.LinearMassBalance(2600.)
+        self.yrs = [50, 100, 150]
+
+    def run_oggm(self, fls, glen_a):
+        model = flowline.FluxBasedModel(fls, mb_model=self.mb, y0=0.,
+                                        glen_a=glen_a)
+        length, volume = [], []
+        for yr in self.yrs:
+            model.run_until(yr)
+            length.append(model.length_m)
+            volume.append(model.volume_m3)
+        return np.array(length), np.array(volume)
+
+    def run_ensemble(self, fls, glen_a):
+        model = ensemble_flowline.EnsembleFluxModel(fls, self.mb, y0=0.,
+                                                    glen_a=glen_a)
+        length, volume = [], []
+        for yr in self.yrs:
+            model.run_until(yr)
+            l, v, _ = model.diagnostics()
+            length.append(l)
+            volume.append(v)
+        self.assertFalse(model.failed.any())
+        self.assertFalse(model.dt_warning.any())
+        return np.array(length).T, np.array(volume).T
+
+    def test_one_member(self):
+        beds = [funcs.dummy_constant_bed, funcs.dummy_parabolic_bed,
+                funcs.dummy_trapezoidal_bed, funcs.dummy_mixed_bed,
+                funcs.dummy_width_bed_tributary]
+        for bed in beds:
+            length, volume = self.run_oggm(bed(), self.glen_a)
+            e_length, e_volume = self.run_ensemble(bed(), self.glen_a)
+            np.testing.assert_allclose(e_length[0], length,
+                                       err_msg=bed.__name__)
+            np.testing.assert_allclose(e_volume[0], volume, rtol=1e-6,
+                                       err_msg=bed.__name__)
+
+    def test_members(self):
+        # every member steps at the shortest time step of all members,
+        # i.e. the results differ slightly from the single runs
+        factors = np.array([0.5, 1, 2])
+        fls = funcs.dummy_width_bed_tributary()
+        e_length, e_volume = self.run_ensemble(fls, self.glen_a * factors)
+        for i, factor in enumerate(factors):
+            length, volume = self.run_oggm(funcs.dummy_width_bed_tributary(),
+                                           self.glen_a * factor)
+            np.testing.assert_allclose(e_length[i], length,
+                                       atol=2 * fls[-1].dx_meter)
+            np.testing.assert_allclose(e_volume[i], volume, rtol=1e-2)
+
+    def test_run_until_and_store(self):
+        model = ensemble_flowline.EnsembleFluxModel(
+            funcs.dummy_constant_bed(), self.mb, y0=0.,
+            glen_a=self.glen_a * np.array([1, 2]))
+        ds = model.run_until_and_store(20)
+        self.assertEqual(ds.length_m.shape, (2, 21))
+        self.assertFalse(ds.failed.any())
+        self.assertFalse(ds.dt_warning.any())
+        # the glacier exceeds the domain
+        mb = massbalance.LinearMassBalance(1200.)
+        model = ensemble_flowline.EnsembleFluxModel(
+            funcs.dummy_constant_bed(nx=20), mb, y0=0.,
+            glen_a=self.glen_a * np.array([1, 2]))
+        with self.assertLogs(ensemble_flowline.log, 'WARNING'):
+            ds = model.run_until_and_store(100)
+        self.assertTrue(ds.failed.all())
+        self.assertTrue(np.isnan(ds.length_m[:, -1]).all())
+
+    def test_shape_factor(self):
+        cfg.PARAMS['use_shape_factor_for_fluxbasedmodel'] = 'Huss'
+        with self.assertRaises(NotImplementedError):
+            ensemble_flowline.EnsembleFluxModel(funcs.dummy_mixed_bed(),
+                                                self.mb)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+import code.idaweb as idaweb
+
+# raw IDAWEB orders shipped with the repository
+IDAWEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, 'raw_data', 'idaweb_data')
+
+
+def read_legend_file_fwf(path, encoding='latin-1', lang='en'):
+    """ Former implementation of `idaweb.read_legend_file()`, based on
+    `pd.read_fwf`, used as reference."""
+    with open(path, encoding=encoding) as fh:
+        lines = pd.Series([line.strip() for line in fh])
+
+    start_line = lines[lines == idaweb.legend_file[lang]['station']].index[0] + 2
+    end_line = lines[lines == idaweb.legend_file[lang]['param']].index[0] - 2
+    colspecs = [(0, 10), (10, 47), (47, 64), (64, 115), (115, 140),
+                (140, 157), (157, 200)]
+    stn = pd.read_fwf(path, colspecs=colspecs, encoding=encoding, index_col=0,
+                      skiprows=lambda l: (l < start_line) or (l > end_line))
+
+    start_line = lines[lines == idaweb.legend_file[lang]['param']].index[0] + 2
+    end_line = lines.size - 2
+    colspecs = [(0, 10), (10, 47), (47, 200)]
+    param = pd.read_fwf(path, colspecs=colspecs, encoding=encoding,
+                        index_col=0,
+                        skiprows=lambda l: (l < start_line) or (l > end_line))
+    return stn, param
+
+
+class TestLegend(unittest.TestCase):
+    """ Testing the legend file parser against `pd.read_fwf`."""
+
+    def _compare(self, path, lang):
+        stn, param = idaweb.read_legend_file(path, lang=lang)
+        stn_ref, param_ref = read_legend_file_fwf(path, lang=lang)
+        pd.testing.assert_frame_equal(stn, stn_ref)
+        pd.testing.assert_frame_equal(param, param_ref)
+        return stn, param
+
+    def test_single_station(self):
+        # english order, one file per parameter, CRLF line endings
+        path = os.path.join(IDAWEB_DIR, 'order61301',
+                            'order_61301_SLFFIR_htoauths_1_legend.txt')
+        stn, param = self._compare(path, 'en')
+        self.assertEqual(list(stn.index), ['SLFFIR'])
+        self.assertEqual(list(param.index), ['htoauths'])
+
+    def test_multi_station(self):
+        # german order, all stations in one file
+        path = os.path.join(IDAWEB_DIR, 'order61305',
+                            'order_61305_legend.txt')
+        stn, param = self._compare(path, 'de')
+        self.assertEqual(len(stn), 11)
+        self.assertIn('SLFFIR', stn.index)
+        self.assertEqual(list(param.index), ['rre150d0'])
+
+
+class TestData(unittest.TestCase):
+    """ Testing the typed data reader and the incremental table update."""
+
+    def setUp(self):
+        self.order_path = os.path.join(IDAWEB_DIR, 'order61301')
+        self.path = os.path.join(self.order_path,
+                                 'order_61301_SLFFIR_rre150d0_1_data.txt')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.table_path = os.path.join(self.tmp_dir, 'daily_precip.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_data_typed(self):
+        data = idaweb.read_data_typed(self.path)
+        ref = idaweb.read_data_file(
+            self.path, date_parser=lambda x: pd.to_datetime(x,
+                                                            format='%Y%m%d'))
+        self.assertEqual(list(data.columns), ['rre150d0_SLFFIR'])
+        self.assertEqual(data.dtypes.iloc[0], np.float32)
+        np.testing.assert_array_equal(data.index.values, ref.index.values)
+        np.testing.assert_allclose(data.values, ref.values, rtol=1e-6)
+
+        # keep station column instead
+        data = idaweb.read_data_typed(self.path, drop_station=False)
+        self.assertEqual(list(data.columns), ['stn', 'rre150d0'])
+        self.assertTrue((data.stn == 'SLFFIR').all())
+
+        # unknown parameter
+        with self.assertRaises(ValueError):
+            idaweb.read_data_typed(self.path, usecols=['tre200d0'])
+
+    def test_read_data_typed_multi_station(self):
+        path = os.path.join(IDAWEB_DIR, 'order61305', 'order_61305_data.txt')
+        with self.assertRaises(ValueError):
+            idaweb.read_data_typed(path)
+
+    def test_order_periods(self):
+        periods = idaweb.order_periods(self.order_path)
+        self.assertEqual(len(periods), 3)
+        self.assertTrue((periods.station == 'SLFFIR').all())
+        self.assertEqual(sorted(periods.param),
+                         ['htoauths', 'rre024i0', 'rre150d0'])
+        row = periods.set_index('param').loc['rre150d0']
+        self.assertEqual(row.file, 'order_61301_SLFFIR_rre150d0_1_data.txt')
+        self.assertEqual(row.start, pd.Timestamp('2000-09-19'))
+        self.assertEqual(row.end, pd.Timestamp('2016-11-06'))
+        row = periods.set_index('param').loc['htoauths']
+        self.assertEqual(row.start, pd.Timestamp('1998-10-16 06:00'))
+        self.assertEqual(row.end, pd.Timestamp('2018-08-16 04:00'))
+
+    def test_order_periods_de(self):
+        periods = idaweb.order_periods(os.path.join(IDAWEB_DIR, 'order61302'))
+        self.assertEqual(len(periods), 24)
+        row = periods.set_index('file').loc['order_61302_EIG_rre150m0_1_data.txt']
+        self.assertEqual(row.station, 'EIG')
+        self.assertEqual(row.param, 'rre150m0')
+        self.assertEqual(row.start, pd.Timestamp('1908-10-01'))
+        self.assertEqual(row.end, pd.Timestamp('1952-04-01'))
+
+    def _write_table(self, end, sentinel):
+        # existing table up to the given date, with one modified value
+        full = idaweb.read_data_typed(self.path, usecols=['rre150d0'])
+        full.columns = ['SLFFIR']
+        table = full.loc[:end].astype(float)
+        table.loc[pd.Timestamp(sentinel), 'SLFFIR'] = -999.
+        table.to_csv(self.table_path)
+        return full, pd.read_csv(self.table_path, index_col=0,
+                                 parse_dates=True)
+
+    def test_update_skips_covered_files(self):
+        # the table covers the entire period of the order already
+        self._write_table('2016-11-06', '2005-01-01')
+        mtime = os.path.getmtime(self.table_path)
+        with mock.patch.object(idaweb, 'read_data_typed',
+                               wraps=idaweb.read_data_typed) as reader:
+            table = idaweb.update_station_table(self.table_path,
+                                                [self.order_path],
+                                                'rre150d0')
+        self.assertFalse(reader.called)
+        self.assertEqual(os.path.getmtime(self.table_path), mtime)
+        self.assertEqual(table.loc['2005-01-01', 'SLFFIR'], -999.)
+
+    def test_update_appends_new_rows(self):
+        full, old = self._write_table('2009-12-31', '2005-01-01')
+        table = idaweb.update_station_table(self.table_path,
+                                            [self.order_path], 'rre150d0')
+        # existing rows (and values) are kept
+        np.testing.assert_array_equal(table.loc[:'2009-12-31'].index.values,
+                                      old.index.values)
+        np.testing.assert_array_equal(table.loc[:'2009-12-31'].values,
+                                      old.values)
+        self.assertEqual(table.loc['2005-01-01', 'SLFFIR'], -999.)
+        # new rows are appended
+        new = full.loc['2010-01-01':].dropna()
+        np.testing.assert_array_equal(table.loc['2010-01-01':].index.values,
+                                      new.index.values)
+        np.testing.assert_allclose(table.loc['2010-01-01':].values,
+                                   new.values, rtol=1e-6)
+        # and stored to file
+        stored = pd.read_csv(self.table_path, index_col=0, parse_dates=True)
+        self.assertEqual(len(stored), len(table))
+
+    def test_update_mixed_languages(self):
+        # English and German orders
+        full, old = self._write_table('2009-12-31', '2005-01-01')
+        order_paths = [self.order_path,
+                       os.path.join(IDAWEB_DIR, 'order61302')]
+        table = idaweb.update_station_table(self.table_path, order_paths,
+                                            'rre150d0')
+        self.assertEqual(list(table.columns), ['SLFFIR'])
+        self.assertEqual(table.loc['2005-01-01', 'SLFFIR'], -999.)
+        self.assertGreater(table.index[-1], pd.Timestamp('2016-11-06'))
+        self.assertGreater(table.loc['2010-01-01':].SLFFIR.count(),
+                           full.loc['2010-01-01':].count().iloc[0])
+
+
+class TestArchive(unittest.TestCase):
+    """ Testing the bulk reader of the archive and its cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'archive.pkl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_list_orders(self):
+        for order in ['order10000', 'order9999', 'order61301']:
+            os.mkdir(os.path.join(self.tmp_dir, order))
+        self.assertEqual(idaweb.list_orders(self.tmp_dir),
+                         ['order9999', 'order10000', 'order61301'])
+
+    def test_empty_archive(self):
+        os.mkdir(os.path.join(self.tmp_dir, 'order61301'))
+        data = idaweb.read_archive(self.tmp_dir, cache_path=self.cache_path)
+        self.assertTrue(data.empty)
+        self.assertEqual(list(data.columns), ['station', 'param', 'time',
+                                              'value', 'order', 'unit'])
+
+    def test_cache(self):
+        archive_path = os.path.join(self.tmp_dir, 'idaweb_data')
+        shutil.copytree(IDAWEB_DIR, archive_path)
+        data = idaweb.read_archive(archive_path, cache_path=self.cache_path)
+        self.assertFalse(data.duplicated(['station', 'param', 'time']).any())
+        self.assertTrue(os.path.isfile(self.cache_path))
+
+        # read from cache, without parsing the archive
+        with mock.patch.object(idaweb.multiprocessing, 'Pool') as pool:
+            cached = idaweb.read_archive(archive_path,
+                                         cache_path=self.cache_path)
+        pool.assert_not_called()
+        pd.testing.assert_frame_equal(cached, data)
+
+        # parsed again after a file changed
+        path = os.path.join(archive_path, 'order61301',
+                            'order_61301_SLFFIR_rre150d0_1_data.txt')
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        with mock.patch.object(idaweb.pd, 'read_pickle') as read_pickle:
+            rebuilt = idaweb.read_archive(archive_path,
+                                          cache_path=self.cache_path)
+        read_pickle.assert_not_called()
+        pd.testing.assert_frame_equal(rebuilt, data)
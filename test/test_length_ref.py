@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+import code.length_ref as length_ref
+
+
+class TestLengthRef(unittest.TestCase):
+    """ Testing the reconciliation of the length records."""
+
+    def setUp(self):
+        # one true record, observed by three sources with different offsets
+        # and partially overlapping periods
+        rs = np.random.RandomState(0)
+        years = np.arange(1850, 2015)
+        self.truth = pd.Series(6000 + rs.randn(years.size).cumsum() * 10,
+                               index=years)
+        self.offsets = [0., -1500., 230.]
+        periods = [(1880, 2014), (1850, 1950), (1930, 2014)]
+        self.records = [(self.truth + c).loc[y0:y1]
+                        for c, (y0, y1) in zip(self.offsets, periods)]
+
+    def test_solve_offsets(self):
+        offsets = length_ref.solve_offsets(self.records)
+        # offsets which shift all records onto the first one
+        np.testing.assert_allclose(offsets, -np.array(self.offsets),
+                                   atol=1e-6)
+        # single record
+        np.testing.assert_array_equal(
+            length_ref.solve_offsets(self.records[:1]), [0])
+
+    def test_solve_offsets_noise(self):
+        # noisy records give the mean difference over the common years
+        rs = np.random.RandomState(1)
+        noisy = self.records[1] + rs.randn(self.records[1].size)
+        offsets = length_ref.solve_offsets([self.records[0], noisy])
+        common = self.records[0].index.intersection(noisy.index)
+        expected = (self.records[0].loc[common] - noisy.loc[common]).mean()
+        self.assertAlmostEqual(offsets[1], expected)
+        self.assertAlmostEqual(length_ref.offset_to(noisy, self.records[0]),
+                               expected)
+
+    def test_no_overlap(self):
+        records = [self.truth.loc[:1900], self.truth.loc[1950:]]
+        with self.assertRaises(ValueError):
+            length_ref.solve_offsets(records)
+        # two groups of overlapping records, which don't overlap each other
+        records = [self.truth.loc[:1880], self.truth.loc[1870:1900],
+                   self.truth.loc[1950:1980], self.truth.loc[1970:]]
+        with self.assertRaises(ValueError):
+            length_ref.solve_offsets(records)
+
+    def test_reconcile(self):
+        ref = length_ref.reconcile(self.records, absolute=self.truth)
+        np.testing.assert_allclose(ref.values, self.truth.loc[ref.index],
+                                   atol=1e-6)
+        self.assertEqual(ref.index.min(), 1850)
+        self.assertEqual(ref.index.max(), 2014)
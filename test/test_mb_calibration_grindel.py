@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import code.mb_calibration_grindel as mb_calib
+
+
+class TestCalibCache(unittest.TestCase):
+    """ Testing the keys and lookup of the calibration cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # fake climate files
+        self.files = []
+        for var in ['tmp', 'pre']:
+            path = os.path.join(self.tmp_dir, var + '.nc')
+            with open(path, 'w') as fh:
+                fh.write(var)
+            self.files.append(path)
+        self.patch = mock.patch.object(mb_calib, 'climate_files',
+                                       return_value=self.files)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_calib_params(self):
+        params = mb_calib.calib_params(1.7500000001)
+        self.assertEqual(params['prcp_scaling_factor'], 1.75)
+        self.assertEqual(params['temp_melt'], -1.75)
+        self.assertEqual(params['baseline_y0'], 1850)
+        self.assertEqual(params['baseline_climate'], 'HISTALP')
+        self.assertEqual(params['rgi_version'], '61')
+        self.assertEqual(len(params['climate_files']), 2)
+        # JSON serializable
+        self.assertEqual(json.loads(json.dumps(params)), params)
+
+        # changed climate file
+        with open(self.files[0], 'a') as fh:
+            fh.write('changed')
+        os.utime(self.files[0], (0, 0))
+        changed = mb_calib.calib_params(1.75)
+        self.assertNotEqual(changed['climate_files'][0],
+                            params['climate_files'][0])
+        self.assertEqual(changed['climate_files'][1],
+                         params['climate_files'][1])
+
+    def test_calib_key(self):
+        params = mb_calib.calib_params(1.75)
+        key = mb_calib.calib_key(params)
+        self.assertEqual(len(key), 40)
+        # independent of the key order
+        reordered = dict(reversed(list(params.items())))
+        self.assertEqual(mb_calib.calib_key(reordered), key)
+        # rounded parameters give the same key
+        self.assertEqual(mb_calib.calib_key(mb_calib.calib_params(1.75 + 1e-9)),
+                         key)
+        # all parameters enter the key
+        for kwargs in [dict(prcp_fac=1.7), dict(prcp_fac=1.75, temp_melt=-1),
+                       dict(prcp_fac=1.75, baseline_y0=1900),
+                       dict(prcp_fac=1.75, rgi_version='6')]:
+            self.assertNotEqual(
+                mb_calib.calib_key(mb_calib.calib_params(**kwargs)), key)
+
+    def test_seed_calib_cache(self):
+        legacy_dir = os.path.join(self.tmp_dir, 'ref_tstars')
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(legacy_dir)
+        path = os.path.join(legacy_dir, 'ref_tstars_prcp_1_25.csv')
+        with open(path, 'w') as fh:
+            fh.write(',tstar,bias\nRGI60-11.00002,1898,-3.7\n')
+        params = mb_calib.calib_params(1.25)
+
+        # no seeding on a cache miss
+        self.assertIsNone(mb_calib.lookup_calib(params, cache_dir=cache_dir))
+
+        # seeded with other climate files
+        entries = mb_calib.seed_calib_cache(legacy_dir, ['abc', 'def'],
+                                            cache_dir=cache_dir)
+        self.assertEqual(list(entries), [1.25])
+        self.assertIsNone(mb_calib.lookup_calib(params, cache_dir=cache_dir))
+
+        # seeded with the current climate files
+        entries = mb_calib.seed_calib_cache(legacy_dir,
+                                            params['climate_files'],
+                                            cache_dir=cache_dir)
+        entry = mb_calib.lookup_calib(params, cache_dir=cache_dir)
+        self.assertEqual(entry, entries[1.25])
+        with open(os.path.join(entry, 'ref_tstars.csv')) as fh:
+            self.assertIn('1898', fh.read())
+        with open(os.path.join(entry, 'mb_calib_params.json')) as fh:
+            mb_calib_params = json.load(fh)
+        self.assertEqual(mb_calib_params['prcp_scaling_factor'], 1.25)
+        self.assertEqual(mb_calib_params['temp_melt'], -1.75)
+        self.assertEqual(len(mb_calib_params), 5)
+        # other parameters are not seeded
+        params = mb_calib.calib_params(1.25, temp_melt=-1)
+        self.assertIsNone(mb_calib.lookup_calib(params, cache_dir=cache_dir))
+
+        # never from the output directory of the batch calibration
+        with self.assertRaises(ValueError):
+            mb_calib.seed_calib_cache(mb_calib.OUT_DIR, ['abc', 'def'],
+                                      cache_dir=cache_dir)
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy as np
+
+# oggm modules
+from oggm import cfg
+from oggm.core import massbalance
+
+import code.mb_table as mb_table
+
+
+class GlacierDirectory(object):
+    """ Minimal glacier directory, with a synthetic monthly climate file
+    and a mu* calibration."""
+
+    def __init__(self, path, y0=1951, y1=1960):
+        self.rgi_id = 'RGI60-11.01270'
+        self.dir = path
+        self.mustar = {'mu_star_glacierwide': 200., 'bias': 50.,
+                       'mu_star_allsame': True}
+        # monthly climate with seasonal cycle and some noise
+        rng = np.random.RandomState(0)
+        nt = (y1 - y0 + 1) * 12
+        month = np.arange(nt) % 12
+        temp = -5 * np.cos(2 * np.pi * (month - 3) / 12) + rng.randn(nt)
+        prcp = 100 + 50 * rng.rand(nt)
+        with netCDF4.Dataset(self.get_filepath('climate_monthly'), 'w') as nc:
+            nc.ref_hgt = 2000.
+            nc.createDimension('time', None)
+            time = nc.createVariable('time', 'i4', ('time',))
+            time.units = 'days since {}-10-01'.format(y0 - 1)
+            time[:] = [i * 365 / 12 for i in range(nt)]
+            nc.createVariable('temp', 'f4', ('time',))[:] = temp
+            nc.createVariable('prcp', 'f4', ('time',))[:] = prcp
+
+    def get_filepath(self, filename, filesuffix=''):
+        return os.path.join(self.dir, filename + filesuffix + '.nc')
+
+    def read_json(self, filename):
+        return self.mustar
+
+    def read_pickle(self, filename):
+        return {'mb_calib_params': {}}
+
+
+class TestMbTable(unittest.TestCase):
+
+    def setUp(self):
+        cfg.initialize()
+        mb_table._tables.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gdir = GlacierDirectory(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_annual_mb(self):
+        mb_ref = massbalance.PastMassBalance(self.gdir)
+        mb_tab = mb_table.get_tabulated_mb(self.gdir)
+        np.testing.assert_array_equal(mb_tab.years, np.arange(1951, 1961))
+        # arbitrary heights, between the grid points of the table
+        heights = np.random.RandomState(1).uniform(1000, 4000, 50)
+        for year in [1951, 1955.5, 1960]:
+            ref = mb_ref.get_annual_mb(heights, year=year)
+            np.testing.assert_allclose(mb_tab.get_annual_mb(heights,
+                                                            year=year),
+                                       ref, atol=1e-3 * np.abs(ref).max())
+        with self.assertRaises(ValueError):
+            mb_tab.get_annual_mb(heights, year=1961)
+
+    def test_cache(self):
+        mb_tab = mb_table.get_tabulated_mb(self.gdir)
+        self.assertIs(mb_table.get_tabulated_mb(self.gdir), mb_tab)
+        # new table for other mass balance parameters
+        temp_melt = cfg.PARAMS['temp_melt']
+        cfg.PARAMS['temp_melt'] = temp_melt + 0.5
+        self.assertIsNot(mb_table.get_tabulated_mb(self.gdir), mb_tab)
+        cfg.PARAMS['temp_melt'] = temp_melt
+        self.assertIs(mb_table.get_tabulated_mb(self.gdir), mb_tab)
+        # ... or a new climate file
+        fpath = self.gdir.get_filepath('climate_monthly')
+        stat = os.stat(fpath)
+        os.utime(fpath, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNot(mb_table.get_tabulated_mb(self.gdir), mb_tab)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+import code.skill as skill
+
+
+class TestSkill(unittest.TestCase):
+    """ Testing the vectorized skill scores against pandas."""
+
+    def setUp(self):
+        # random length records with some missing values
+        rs = np.random.RandomState(0)
+        self.years = np.arange(1880, 2015)
+        self.lengths = 6000 + rs.randn(4, self.years.size).cumsum(axis=1) * 10
+        self.lengths[1, -20:] = np.nan
+        self.ref_years = np.arange(1850, 2010)
+        self.ref = 6000 + rs.randn(self.ref_years.size).cumsum() * 10
+        self.ref[::3] = np.nan
+
+    def test_score(self):
+        scores = skill.score(self.lengths, self.years,
+                             self.ref, self.ref_years, y0=1894)
+        ref = pd.Series(self.ref, index=self.ref_years, name='ref')
+        for i, length in enumerate(self.lengths):
+            # compute scores the pandas way, as in glen_a
+            mod = pd.Series(length, index=self.years, name='model')
+            control = pd.concat([ref, mod], axis=1).loc[1894:]
+            corr = control.corr().iloc[0, 1]
+            d = control.model - control.ref
+            rmsd = np.sqrt(np.mean(d ** 2))
+            d = ((control.model - np.mean(control.model)) -
+                 (control.ref - np.mean(control.ref)))
+            rmsd_bc = np.sqrt(np.mean(d ** 2))
+            amp = control.max() - control.min()
+            amp_diff = amp.diff().iloc[-1]
+            np.testing.assert_allclose(scores.iloc[i].values,
+                                       [corr, rmsd, rmsd_bc, rmsd_bc,
+                                        amp_diff])
+
+    def test_no_overlap(self):
+        scores = skill.score(self.lengths, self.years,
+                             self.ref, self.ref_years, y0=2012)
+        self.assertTrue(scores[['corr', 'rmsd', 'rmsd_bc']].isnull().all().all())
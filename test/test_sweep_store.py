@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from code.sweep_store import SweepStore
+
+
+class TestSweepStore(unittest.TestCase):
+    """ Testing the persistent store of the parameter sweeps."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'sweep.sqlite')
+        self.glen_a_factors = np.array([0.1, 0.5, 1, 2, 10])
+        self.df = pd.DataFrame(np.arange(20.).reshape(5, 4),
+                               index=self.glen_a_factors,
+                               columns=['corr', 'rmsd', 'rmsd_bc', 'amp_diff'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume(self):
+        prcp_fac = np.linspace(1, 1.75, 4)[1]
+        with SweepStore(self.path) as store:
+            self.assertFalse(store.done(1935, prcp_fac, self.glen_a_factors))
+            store.add(1935, prcp_fac, self.df)
+        # reopen store, as after a restart
+        with SweepStore(self.path) as store:
+            self.assertTrue(store.done(1935, prcp_fac, self.glen_a_factors))
+            self.assertFalse(store.done(1935, prcp_fac, [20]))
+            self.assertFalse(store.done(1940, prcp_fac, self.glen_a_factors))
+            self.assertEqual(len(store.to_dataframe()), 5)
+
+    def test_get(self):
+        with SweepStore(self.path) as store:
+            store.add(1935, 1.25, self.df)
+            pd.testing.assert_series_equal(store.get(1935, 1.25, 0.5),
+                                           self.df.loc[0.5],
+                                           check_names=False)
+            self.assertIsNone(store.get(1935, 1.25, 20))
+
+    def test_fill_dataset(self):
+        prcp_factors = np.linspace(1, 1.75, 4)
+        ds = xr.Dataset()
+        ds.coords['t_star'] = ('t_star', [1935, 1940])
+        ds.coords['prcp_fac'] = ('prcp_fac', prcp_factors)
+        ds.coords['glen_a_fac'] = ('glen_a_fac', self.glen_a_factors)
+        dims = ['glen_a_fac', 'prcp_fac', 't_star']
+        for var in self.df.columns:
+            ds[var] = (dims, np.zeros((5, 4, 2)) * np.NaN)
+        with SweepStore(self.path) as store:
+            store.add(1940, prcp_factors[2], self.df)
+            store.fill_dataset(ds)
+        cell = ds.sel(t_star=1940, prcp_fac=prcp_factors[2])
+        np.testing.assert_allclose(cell.rmsd.values, self.df.rmsd.values)
+        self.assertEqual(int(ds.rmsd.notnull().sum()), 5)
@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+import numpy as np
+
+# oggm modules
+from oggm import cfg
+
+import code.t_star_scan as t_star_scan
+
+
+class TestScanTStar(unittest.TestCase):
+    """ Comparing the vectorized scan with the window means of
+    `local_t_star`, on a synthetic yearly climate."""
+
+    def setUp(self):
+        cfg.initialize()
+        rng = np.random.RandomState(0)
+        self.years = np.arange(1802, 2004)
+        self.temp = 100 + 50 * rng.rand(self.years.size)
+        self.prcp = 1000 + 500 * rng.rand(self.years.size)
+        self.patch = mock.patch.object(
+            t_star_scan.climate, 'mb_yearly_climate_on_glacier',
+            side_effect=lambda gdir: (self.years, self.temp, self.prcp))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def window(self, t_star):
+        mu_hp = int(cfg.PARAMS['mu_star_halfperiod'])
+        ok = np.abs(self.years - t_star) <= mu_hp
+        return self.temp[ok].mean(), self.prcp[ok].mean()
+
+    def test_scan(self):
+        df = t_star_scan.scan_t_star(None)
+        self.assertEqual(df.index[0], 1802 + 15)
+        self.assertEqual(df.index[-1], 2003 - 15)
+        for t_star in [1817, 1900, 1988]:
+            temp, prcp = self.window(t_star)
+            np.testing.assert_allclose(df.temp_melt[t_star], temp)
+            np.testing.assert_allclose(df.prcp_solid[t_star], prcp)
+            np.testing.assert_allclose(df.mu_star[t_star], prcp / temp)
+        np.testing.assert_allclose(df.mb_window, 0, atol=1e-9)
+        self.assertTrue(df.valid.all())
+
+        # bounds
+        cfg.PARAMS['max_mu_star'] = df.mu_star.median()
+        df_max = t_star_scan.scan_t_star(None)
+        np.testing.assert_array_equal(df_max.valid,
+                                      df.mu_star <= df.mu_star.median())
+
+        # candidates without complete window
+        df = t_star_scan.scan_t_star(None, t_stars=[1810, 1900])
+        self.assertFalse(df.valid[1810])
+        self.assertTrue(df.valid[1900])
+
+    def test_clip_mu_star(self):
+        # negative mu* (synthetic negative solid precipitation)
+        self.prcp[:] = -self.prcp
+        df = t_star_scan.scan_t_star(None)
+        self.assertTrue((df.mu_star < 0).all())
+        self.assertFalse(df.valid.any())
+
+        cfg.PARAMS['clip_mu_star'] = True
+        cfg.PARAMS['min_mu_star'] = 0.
+        df = t_star_scan.scan_t_star(None)
+        np.testing.assert_array_equal(df.mu_star, 0)
+        np.testing.assert_allclose(df.mb_window, df.prcp_solid)
+        self.assertTrue(df.valid.all())
+
+    def test_write_local_mustar(self):
+        gdir = mock.MagicMock(rgi_id='RGI60-11.01270')
+        gdir.read_pickle.return_value = {'baseline_hydro_yr_0': 1802}
+        t_star_scan.write_local_mustar(gdir, 1900, np.float64(250.5))
+        ci, fn = gdir.write_pickle.call_args[0]
+        self.assertEqual(fn, 'climate_info')
+        self.assertEqual(ci['baseline_hydro_yr_0'], 1802)
+        self.assertEqual(ci['mb_calib_params']['temp_melt'],
+                         cfg.PARAMS['temp_melt'])
+        gdir.write_json.assert_called_once_with(
+            {'rgi_id': 'RGI60-11.01270', 't_star': 1900, 'bias': 0.,
+             'mu_star_glacierwide': 250.5}, 'local_mustar')
+
+
+if __name__ == '__main__':
+    unittest.main()
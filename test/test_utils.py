@@ -1,5 +1,10 @@
+import os
+import shutil
+import tempfile
 import unittest
 import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
 
 import code.utils as utils
 
@@ -8,10 +13,59 @@ class TestGrindelUtils(unittest.TestCase):
     """ Testing the utility methods for the Grindelwald project."""
 
     def test_rgi_finder(self):
-        raise NotImplementedError
+        # build a small region index by hand
+        index_dir = tempfile.mkdtemp()
+        try:
+            rids = ['RGI60-11.01270', 'RGI60-11.01328', 'RGI60-11.03887']
+            rgi_df = gpd.GeoDataFrame({'RGIId': rids,
+                                       'Area': [9.1, 17.2, 1.9]},
+                                      geometry=[Point(8.1, 46.6),
+                                                Point(8.0, 46.6),
+                                                Point(11.9, 46.4)],
+                                      index=rids)
+            rgi_df.to_parquet(utils.rgi_index_path('60', '11', index_dir))
+            utils._rgi_index.clear()
+
+            # single and batch lookups, in the given order
+            df = utils.rgi_finder(['11.01328', '11.01270'],
+                                  index_dir=index_dir)
+            self.assertEqual(list(df.index), rids[1::-1])
+            self.assertEqual(list(df.Area), [17.2, 9.1])
+            self.assertNotIn('RGIId', df.columns)
+
+            # unknown glaciers
+            with self.assertRaises(RuntimeError):
+                utils.rgi_finder(['11.99999'], index_dir=index_dir)
+
+            # the RGI version is inferred from the RGI IDs
+            df = utils.get_rgi_entities(rids[::-1], index_dir=index_dir)
+            self.assertEqual(list(df.RGIId), rids[::-1])
+        finally:
+            utils._rgi_index.clear()
+            shutil.rmtree(index_dir)
 
     def test_convert_to_wgs84(self):
-        raise NotImplementedError
+        # Jungfraujoch and Grindelwald First, in Swiss LV03 coordinates
+        # (IDAWEB gives lon/lat 7°59'/46°33' and 8°04'/46°40')
+        lon, lat = utils.convert_to_wgs84(641930, 155275, 21781)
+        self.assertAlmostEqual(lon, 7 + 59 / 60, delta=0.01)
+        self.assertAlmostEqual(lat, 46 + 33 / 60, delta=0.01)
+
+        # array version gives the same results
+        lons, lats = utils.transform_coords([641930, 647900],
+                                            [155275, 168780], 21781)
+        self.assertEqual(lons.shape, (2,))
+        self.assertAlmostEqual(lons[0], lon)
+        self.assertAlmostEqual(lats[0], lat)
+        self.assertAlmostEqual(lons[1], 8 + 4 / 60, delta=0.01)
+        self.assertAlmostEqual(lats[1], 46 + 40 / 60, delta=0.01)
+
+        # station table
+        stations = pd.DataFrame({'Coordinates [km]': ['641930/155275']},
+                                index=['JUN'])
+        coords = utils.stations_to_wgs84(stations)
+        self.assertAlmostEqual(coords.loc['JUN', 'lon'], lon)
+        self.assertAlmostEqual(coords.loc['JUN', 'lat'], lat)
 
     def test_leclerq_length(self):
         # test with Oberen Grindelwald Gletscher
@@ -30,5 +84,24 @@ class TestGrindelUtils(unittest.TestCase):
         except RuntimeError as e:
             e.args[0] == 'No length data found for this glacier!'
 
+    def test_leclerq_lengths(self):
+        # Oberer Grindelwald, Marmolada (no records) and Grosser Aletsch
+        rgi_ids = ['11.01270', '11.03887', '11.01450']
+        lengths = utils.get_leclercq_lengths(rgi_ids)
+        self.assertEqual(sorted(lengths), ['11.01270', '11.01450'])
+
+        # same records as for the single glacier routine
+        length_grindel = pd.read_csv('length_grindel.csv', index_col=0)
+        pd.testing.assert_frame_equal(lengths['11.01270'], length_grindel,
+                                      check_dtype=False)
+        length_aletsch = utils.get_leclercq_length('11.01450')
+        pd.testing.assert_frame_equal(lengths['11.01450'], length_aletsch)
+        self.assertFalse(length_aletsch.equals(lengths['11.01270']))
+
+        # reading again works as well
+        lengths = utils.get_leclercq_lengths(rgi_ids)
+        pd.testing.assert_frame_equal(lengths['11.01270'], length_grindel,
+                                      check_dtype=False)
+
     def test_rmsd_anomaly(self):
         raise NotImplementedError